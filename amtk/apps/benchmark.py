@@ -0,0 +1,391 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import collections
+from amtk.utils import (
+    messages, options, builtins, misc, time, formats, writers, synthetic,
+    stats, profiler, codec
+)
+from amtk.apps import record, play, merge
+
+
+# The tools whose startup is measured.
+TOOLS = ('play', 'record', 'merge', 'convert', 'index', 'generate')
+
+# Starts a tool and prints its help.
+LAUNCH = ('import sys; sys.argv = [\'amtk.%s\', \'--help\']; '
+          'from amtk.apps import %s; %s.main()')
+
+# pika and multiprocessing are only imported once a benchmark runs.
+pika = misc.Lazy('pika')
+multiprocessing = misc.Lazy('multiprocessing')
+
+
+class Channel(object):
+    '''
+    Stands in for a channel. Publishes are counted and go nowhere.
+    '''
+    def __init__(self):
+        self.published = 0
+
+    def basic_publish(self, **kwargs):
+        self.published += 1
+
+    def basic_ack(self, **kwargs):
+        pass
+
+    def basic_nack(self, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+class Connection(object):
+    '''
+    Stands in for a connection.
+    '''
+    def close(self):
+        pass
+
+
+class Sink(object):
+    '''
+    Stands in for an output file, in text or binary mode. What is written is
+    counted and dropped.
+    '''
+    def __init__(self):
+        self.size = 0
+
+    @property
+    def buffer(self):
+        return self
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@contextlib.contextmanager
+def standins(channel, output):
+    '''
+    Points the tools at a stand-in channel and output while the block runs.
+    Errors that the tools print are dropped.
+    '''
+    saved = messages.connect, builtins.stdout, builtins.print_error
+    messages.connect = lambda args: (Connection(), channel)
+    builtins.stdout = lambda: output
+    builtins.print_error = lambda target: None
+
+    try:
+        yield
+
+    finally:
+        messages.connect, builtins.stdout, builtins.print_error = saved
+
+
+def generate(settings):
+    '''
+    Returns the data of the synthetic messages.
+    '''
+    return synthetic.recording(
+        settings.messages, settings.body_size, settings.headers
+    )
+
+
+def save(settings, path, number=0, count=1):
+    '''
+    Writes every count-th synthetic message, from number, to a recording.
+    Returns the recording opened for reading, as it is on the command line.
+    '''
+    format = formats.get(settings.format)
+    with open(path, 'w' + format.mode) as file:
+        format.header(file)
+        for position, data in enumerate(generate(settings)):
+            if position % count == number:
+                format.write(file, format.dumps(data))
+
+    return open(path, 'r')
+
+
+def deliveries(settings):
+    '''
+    Returns the synthetic messages as they are delivered by pika.
+    '''
+    result = []
+    for number, data in enumerate(generate(settings)):
+        method = pika.spec.Basic.Deliver(
+            delivery_tag=number + 1,
+            exchange=data['exchange'],
+            routing_key=data['routing_key'],
+        )
+        created = time.parse(data['creation_time'])
+        properties = pika.spec.BasicProperties(
+            content_type=data['content_type'],
+            content_encoding=data['content_encoding'],
+            headers=data['headers'],
+            message_id=data['message_id'],
+            timestamp=time.timestamp(created),
+        )
+        result.append((method, properties, data['body'].encode('utf-8')))
+
+    return result
+
+
+def record_write(settings, directory):
+    '''
+    Records messages to an output that discards them. Returns the number of
+    messages, the bytes written and the seconds taken.
+    '''
+    format = formats.get(settings.format)
+    sink = Sink()
+    args = argparse.Namespace(
+        format=settings.format,
+        output=writers.Buffered(format.stream(sink)),
+        index=None,
+        acks=None,
+        writer=None,
+        segments=None,
+        meter=stats.Silent(),
+    )
+    channel = Channel()
+    inputs = deliveries(settings)
+
+    start = profiler.clock()
+    for method, properties, body in inputs:
+        record.write(args, channel, method, properties, body)
+    seconds = profiler.clock() - start
+
+    return len(inputs), sink.size, seconds
+
+
+def play_publish(settings, directory):
+    '''
+    Publishes encoded records to a stand-in channel. Returns the number of
+    messages, the bytes published and the seconds taken.
+    '''
+    format = formats.get(settings.format)
+    args = argparse.Namespace(
+        format=settings.format,
+        timing='none',
+        exchange=synthetic.EXCHANGE,
+        routing_key=None,
+        mandatory='no',
+        immediate='no',
+        meter=stats.Silent(),
+    )
+    channel = Channel()
+    lines = [format.dumps(data) for data in generate(settings)]
+
+    start = profiler.clock()
+    last = None
+    for line in lines:
+        last = play.publish(last, play.wait_none, args, channel, line)
+    seconds = profiler.clock() - start
+
+    return channel.published, sum(len(line) for line in lines), seconds
+
+
+def play_play(settings, directory):
+    '''
+    Plays a recording to a stand-in channel. Returns the number of messages,
+    the bytes read and the seconds taken.
+    '''
+    path = os.path.join(directory, 'play')
+    args = argparse.Namespace(
+        input=save(settings, path),
+        format=settings.format,
+        compress='none',
+        workers=1,
+        start=None,
+        end=None,
+        timing='none',
+        speed=1.0,
+        max_gap=None,
+        rate=None,
+        confirm=0,
+        exchange=synthetic.EXCHANGE,
+        routing_key=None,
+        mandatory='no',
+        immediate='no',
+        stats=0,
+        stats_format='text',
+    )
+    channel = Channel()
+
+    start = profiler.clock()
+    with standins(channel, Sink()):
+        play.play(args)
+    seconds = profiler.clock() - start
+
+    args.input.close()
+    return channel.published, os.path.getsize(path), seconds
+
+
+def merge_merge(settings, directory):
+    '''
+    Merges recordings into an output that discards them. Returns the number
+    of messages, the bytes written and the seconds taken.
+    '''
+    count = max(settings.files, 1)
+    files = [
+        save(settings, os.path.join(directory, 'merge.%d' % number), number,
+             count)
+        for number in range(count)
+    ]
+    args = argparse.Namespace(
+        files=files,
+        format=settings.format,
+        order='record',
+        engine=settings.engine,
+        memory_limit=256,
+        dedup='exact',
+        dedup_expected=settings.messages,
+        passthrough=settings.passthrough,
+        compress='none',
+        start=None,
+        end=None,
+        stats=0,
+        stats_format='text',
+    )
+    sink = Sink()
+
+    start = profiler.clock()
+    with standins(Channel(), sink):
+        merge.merge(args)
+    seconds = profiler.clock() - start
+
+    for file in args.files:
+        file.close()
+    return settings.messages, sink.size, seconds
+
+
+def startup(settings, directory):
+    '''
+    Starts each tool to print its help, launches times, in a new python
+    process. Returns the number of launches, no bytes and the seconds taken.
+    '''
+    # Start the tools from this copy of the package.
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)
+    )))
+
+    count = 0
+    start = profiler.clock()
+    with open(os.devnull, 'w') as output:
+        for run in range(settings.launches):
+            for tool in TOOLS:
+                command = [sys.executable, '-c', LAUNCH % ((tool, ) * 3)]
+                subprocess.check_call(command, stdout=output, cwd=root)
+                count += 1
+    seconds = profiler.clock() - start
+
+    return count, 0, seconds
+
+
+# The available benchmarks, in the order they are run.
+BENCHMARKS = collections.OrderedDict((
+    ('record.write', record_write),
+    ('play.publish', play_publish),
+    ('play.play', play_play),
+    ('merge.merge', merge_merge),
+    ('startup', startup),
+))
+
+
+def measure(name, settings):
+    '''
+    Runs a benchmark and returns its result. The peak memory is that of the
+    whole process, so benchmarks are run in their own process; see isolated.
+    For startup, messages are launches.
+    '''
+    codec.use(settings.codec)
+    directory = tempfile.mkdtemp()
+    try:
+        count, size, seconds = BENCHMARKS[name](settings, directory)
+    finally:
+        shutil.rmtree(directory)
+
+    rate = stats.Stats.rate
+    return {
+        'benchmark': name,
+        'label': settings.label,
+        'python': platform.python_version(),
+        'format': settings.format,
+        'codec': settings.codec,
+        'body_size': settings.body_size,
+        'headers': settings.headers,
+        'messages': count,
+        'bytes': size,
+        'seconds': seconds,
+        'message_rate': rate(count, seconds),
+        'byte_rate': rate(size, seconds),
+        'peak_memory': profiler.memory(),
+    }
+
+
+def isolated(name, settings):
+    '''
+    Runs a benchmark in a new process, so that its peak memory is its own.
+    Returns the result.
+    '''
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(measure, (name, settings))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def benchmark(args):
+    '''
+    Runs the benchmarks and prints each result as a line of json.
+    '''
+    names = args.only or list(BENCHMARKS)
+    for name in names:
+        for run in range(args.repeat):
+            result = isolated(name, args)
+            result['run'] = run
+            builtins.print_text(json.dumps(result, sort_keys=True))
+
+
+def main():
+    '''
+    Application entry point.
+    '''
+    # Parse the command line arguments.
+    description = ('Measures the throughput of record, play and merge on '
+                   'synthetic recordings, using stand-ins for rabbitmq and '
+                   'the output. Each result is printed as a line of json, '
+                   'with the message and byte rates and the peak memory of '
+                   'the process that ran the benchmark.')
+    parameters = (
+        options.benchmark,
+        options.engine,
+        options.passthrough,
+        options.format,
+        options.codec,
+        options.version,
+    )
+    args = options.parse(description, parameters).parse_args()
+
+    # Run the benchmarks.
+    benchmark(args)
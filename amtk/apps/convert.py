@@ -0,0 +1,55 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from amtk.utils import options, builtins, formats, compress, codec
+
+
+def convert(args):
+    '''
+    Converts a recording from one format to another.
+    '''
+    # Get the formats. With auto, each file is checked for compression.
+    source = formats.get(args.format)
+    target = formats.get(args.to)
+    args.input = compress.input(args.input, args.compress)
+    file = compress.output(args.output, args.compress)
+    input = source.stream(args.input)
+    output = target.stream(file)
+    target.header(output)
+
+    for record in source.read(input):
+        try:
+            # Decode the data.
+            data = source.loads(record)
+
+        except ValueError:
+            builtins.print_error('Invalid message: %r' % record)
+            continue
+
+        target.write(output, target.dumps(data))
+
+    output.flush()
+    file.close()
+
+
+def main():
+    '''
+    Application entry point.
+    '''
+    # Parse the command line arguments.
+    description = ('Converts a recording between the jsonl and binary '
+                   'formats. Messages that cannot be parsed are ignored.')
+    parameters = (
+        options.format,
+        options.codec,
+        options.convert,
+        options.compress,
+        options.input,
+        options.output,
+        options.version,
+    )
+    args = options.parse(description, parameters).parse_args()
+    codec.use(args.codec)
+
+    # Convert the recording.
+    convert(args)
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from amtk.utils import options, formats, compress, seek, synthetic
+
+
+def generate(args):
+    '''
+    Writes a synthetic recording.
+    '''
+    if args.rate <= 0:
+        raise ValueError('Rate must be a positive number.')
+    if args.burst < 1:
+        raise ValueError('Bursts must have at least one message.')
+
+    generator = synthetic.Generator(
+        args.messages,
+        args.rate,
+        args.arrival,
+        args.burst,
+        args.body_size,
+        args.body_distribution,
+        args.routing_keys,
+        args.header,
+        args.exchange,
+        seek.moment(args.start),
+        args.seed,
+    )
+
+    # Get the output. Binary recordings are written to the underlying byte
+    # stream.
+    format = formats.get(args.format)
+    file = compress.output(args.output, args.compress)
+    output = format.stream(file)
+    format.header(output)
+
+    # jsonl lines are rendered a batch at a time; binary records are encoded
+    # one at a time.
+    if format is formats.Jsonl:
+        for lines in generator.lines():
+            output.write(lines)
+    else:
+        for data in generator.messages():
+            format.write(output, format.dumps(data))
+
+    output.flush()
+    file.close()
+
+
+def main():
+    '''
+    Application entry point.
+    '''
+    # Parse the command line arguments.
+    description = ('Writes a synthetic recording that can be played like any '
+                   'other, for capacity tests that need more messages than '
+                   'have been recorded.')
+    parameters = (
+        options.generate,
+        options.format,
+        options.compress,
+        options.output,
+        options.version,
+    )
+    args = options.parse(description, parameters).parse_args()
+
+    # Generate the recording.
+    generate(args)
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from amtk.utils import options, builtins, formats, compress, seek
+
+
+def index(args):
+    '''
+    Writes a time index next to each recording.
+    '''
+    format = formats.get(args.format)
+
+    for file in args.files:
+        # Indexes are kept next to the recording.
+        if seek.path(file) is None:
+            builtins.print_error('Only recording files can be indexed.')
+            continue
+
+        try:
+            # Read the recording.
+            source = compress.input(file, args.compress)
+            entries = seek.build(format, source, args.index_every)
+
+        except ValueError as error:
+            builtins.print_error('Cannot index %s: %s' % (file.name, error))
+            continue
+
+        seek.save(file, entries)
+
+
+def main():
+    '''
+    Application entry point.
+    '''
+    # Parse the command line arguments.
+    description = ('Writes a time index next to each recording, so that play '
+                   'and merge can seek to --start. Recordings must be in '
+                   'record order, as they are when written by record.')
+    parameters = (
+        options.files,
+        options.index(default=1000),
+        options.format,
+        options.compress,
+        options.version,
+    )
+    args = options.parse(description, parameters).parse_args()
+
+    # Index the recordings.
+    index(args)
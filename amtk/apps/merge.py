@@ -1,65 +1,319 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import json
-import dateutil.parser
-from amtk.utils import options, builtins, misc
+import heapq
+import tempfile
+from amtk.utils import (
+    options, builtins, misc, time, dedup, formats, compress, seek, stats,
+    profiler, codec
+)
 
 
-def merge(args):
+# Maps the order parameter to the field used to order messages.
+ORDER = {
+    'record': 'record_time',
+    'created': 'creation_time',
+}
+
+# An estimate of the memory used by each message held in a run, on top of the
+# encoded record itself.
+OVERHEAD = 128
+
+# The most runs the external merge reads at once, so that it stays well
+# within the limit on open files however many runs there are.
+FAN_IN = 64
+
+
+def read(format, file, key, start=None, end=None, meter=None):
     '''
-    Merges and prints messages.
+    Reads messages from a file. Yields (date, id, data, record) tuples for
+    each message that can be parsed, is dated and has a message id, where
+    record is the message as it was read. Only messages recorded from start
+    up to end are read, if either is given. Messages that cannot be parsed
+    are counted by meter, if given.
     '''
-    # The content of the merged dataset. This dictionary contains a map
-    # between the message ids and the data object.
-    content = {}
+    parser = misc.optional(time.parse)
 
-    # This dictionary contains a map between the ordering date and a list of
-    # message ids that correspond to that date.
-    dates = {}
+    records = seek.window(format, file, start, end)
+    for record in profiler.timed('read', records):
+        try:
+            # Parse the data.
+            with profiler.stage('decode'):
+                data = format.loads(record)
 
-    # Get the order parameters.
-    parser = misc.optional(dateutil.parser.parse)
-    map = {
-        'record': 'record_time',
-        'created': 'creation_time',
-    }
-    key = map[args.order]
+        except ValueError:
+            if meter is not None:
+                meter.skip()
+            continue
 
-    # Read the data from the files.
-    for file in args.files:
-        for line in file.readlines():
-            try:
-                # Parse the data.
-                data = json.loads(line)
+        # Ignore any undated lines.
+        with profiler.stage('parse'):
+            date = parser(data[key])
+        if date is None:
+            continue
 
-            except ValueError:
-                continue
+        # Ignore any lines that cannot be merged.
+        id = data['message_id']
+        if id is None:
+            continue
 
-            # Ignore any undated lines.
-            date = parser(data[key])
-            if date is None:
-                continue
+        yield date, id, data, record
+
+
+def serialise(format, data, record, passthrough):
+    '''
+    Returns the record to write for a message. With passthrough, that's the
+    record as it was read; otherwise the message is encoded again.
+    '''
+    with profiler.stage('serialise'):
+        if passthrough:
+            return format.original(record)
+
+        return format.dumps(data)
 
+
+def memory(args, key, index):
+    '''
+    Loads every message into memory and sorts them. Yields the merged
+    records.
+    '''
+    # This dictionary contains a map between the ordering date and a list of
+    # records that correspond to that date.
+    format = formats.get(args.format)
+    passthrough = args.passthrough == 'yes'
+    dates = {}
+
+    # Read the data from the files.
+    for file in args.files:
+        messages = read(format, file, key, args.start, args.end, args.meter)
+        for date, id, data, record in messages:
             # Ignore existing data.
-            id = data['message_id']
-            if id is None or id in content:
+            if not index.add(id):
                 continue
 
-            # Store the line. To ensure that content is properly formatted,
-            # it is re-encoded using json.
-            content[id] = json.dumps(data)
-
-            # Store the order.
+            # Store the record.
+            record = serialise(format, data, record, passthrough)
             dates.setdefault(date, [])
-            dates[date].append(id)
+            dates[date].append(record)
 
-    # Print the content in order.
+    # Yield the content in order.
     order = sorted(dates.keys())
     for date in order:
-        # Print each message at that date.
-        for id in dates[date]:
-            builtins.print_text(content[id])
+        # Yield each message at that date.
+        for record in dates[date]:
+            yield record
+
+
+def combine(format, files, key, index, start=None, end=None, meter=None,
+            passthrough=False):
+    '''
+    Merges files that are already in order without loading them into memory.
+    Only one message per file is held at a time. Yields the merged records;
+    see serialise for passthrough. Duplicates are only dropped if an index
+    is given. Raises a ValueError if a file is not in order.
+    '''
+    def tagged(number, file):
+        # Ties are broken by file and then by position in the file, so that
+        # the data itself is never compared.
+        messages = read(format, file, key, start, end, meter)
+        last = None
+        for position, (date, id, data, record) in enumerate(messages):
+            if last is not None and date < last:
+                message = ('Message %d of file %d is out of order. Use '
+                           '--engine memory or external for unsorted files.')
+                raise ValueError(message % (position + 1, number + 1))
+            last = date
+
+            yield date, number, position, id, data, record
+
+    # Merge the files.
+    streams = [tagged(number, file) for number, file in enumerate(files)]
+    for date, number, position, id, data, record in heapq.merge(*streams):
+        # Ignore existing data.
+        if index is not None and not index.add(id):
+            continue
+
+        yield serialise(format, data, record, passthrough)
+
+
+def stream(args, key, index):
+    '''
+    Merges files that are already in order, such as recordings ordered by
+    record time. Yields the merged records. Files are read together, so of
+    the copies of a message, the earliest is kept rather than the first
+    read.
+    '''
+    format = formats.get(args.format)
+    return combine(
+        format, args.files, key, index, args.start, args.end, args.meter,
+        args.passthrough == 'yes',
+    )
+
+
+def spill(format, run):
+    '''
+    Sorts a run of (date, record) tuples and writes it to a temporary file.
+    The file is returned ready to be read.
+    '''
+    # The sort is stable, so messages at the same date stay in file order.
+    run.sort(key=lambda item: item[0])
+
+    result = tempfile.TemporaryFile('w+' + format.mode)
+    format.header(result)
+    for date, record in run:
+        format.write(result, record)
+    result.seek(0)
+
+    return result
+
+
+def collect(format, runs, key):
+    '''
+    Merges sorted runs into a single run and closes them. Every message is
+    kept. The run is returned ready to be read.
+    '''
+    result = tempfile.TemporaryFile('w+' + format.mode)
+    format.header(result)
+    try:
+        for record in combine(format, runs, key, None, passthrough=True):
+            format.write(result, record)
+    finally:
+        for file in runs:
+            file.close()
+    result.seek(0)
+
+    return result
+
+
+def external(args, key, index):
+    '''
+    Merges files in any order using a bounded amount of memory. Messages are
+    collected into runs that fit within the memory limit, each run is sorted
+    and spilled to a temporary file, and the runs are then merged. Yields the
+    merged records. As with the memory engine, the first copy of a message
+    read is kept.
+
+    At most FAN_IN runs are open at once. Runs are kept in levels; once a
+    level has FAN_IN runs they are merged into one run on the next level, so
+    every message is merged a few times at most.
+    '''
+    format = formats.get(args.format)
+    passthrough = args.passthrough == 'yes'
+    limit = args.memory_limit * 1024 * 1024
+    levels = [[]]
+    run = []
+    size = 0
+
+    def compact(level):
+        # Merge a level into one run on the next. The runs on the next level
+        # hold earlier messages, so the merged run goes after them.
+        if level + 1 == len(levels):
+            levels.append([])
+        runs, levels[level] = levels[level], []
+        levels[level + 1].append(collect(format, runs, key))
+
+    def add(run):
+        levels[0].append(run)
+        for level in range(len(levels)):
+            if len(levels[level]) < FAN_IN:
+                break
+            compact(level)
+
+    try:
+        # Read the data from the files.
+        for file in args.files:
+            messages = read(
+                format, file, key, args.start, args.end, args.meter
+            )
+            for date, id, data, record in messages:
+                # Ignore existing data. Like the memory engine, the first
+                # copy read is kept.
+                if not index.add(id):
+                    continue
+
+                record = serialise(format, data, record, passthrough)
+                run.append((date, record))
+
+                # Spill the run once it's full.
+                size += len(record) + OVERHEAD
+                if size >= limit:
+                    add(spill(format, run))
+                    run = []
+                    size = 0
+
+        # Spill whatever is left.
+        if run:
+            add(spill(format, run))
+            run = []
+
+        # Merge the lower levels until the rest can be read at once.
+        for level in range(len(levels) - 1):
+            if sum(len(runs) for runs in levels) <= FAN_IN:
+                break
+            compact(level)
+
+        # Merge the runs, from the earliest. Their records are already
+        # serialised and unique.
+        runs = [file for runs in reversed(levels) for file in runs]
+        for record in combine(format, runs, key, None, passthrough=True):
+            yield record
+
+    finally:
+        for runs in levels:
+            for file in runs:
+                file.close()
+
+
+# The available merge engines.
+ENGINES = {
+    'memory': memory,
+    'stream': stream,
+    'external': external,
+}
+
+
+def merge(args):
+    '''
+    Merges and prints messages.
+    '''
+    # Get the merge parameters.
+    key = ORDER[args.order]
+    engine = ENGINES[args.engine]
+    index = dedup.create(args)
+
+    # Decompress the inputs.
+    args.files = [compress.input(file, args.compress) for file in args.files]
+
+    # Get the time window.
+    moment = misc.optional(seek.moment)
+    args.start, args.end = moment(args.start), moment(args.end)
+
+    # Get the output. It is only compressed when a method is given, as
+    # stdout has no extension.
+    file = compress.output(builtins.stdout(), args.compress)
+    format = formats.get(args.format)
+    output = format.stream(file)
+    format.header(output)
+
+    # Report progress.
+    args.meter = stats.create(args)
+
+    try:
+        # Print the content in order.
+        for record in engine(args, key, index):
+            with profiler.stage('write'):
+                format.write(output, record)
+            args.meter.add(len(record))
+
+    finally:
+        index.close()
+        args.meter.close()
+
+    # End the compressed stream.
+    file.close()
+
+    # Report the duplicates on stderr, so that the merge is unaffected.
+    builtins.print_error('Dropped %d duplicate messages.' % index.duplicates)
 
 
 def main():
@@ -74,9 +328,21 @@ def main():
     parameters = (
         options.files,
         options.order,
+        options.engine,
+        options.memory_limit,
+        options.dedup,
+        options.passthrough,
+        options.format,
+        options.codec,
+        options.compress,
+        options.window,
+        options.stats,
+        options.profile,
         options.version,
     )
     args = options.parse(description, parameters).parse_args()
+    codec.use(args.codec)
 
     # Merge files.
-    merge(args)
+    with profiler.profile(args, 'amtk.merge'):
+        merge(args)
@@ -1,15 +1,25 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import json
-import pika
+import zlib
 import time
-import dateutil.parser
+import argparse
+import queue as Queue
 from amtk.utils import (
-    messages, options, builtins, misc, time as timeutils
+    messages, options, builtins, misc, formats, compress, seek, stats,
+    profiler, codec, time as timeutils
 )
 
 
+# pika is only imported once a message is published, and multiprocessing
+# once workers are started.
+pika = misc.Lazy('pika')
+multiprocessing = misc.Lazy('multiprocessing')
+
+# The number of lines each worker can have waiting to be published.
+QUEUE_SIZE = 10000
+
+
 def wait_delta(delta):
     '''
     Wait a specified delta number of seconds.
@@ -24,63 +34,203 @@ def wait_delta(delta):
     return result
 
 
-def wait_timestamp(last, now):
+def wait_schedule(speed=1.0, max_gap=None, start=None):
+    '''
+    Returns a wait function that follows the recorded timeline. The first
+    message anchors the timeline to the monotonic clock, and every message
+    after that is published at its recorded offset from the first, divided
+    by speed. Because each wait targets an absolute time, time spent parsing
+    and publishing, or oversleeping, never accumulates.
+
+    If max_gap is given, longer gaps between consecutive messages are cut
+    down to max_gap recorded seconds. start anchors the timeline to a given
+    clock reading instead of the first message.
+
+    Returns the number of seconds the message is behind the timeline, which
+    is 0 unless publishing can't keep up.
+    '''
+    # The clock reading of the first message, and the offset of the current
+    # message from it in seconds.
+    state = {'start': start, 'offset': 0.0}
+
+    def result(last, now):
+        # Anchor the timeline.
+        if state['start'] is None:
+            state['start'] = time.monotonic()
+
+        # Exit early.
+        if last is None or now is None:
+            return 0.0
+
+        # Get the time delta.
+        delta = (now - last).total_seconds()
+        if max_gap is not None:
+            delta = min(delta, max_gap)
+        state['offset'] += delta / speed
+
+        # Wait for the next message.
+        delay = state['start'] + state['offset'] - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        return max(-delay, 0.0)
+
+    return result
+
+
+def wait_offset(speed=1.0, start=None):
     '''
-    Wait for the difference between now and last.
+    Returns a wait function for messages that are timed by their offset, in
+    recorded seconds, from the first message in the recording, with any long
+    gaps already cut down; see schedule. Workers use it to follow the
+    timeline of the whole recording rather than of their own messages.
+    start anchors the offsets to a clock reading.
+
+    Returns the number of seconds the message is behind the timeline.
     '''
-    # Exit early.
-    if last is None or now is None:
-        return
+    state = {'start': start}
+
+    def result(last, offset):
+        # Anchor the timeline.
+        if state['start'] is None:
+            state['start'] = time.monotonic()
 
-    # Get the time delta.
-    delta = (now - last).total_seconds()
+        # Messages without a time are published immediately.
+        if offset is None:
+            return 0.0
 
-    # Wait for the next message.
-    time.sleep(delta)
+        # Wait for the message.
+        delay = state['start'] + offset / speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
 
+        return max(-delay, 0.0)
 
-def get_timing(args):
+    return result
+
+
+def wait_none(last, now):
     '''
-    Test and return the wait function.
+    Publish as fast as the broker accepts messages.
+    '''
+
+
+def wait_rate(rate):
+    '''
+    Returns a wait function that limits publishing to rate messages per
+    second using a token bucket. Rather than sleeping between every message,
+    the bucket is allowed to run dry and is then refilled with a batch of
+    tokens in a single sleep; at most around 100 sleeps happen per second.
+    '''
+    batch = max(rate / 100.0, 1.0)
+    state = {'tokens': batch, 'time': None}
+
+    def refill():
+        # Add the tokens earned since the last refill.
+        now = time.monotonic()
+        if state['time'] is not None:
+            earned = (now - state['time']) * rate
+            state['tokens'] = min(state['tokens'] + earned, batch)
+        state['time'] = now
+
+    def result(last, now):
+        refill()
+
+        # Wait for a batch of tokens.
+        if state['tokens'] < 1:
+            time.sleep((batch - state['tokens']) / rate)
+            state['tokens'] = batch
+            state['time'] = time.monotonic()
+
+        state['tokens'] -= 1
+
+    return result
+
+
+def wait_all(*waits):
+    '''
+    Returns a wait function that calls each of the wait functions in turn,
+    returning the largest lag behind the timeline of any of them.
+    '''
+    def result(last, now):
+        lags = [wait(last, now) for wait in waits]
+        lags = [lag for lag in lags if lag is not None]
+        return max(lags) if lags else None
+
+    return result
+
+
+def get_timing(args, start=None, offsets=False):
+    '''
+    Test and return the wait function. start anchors timestamp timings to a
+    monotonic clock reading; see wait_schedule. With offsets, messages are
+    timed by their offsets instead; see wait_offset.
     '''
     # Check for a timestamp timing mode.
     if args.timing in ('record', 'created'):
-        return wait_timestamp
+        if args.speed <= 0:
+            raise ValueError('Speed must be a positive number.')
+
+        if offsets:
+            wait = wait_offset(args.speed, start)
+        else:
+            wait = wait_schedule(args.speed, args.max_gap, start)
+
+    # Check for no timing.
+    elif args.timing == 'none':
+        wait = wait_none
 
     # Check for a delta.
-    try:
-        # Get the delta.
-        timing = float(args.timing)
-    except ValueError:
-        message = ('Timing must either be record, created or delta '
-                   'seconds between messages. %s provided.')
-        raise ValueError(message % args.timing)
+    else:
+        try:
+            # Get the delta.
+            timing = float(args.timing)
+        except ValueError:
+            message = ('Timing must either be record, created, none or delta '
+                       'seconds between messages. %s provided.')
+            raise ValueError(message % args.timing)
 
-    # Ensure that the timing is > 0.
-    if timing < 0:
-        raise ValueError('Timing must be a positive number.')
+        # Ensure that the timing is > 0.
+        if timing < 0:
+            raise ValueError('Timing must be a positive number.')
 
-    return wait_delta(timing)
+        if offsets:
+            wait = wait_offset(1.0, start)
+        else:
+            wait = wait_delta(timing)
 
+    # Limit the rate. The rate is shared evenly between workers.
+    if args.rate is not None:
+        if args.rate <= 0:
+            raise ValueError('Rate must be a positive number.')
 
-def publish(last, wait, args, channel, line):
+        wait = wait_all(wait, wait_rate(float(args.rate) / args.workers))
+
+    return wait
+
+
+def publish(last, wait, args, channel, line, offset=None):
     '''
     Publishes a line from stdin to the message queue. This function returns
-    the timestamp of the last valid message processed.
+    the timestamp of the last valid message processed. If offset is given,
+    the message is timed by it instead of its timestamp; see wait_offset.
     '''
     try:
         # Decode the data.
-        data = json.loads(line)
+        with profiler.stage('decode'):
+            data = formats.get(args.format).loads(line)
 
     except ValueError:
         builtins.print_text('Invalid message: %s' % line)
+        args.meter.skip()
         return last
 
     # Parse timestamps.
-    parser = misc.optional(dateutil.parser.parse)
-    expiry_time = parser(data['absolute_expiry_time'])
-    creation_time = parser(data['creation_time'])
-    record_time = parser(data['record_time'])
+    with profiler.stage('parse'):
+        parser = misc.optional(timeutils.parse)
+        expiry_time = parser(data['absolute_expiry_time'])
+        creation_time = parser(data['creation_time'])
+        record_time = parser(data['record_time'])
 
     # Wait to publish.
     timings = {'created': creation_time, 'record': record_time}
@@ -88,8 +238,9 @@ def publish(last, wait, args, channel, line):
     # set explicitly) does not exit early the default return value for now is
     # set to True. That way, on the first message, the loop will ignore the
     # timing. However, the timing will be respected for subsequent runs.
-    now = timings.get(args.timing, True)
-    wait(last, now)
+    now = timings.get(args.timing, True) if offset is None else offset
+    with profiler.stage('wait'):
+        lag = wait(last, now)
 
     # Get publish parameters.
     key = args.routing_key
@@ -98,57 +249,262 @@ def publish(last, wait, args, channel, line):
     immediate = args.immediate == 'yes'
 
     # Set the properties.
-    parser = misc.optional(timeutils.timestamp)
-    properties = pika.spec.BasicProperties(
-        content_type=data['content_type'],
-        content_encoding=data['content_encoding'],
-        headers=data.get('headers', {}),
-        correlation_id=data['correlation_id'],
-        reply_to=data['reply_to'],
-        expiration=parser(expiry_time),
-        message_id=data['message_id'],
-        timestamp=parser(creation_time),
-        user_id=data['user_id'],
-    )
+    with profiler.stage('properties'):
+        parser = misc.optional(timeutils.timestamp)
+        properties = pika.spec.BasicProperties(
+            content_type=data['content_type'],
+            content_encoding=data['content_encoding'],
+            headers=formats.decode(data.get('headers', {})),
+            correlation_id=data['correlation_id'],
+            reply_to=data['reply_to'],
+            expiration=parser(expiry_time),
+            message_id=data['message_id'],
+            timestamp=parser(creation_time),
+            user_id=data['user_id'],
+        )
 
     # Publish the message.
-    channel.basic_publish(
-        exchange=args.exchange,
-        routing_key=routing_key,
-        body=data['body'],
-        properties=properties,
-        mandatory=mandatory,
-        immediate=immediate,
-    )
+    with profiler.stage('publish'):
+        channel.basic_publish(
+            exchange=args.exchange,
+            routing_key=routing_key,
+            body=formats.decode(data['body']),
+            properties=properties,
+            mandatory=mandatory,
+            immediate=immediate,
+        )
+
+    # Schedule lag is how far behind the recorded timeline publishing is.
+    args.meter.add(len(line), lag)
 
     return now
 
 
-def play(args):
+def replay(args, lines, start=None, offsets=False):
     '''
-    Reads and publishes messages.
+    Connects to the server and publishes each line. start is the clock
+    reading the first line is timed against. With offsets, lines are
+    (line, offset) pairs; see wait_offset.
     '''
     # Connect to the server.
     connection, channel = messages.connect(args)
+    if args.confirm:
+        channel = messages.Confirmed(connection, channel, args.confirm)
 
     # Get timing parameters.
-    wait = get_timing(args)
-    last = None
+    wait = get_timing(args, start, offsets)
+
+    # Report progress.
+    args.meter = stats.create(args)
 
     # Stream the data in.
-    line = args.input.readline()
-    while line:
+    last = None
+    offset = None
+    for line in profiler.timed('read', lines):
+        if offsets:
+            line, offset = line
+
         # Publish the data.
-        last = publish(last, wait, args, channel, line)
+        last = publish(last, wait, args, channel, line, offset)
+
+    # Report any messages the broker failed to confirm.
+    if args.confirm:
+        lost = channel.drain(args.confirm_timeout)
+        for id in lost:
+            builtins.print_error('Unconfirmed message: %s' % id)
+        message = 'Confirmed %d messages, %d unconfirmed.'
+        builtins.print_error(message % (channel.acked, len(lost)))
 
-        # Get the next line.
-        line = args.input.readline()
+    args.meter.close()
 
     # Close the connection.
     channel.close()
     connection.close()
 
 
+def partition(args, data):
+    '''
+    Returns the index of the worker that publishes the data. Messages with
+    the same recorded routing key, or partition header, always go to the
+    same worker so that their order is preserved. A --routing_key override
+    is only used to publish, so messages are still shared between workers.
+    '''
+    if args.partition_header:
+        headers = data.get('headers') or {}
+        value = headers.get(args.partition_header)
+    else:
+        value = data.get('routing_key')
+
+    value = ('%s' % value).encode('utf-8')
+    return zlib.crc32(value) % args.workers
+
+
+def schedule(args):
+    '''
+    Returns a function that takes the data of each message in the recording
+    in turn, and returns its offset in recorded seconds from the first
+    message, with gaps cut down to max_gap as wait_schedule does. With a
+    delta timing, messages are delta seconds apart. Messages without a
+    time, or that aren't timed, have no offset.
+    '''
+    timings = {'created': 'creation_time', 'record': 'record_time'}
+    field = timings.get(args.timing)
+    parser = misc.optional(timeutils.parse)
+    state = {'last': None, 'offset': 0.0}
+
+    # The timing has already been checked; see get_timing.
+    delta = None
+    if field is None and args.timing != 'none':
+        delta = float(args.timing)
+
+    def result(data):
+        if delta is not None:
+            offset = state['offset']
+            state['offset'] += delta
+            return offset
+
+        if field is None:
+            return None
+
+        # Like wait_schedule, the gap before and after a message without a
+        # time is skipped.
+        now = parser(data[field])
+        last, state['last'] = state['last'], now
+        if now is None:
+            return None
+
+        if last is not None:
+            gap = (now - last).total_seconds()
+            if args.max_gap is not None:
+                gap = min(gap, args.max_gap)
+            state['offset'] += gap
+
+        return state['offset']
+
+    return result
+
+
+def worker(args, queue, start):
+    '''
+    Publishes the (line, offset) pairs taken from the queue until None is
+    received.
+    '''
+    # Workers that aren't forked start with the default codec.
+    codec.use(args.codec)
+
+    title, dump = profiler.worker(args)
+    with misc.suppress_interrupt(), profiler.profile(args, title, dump):
+        replay(args, iter(queue.get, None), start, True)
+
+
+def send(queue, process, line):
+    '''
+    Hands a line to a worker. Raises a RuntimeError if the worker has
+    stopped, rather than waiting on its queue forever.
+    '''
+    while True:
+        try:
+            queue.put(line, timeout=1)
+            return
+
+        except Queue.Full:
+            if not process.is_alive():
+                raise RuntimeError('A worker stopped unexpectedly.')
+
+
+def parallel(args):
+    '''
+    Reads messages and shares them between worker processes, each with its
+    own connection.
+    '''
+    # Check the timing once, rather than in every worker.
+    get_timing(args)
+
+    # Open files can't be shared with the workers. Progress is reported
+    # here, as messages are handed to the workers.
+    settings = argparse.Namespace(**vars(args))
+    settings.input = None
+    settings.stats = 0
+    meter = stats.create(args)
+
+    queues = []
+    processes = []
+    offset = schedule(args)
+
+    format = formats.get(args.format)
+    for line in profiler.timed('read', records(args)):
+        try:
+            # Decode the data.
+            with profiler.stage('decode'):
+                data = format.loads(line)
+
+        except ValueError:
+            builtins.print_text('Invalid message: %s' % line)
+            meter.skip()
+            continue
+
+        # Start the workers on the first message. Every message is sent with
+        # its offset on the timeline of the whole recording, and every
+        # worker anchors the offsets to the time the first message was read,
+        # so that the workers all follow the same schedule. The monotonic
+        # clock is shared by every process on the machine.
+        if not processes:
+            start = time.monotonic()
+
+            for index in range(args.workers):
+                queue = multiprocessing.Queue(QUEUE_SIZE)
+                process = multiprocessing.Process(
+                    target=worker,
+                    args=(settings, queue, start),
+                )
+                process.start()
+                queues.append(queue)
+                processes.append(process)
+
+        # Send the line to its worker.
+        index = partition(args, data)
+        send(queues[index], processes[index], (line, offset(data)))
+        meter.add(len(line))
+
+    # Stop the workers.
+    for queue, process in zip(queues, processes):
+        send(queue, process, None)
+    for process in processes:
+        process.join()
+
+    meter.close()
+
+    # Fail as replay would if a worker failed.
+    failed = [process for process in processes if process.exitcode]
+    if failed:
+        raise RuntimeError('%d of %d workers failed.' %
+                           (len(failed), len(processes)))
+
+
+def records(args):
+    '''
+    Returns an iterator over the records in the input, within the time
+    window if one is given.
+    '''
+    format = formats.get(args.format)
+    moment = misc.optional(seek.moment)
+    start, end = moment(args.start), moment(args.end)
+    return seek.window(format, args.input, start, end)
+
+
+def play(args):
+    '''
+    Reads and publishes messages.
+    '''
+    # Decompress the input.
+    args.input = compress.input(args.input, args.compress)
+
+    if args.workers > 1:
+        parallel(args)
+    else:
+        replay(args, records(args))
+
+
 def main():
     '''
     Application entry point.
@@ -159,12 +515,21 @@ def main():
     parameters = (
         options.amqp(routing_key='play', queue=False),
         options.publish,
+        options.confirm,
+        options.workers,
         options.timing,
+        options.format,
+        options.codec,
+        options.compress,
+        options.window,
+        options.stats,
+        options.profile,
         options.input,
         options.version,
     )
     args = options.parse(description, parameters).parse_args()
+    codec.use(args.codec)
 
     # Run until the user interrupts execution.
-    with misc.suppress_interrupt():
+    with misc.suppress_interrupt(), profiler.profile(args, 'amtk.play'):
         play(args)
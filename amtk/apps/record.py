@@ -1,45 +1,137 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import json
-from amtk.utils import messages, options, time, misc
+import os
+from amtk.utils import (
+    messages, options, builtins, time, misc, writers, formats, compress,
+    seek, stats, profiler, codec
+)
+
+
+# How often, in seconds, the writer thread checks for due flushes and
+# segments while the exchange is quiet, and the messages it has stored are
+# acked.
+POLL = 0.1
 
 
 def write(args, channel, method, properties, body):
     '''
-    Called when messages are consumed.
+    Called when messages are consumed. With a writer thread, the message is
+    queued to be stored on it; see store.
     '''
     # Decode the result.
-    data = {
-        'exchange': method.exchange,
-        'routing_key': method.routing_key,
-        'message_id': properties.message_id,
-        'user_id': properties.user_id,
-        'reply_to': properties.reply_to,
-        'correlation_id': properties.correlation_id,
-        'content_type': properties.content_type,
-        'content_encoding': properties.content_encoding,
-        'absolute_expiry_time': time.server_time(properties.expiration),
-        'creation_time': time.server_time(properties.timestamp),
-        'record_time': time.now(),
-        'body': body,
-        'headers': properties.headers,
-    }
-
-    # Write a single line of json.
-    args.output.write(json.dumps(data) + '\n')
+    with profiler.stage('convert'):
+        data = {
+            'exchange': method.exchange,
+            'routing_key': method.routing_key,
+            'message_id': properties.message_id,
+            'user_id': properties.user_id,
+            'reply_to': properties.reply_to,
+            'correlation_id': properties.correlation_id,
+            'content_type': properties.content_type,
+            'content_encoding': properties.content_encoding,
+            'absolute_expiry_time': time.server_time(properties.expiration),
+            'creation_time': time.server_time(properties.timestamp),
+            'record_time': time.now(),
+            'body': body,
+            'headers': properties.headers,
+        }
+
+    # Consumer lag is the time between creation and consumption.
+    args.meter.add(len(body), args.meter.since(properties.timestamp))
+
+    if args.writer is None:
+        store(args, data, method.delivery_tag)
+
+    # Dropped messages are requeued when acking.
+    elif not args.writer.put((data, method.delivery_tag)):
+        if args.acks is not None:
+            channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+
+def store(args, data, tag):
+    '''
+    Writes a message to the output.
+    '''
+    # Start a new segment before the message, if one is due.
+    rotate(args)
+
+    # Index the record before it is written, so that the entry points at it.
+    if args.index is not None:
+        args.index.add(data['record_time'], args.output.tell)
+
+    # Write a single record; in the jsonl format, a single line of json.
+    format = formats.get(args.format)
+    with profiler.stage('serialise'):
+        record = format.dumps(data)
+    with profiler.stage('write'):
+        format.write(args.output, record)
+
+    # The message is acked once the output has been flushed to disk.
+    if args.acks is not None:
+        args.acks.add(tag)
 
     # Flush the buffer so that commands that are piped to this utility will
     # get the next message instantly. This feature is useful if you want to
     # pipe messages from one exchange to the next; just record and pipe it to
-    # play.
-    args.output.flush()
+    # play. When batching is configured, the output only flushes once the
+    # batch is due; see options.flush.
+    with profiler.stage('flush'):
+        args.output.flush()
+
+
+def rotate(args):
+    '''
+    Starts the next segment if the current one is due. The messages in the
+    finished segment are acked once it has been renamed.
+    '''
+    if args.segments is not None and args.segments.due():
+        args.segments.rotate()
+        args.output.sync()
+
+
+def segments(args, format):
+    '''
+    Returns the segments the recording is written to, or None if the output
+    is not rotated.
+    '''
+    if args.rotate_size <= 0 and args.rotate_interval <= 0:
+        return None
+
+    # Only files can be rotated; the segments are written next to them.
+    name = getattr(args.output, 'name', None)
+    if not isinstance(name, str) or not os.path.isfile(name):
+        builtins.print_error('Only recording files can be rotated.')
+        return None
+
+    # The output itself is left unused.
+    args.output.close()
+    os.remove(name)
+
+    count = args.index_every
+    if count > 0 and compress.detect(args.output, args.compress):
+        builtins.print_error('Only plain recording files can be indexed.')
+        count = 0
+
+    size = args.rotate_size * 1024 * 1024
+    return writers.Segments(
+        name, format, args.compress, size, args.rotate_interval, count
+    )
 
 
 def record(args):
     '''
     Reads and prints messages.
     '''
+    # When acking, the broker stops delivering once prefetch_count messages
+    # are unacked, so a batch larger than that would never be flushed
+    # without a time limit.
+    if args.ack == 'yes' and args.flush_ms <= 0:
+        if 0 < args.prefetch_count < args.flush_every:
+            message = ('With --ack, --flush_every (%d) must not exceed '
+                       '--prefetch_count (%d) unless --flush_ms is set.')
+            raise ValueError(message % (args.flush_every, args.prefetch_count))
+
     # Connect to the server.
     connection, channel = messages.connect(args)
 
@@ -47,15 +139,138 @@ def record(args):
     queue = messages.subscribe(channel, args)
     messages.qos(channel, args)
 
+    # Compress the output on a background thread, so that consuming never
+    # waits for compression. Binary recordings are written to the underlying
+    # byte stream.
+    format = formats.get(args.format)
+    args.segments = segments(args, format)
+    if args.segments is None:
+        file = compress.output(args.output, args.compress)
+        output = format.stream(file)
+        format.header(output)
+    else:
+        file = output = args.segments
+
+    # Index the recording. Offsets are only meaningful in plain files. Each
+    # segment has its own index.
+    args.index = None
+    if args.segments is not None:
+        args.index = args.segments
+    elif args.index_every > 0:
+        name = seek.path(args.output)
+        if name is None or file is not args.output:
+            builtins.print_error('Only plain recording files can be indexed.')
+        else:
+            args.index = seek.Writer(open(name, 'w'), args.index_every)
+
+    # When acking, every flush waits for the output to reach the disk and
+    # then acks the messages written since the last flush. Messages stored
+    # by the writer thread are acked by the consumer.
+    args.acks = None
+    callback = None
+    if args.ack == 'yes':
+        args.acks = messages.Acknowledged(channel)
+
+        def synced():
+            if args.segments is None:
+                writers.durable(file)
+            else:
+                writers.durable(args.segments.file)
+            args.acks.store()
+            if args.writer is None:
+                args.acks.ack()
+        callback = synced
+
+    # Batch flushes to the output. The default flushes every message.
+    interval = args.flush_ms / 1000.0
+    args.output = writers.Buffered(
+        output, args.flush_every, interval, callback=callback
+    )
+
+    # Write on a background thread, so that disk stalls don't hold up the
+    # connection. The output is only used by the thread from now on; it
+    # flushes and rotates the output itself when the exchange is quiet.
+    args.writer = None
+    if args.write_queue > 0:
+        def idle():
+            args.output.flush()
+            rotate(args)
+
+        args.writer = writers.Background(
+            lambda item: store(args, *item),
+            args.write_queue,
+            args.write_policy,
+            idle,
+            POLL,
+        )
+
+        # Ack the messages stored by the thread.
+        def acknowledge():
+            args.acks.ack()
+            connection.add_timeout(POLL, acknowledge)
+
+        if args.acks is not None:
+            connection.add_timeout(POLL, acknowledge)
+
+    # Ensure that a quiet exchange doesn't leave messages sitting in the
+    # buffer for longer than the flush interval.
+    def tick():
+        args.output.flush()
+        connection.add_timeout(interval, tick)
+
+    if interval > 0 and args.writer is None:
+        connection.add_timeout(interval, tick)
+
+    # Ensure that a quiet exchange doesn't leave a segment open for longer
+    # than the rotation interval.
+    def roll():
+        rotate(args)
+        connection.add_timeout(args.segments.remaining(), roll)
+
+    rolling = args.segments is not None and args.rotate_interval > 0
+    if rolling and args.writer is None:
+        connection.add_timeout(args.segments.remaining(), roll)
+
+    # Report progress, including while the exchange is quiet.
+    args.meter = stats.create(args)
+
+    def report():
+        args.meter.check()
+        connection.add_timeout(args.stats, report)
+
+    if args.stats > 0:
+        connection.add_timeout(args.stats, report)
+
+    # Tune the prefetch count as the queue depth changes.
+    adaptive = None
+    if args.prefetch_max > args.prefetch_count:
+        adaptive = messages.Adaptive(
+            channel,
+            queue,
+            args.prefetch_count,
+            args.prefetch_max,
+            args.prefetch_size,
+        )
+
+        def tune():
+            change = adaptive.tune()
+            if change is not None:
+                builtins.print_error(change)
+            connection.add_timeout(args.prefetch_interval, tune)
+
+        connection.add_timeout(args.prefetch_interval, tune)
+
     # Create a callback that closures over the args parameter.
     def callback(channel, method, properties, body):
         write(args, channel, method, properties, body)
+        if adaptive is not None:
+            adaptive.add()
 
     # Setup the consumption callback.
     channel.basic_consume(
         callback,
         queue=queue,
-        no_ack=True,
+        no_ack=args.acks is None,
         exclusive=True,
     )
 
@@ -64,6 +279,26 @@ def record(args):
         # Start consuming messages.
         channel.start_consuming()
 
+    # Wait for the writer thread to store the queued messages.
+    if args.writer is not None:
+        args.writer.close()
+        message = 'The write queue peaked at %d of %d messages; %d dropped.'
+        builtins.print_error(message % (
+            args.writer.peak, args.writer.size, args.writer.dropped
+        ))
+
+    # Flush anything left in the buffer and end the compressed stream.
+    args.output.sync()
+    file.close()
+    if args.index is not None:
+        args.index.close()
+
+    # Ack the last messages stored by the writer thread.
+    if args.writer is not None and args.acks is not None:
+        args.acks.ack()
+
+    args.meter.close()
+
     # Close the connection.
     channel.close()
     connection.close()
@@ -78,11 +313,24 @@ def main():
                    'exchange should be created before this tool is used.')
     parameters = (
         options.amqp(routing_key='routing', queue=True),
+        options.bind,
         options.prefetch,
+        options.ack,
+        options.flush,
+        options.writer,
+        options.rotate,
+        options.format,
+        options.codec,
+        options.compress,
+        options.index(),
+        options.stats,
+        options.profile,
         options.output,
         options.version,
     )
     args = options.parse(description, parameters).parse_args()
+    codec.use(args.codec)
 
     # Run until the user interrupts execution.
-    record(args)
+    with profiler.profile(args, 'amtk.record'):
+        record(args)
@@ -4,18 +4,25 @@
 # Testing tools.
 from amtk.utils import testcase as unittest
 from mock import patch, MagicMock
+import io
+import os
+import sys
 import json
+import shutil
+import tempfile
+import subprocess
 import datetime
-import pytz
 import dateutil.parser
-from amtk.utils import time
+from amtk.utils import time, dedup, formats, seek, transport
 
 # To be tested.
-from amtk.apps import record, play, merge
+from amtk.apps import (
+    record, play, merge, convert, index, benchmark, generate
+)
 
 
 # Timestamp constants.
-parse = lambda value: datetime.datetime.fromtimestamp(value, pytz.utc)
+parse = lambda value: datetime.datetime.fromtimestamp(value, time.UTC)
 TIMESTAMPS = {
     'now': (
         1420070460,
@@ -72,6 +79,8 @@ class Record(unittest.TestCase):
 
         # Create test data.
         args = MagicMock()
+        args.format = 'jsonl'
+        args.writer = None
         channel = MagicMock()
         method = MagicMock()
         method.exchange = 'exchange'
@@ -100,10 +109,50 @@ class Record(unittest.TestCase):
                     '"reply_to": "reply_to", "absolute_expiry_time": null, '
                     '"message_id": "message_id"}\n')
         values = (created[1], now[1])
-        args.output.write.assert_called_once_with(expected % values)
+        self.assertEqual(args.output.write.call_count, 1)
+        line = args.output.write.call_args[0][0]
+        self.assertTrue(line.endswith('\n'))
+        self.assertEqual(json.loads(line), json.loads(expected % values))
 
         self.assertTrue(args.output.flush.called)
 
+    @patch('amtk.apps.record.time')
+    def test_write_binary(self, _time):
+        '''
+        A test for the write function in the binary format.
+        '''
+        created = TIMESTAMPS['created']
+        now = TIMESTAMPS['now']
+
+        # Mock time.now. server_time should not be mocked.
+        _time.server_time = time.server_time
+        _time.now.return_value = now[1]
+
+        # Create test data.
+        args = MagicMock()
+        args.writer = None
+        args.format = 'binary'
+        method = MagicMock()
+        method.exchange = 'exchange'
+        method.routing_key = 'routing_key'
+        properties = MagicMock()
+        properties.headers = None
+        properties.timestamp = created[0]
+        properties.expiration = None
+        body = b'\x00\xff'
+
+        # Run the test.
+        record.write(args, MagicMock(), method, properties, body)
+
+        # Check the result.
+        value = args.output.write.call_args[0][0]
+        data = formats.Binary.loads(value[4:])
+        self.assertEqual(data['body'], body)
+        self.assertEqual(data['creation_time'], created[2])
+        self.assertEqual(data['record_time'], now[2])
+        self.assertIsNone(data['absolute_expiry_time'])
+        self.assertIsNone(data['headers'])
+
     @patch('amtk.apps.record.messages')
     def test_record(self, messages):
         '''
@@ -111,10 +160,316 @@ class Record(unittest.TestCase):
         '''
         # Create test data.
         args = MagicMock()
+        args.format = 'jsonl'
+        args.compress = 'none'
+        args.index_every = 0
+        args.prefetch_count = 1
+        args.prefetch_max = 0
+        args.rotate_size = 0
+        args.rotate_interval = 0
+        args.write_queue = 0
+        args.stats = 0
+        args.flush_every = 1
+        args.flush_ms = 0
+        output = args.output
+        connection = MagicMock()
+        messages.connect.return_value = (connection, MagicMock())
+
+        # Run the test.
+        record.record(args)
+
+        # Check the result.
+        self.assertTrue(output.flush.called)
+        self.assertFalse(connection.add_timeout.called)
+
+    @patch('amtk.apps.record.messages')
+    def test_record_flush_ms(self, messages):
+        '''
+        A periodic flush is scheduled when a flush interval is given.
+        '''
+        # Create test data.
+        args = MagicMock()
+        args.format = 'jsonl'
+        args.compress = 'none'
+        args.index_every = 0
+        args.prefetch_count = 1
+        args.prefetch_max = 0
+        args.rotate_size = 0
+        args.rotate_interval = 0
+        args.write_queue = 0
+        args.stats = 0
+        args.flush_every = 100
+        args.flush_ms = 250
+        connection = MagicMock()
+        messages.connect.return_value = (connection, MagicMock())
+
+        # Run the test.
+        record.record(args)
+
+        # Check the result.
+        self.assertEqual(connection.add_timeout.call_args[0][0], 0.25)
+
+    def run_recording(self, messages, args, count=3):
+        '''
+        Records count messages to a temporary file. Returns the file.
+        '''
+        # Create test data.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output = open(os.path.join(directory, 'recording'), 'w')
+        args.format = 'jsonl'
+        args.compress = 'none'
+        args.flush_ms = 0
+        args.prefetch_count = args.flush_every
+        args.prefetch_max = 0
+        args.output = output
         messages.connect.return_value = (MagicMock(), MagicMock())
 
+        # Deliver the messages once consuming starts.
+        def consume():
+            callback = channel.basic_consume.call_args[0][0]
+            fields = ('message_id', 'user_id', 'reply_to', 'correlation_id',
+                      'content_type', 'content_encoding', 'headers',
+                      'timestamp', 'expiration')
+            properties = MagicMock(**dict.fromkeys(fields))
+            for tag in range(1, count + 1):
+                method = MagicMock(exchange='exchange', routing_key='key')
+                method.delivery_tag = tag
+                callback(channel, method, properties, 'body')
+
+        channel = messages.connect.return_value[1]
+        channel.start_consuming.side_effect = consume
+
+        # Run the test.
+        record.record(args)
+
+        return output
+
+    @patch('amtk.apps.record.messages')
+    def test_record_index(self, messages):
+        '''
+        An index is written next to the recording.
+        '''
+        # Create test data.
+        args = MagicMock()
+        args.index_every = 2
+        args.flush_every = 1
+        args.rotate_size = 0
+        args.rotate_interval = 0
+        args.write_queue = 0
+        args.stats = 0
+
+        # Run the test.
+        output = self.run_recording(messages, args)
+
+        # Check the result.
+        with open(output.name) as file:
+            entries = seek.load(file)
+            lines = file.readlines()
+        offset = len(''.join(lines[:2]))
+        expected = [(0, 0), (offset, 2)]
+        self.assertEqual([entry[1:] for entry in entries], expected)
+
+    @patch('amtk.apps.record.messages')
+    def test_record_rotate(self, messages):
+        '''
+        Rotated recordings are written as finished segments, each with its
+        own index, in place of the output.
+        '''
+        # Create test data.
+        args = MagicMock()
+        args.ack = 'no'
+        args.index_every = 2
+        args.flush_every = 1
+        args.rotate_size = 0
+        args.rotate_interval = 3600
+        args.write_queue = 0
+        args.stats = 0
+
+        # Run the test.
+        output = self.run_recording(messages, args)
+
+        # Check the result.
+        directory = os.path.dirname(output.name)
+        expected = ['recording.000000', 'recording.000000.idx']
+        self.assertEqual(sorted(os.listdir(directory)), expected)
+        with open(os.path.join(directory, expected[0])) as file:
+            self.assertEqual(len(file.readlines()), 3)
+            self.assertEqual(len(seek.load(file)), 2)
+
+        # The segment is due by age once the interval passes.
+        connection = messages.connect.return_value[0]
+        self.assertEqual(connection.add_timeout.call_args[0][0], 3600)
+
+    def test_rotate(self):
+        '''
+        A new segment is started, and the finished one acked, once it's due.
+        '''
+        # Create test data.
+        args = MagicMock()
+        args.segments.due.side_effect = [False, True]
+
+        # Run the test.
+        record.rotate(args)
+        record.rotate(args)
+
+        # Check the result.
+        args.segments.rotate.assert_called_once_with()
+        args.output.sync.assert_called_once_with()
+
+    @patch('amtk.apps.record.messages')
+    def test_record_ack(self, messages):
+        '''
+        Messages are acked in batches once they are flushed.
+        '''
+        # Create test data.
+        args = MagicMock()
+        args.ack = 'yes'
+        args.index_every = 0
+        args.prefetch_count = 1
+        args.prefetch_max = 0
+        args.rotate_size = 0
+        args.rotate_interval = 0
+        args.write_queue = 0
+        args.stats = 0
+        args.flush_every = 2
+
+        # Run the test.
+        self.run_recording(messages, args)
+
+        # Check the result.
+        channel = messages.connect.return_value[1]
+        acks = messages.Acknowledged.return_value
+        messages.Acknowledged.assert_called_once_with(channel)
+        self.assertFalse(channel.basic_consume.call_args[1]['no_ack'])
+        added = [call[0][0] for call in acks.add.call_args_list]
+        self.assertEqual(added, [1, 2, 3])
+        self.assertEqual(acks.ack.call_count, 2)
+
+    @patch('amtk.apps.record.messages')
+    def test_record_ack_stall(self, messages):
+        '''
+        Acked batches that could never fill are rejected before connecting.
+        '''
+        # Create test data.
+        args = MagicMock()
+        args.ack = 'yes'
+        args.prefetch_count = 1
+        args.flush_every = 2
+        args.flush_ms = 0
+
+        # Run the test.
+        self.assertRaises(ValueError, record.record, args)
+
+        # Check the result.
+        self.assertFalse(messages.connect.called)
+
+    @patch('amtk.apps.record.messages')
+    @patch('amtk.apps.record.builtins')
+    def test_record_writer(self, builtins, messages):
+        '''
+        Messages are written on a writer thread and acked by the consumer
+        once stored. The queue depth is reported at the end.
+        '''
+        # Create test data.
+        args = MagicMock()
+        args.ack = 'yes'
+        args.index_every = 0
+        args.flush_every = 2
+        args.rotate_size = 0
+        args.rotate_interval = 0
+        args.write_queue = 10
+        args.stats = 0
+        args.write_policy = 'block'
+
+        # Run the test.
+        output = self.run_recording(messages, args)
+
+        # Check the result.
+        with open(output.name) as file:
+            self.assertEqual(len(file.readlines()), 3)
+        acks = messages.Acknowledged.return_value
+        self.assertEqual(acks.store.call_count, 2)
+        self.assertTrue(acks.ack.called)
+        connection = messages.connect.return_value[0]
+        self.assertEqual(connection.add_timeout.call_args[0][0], record.POLL)
+        report = builtins.print_error.call_args[0][0]
+        self.assertIn('of 10 messages; 0 dropped', report)
+
+    def test_write_dropped(self):
+        '''
+        Messages dropped by the writer thread are requeued when acking.
+        '''
+        # Create test data.
+        args = MagicMock()
+        args.writer.put.return_value = False
+        channel = MagicMock()
+        method = MagicMock()
+        method.delivery_tag = 5
+
+        # Run the test.
+        record.write(args, channel, method, MagicMock(), 'body')
+
+        # Check the result.
+        channel.basic_nack.assert_called_once_with(delivery_tag=5,
+                                                   requeue=True)
+        self.assertFalse(args.output.write.called)
+
+    def test_write_dropped_asyncio(self):
+        '''
+        Dropped messages are requeued through the asyncio transport too.
+        '''
+        # Create test data.
+        args = MagicMock()
+        args.writer.put.return_value = False
+        connection = MagicMock()
+        underlying = MagicMock()
+        channel = transport.Channel(connection, underlying)
+        method = MagicMock()
+        method.delivery_tag = 5
+
+        # Run the test.
+        record.write(args, channel, method, MagicMock(), 'body')
+
+        # Check the result.
+        connection.send.assert_called_once_with(
+            underlying.basic_nack, delivery_tag=5, requeue=True
+        )
+
+    @patch('amtk.apps.record.messages')
+    @patch('amtk.apps.record.builtins')
+    def test_record_adaptive(self, builtins, messages):
+        '''
+        The prefetch count is tuned periodically when a maximum is given.
+        '''
+        # Create test data.
+        args = MagicMock()
+        args.format = 'jsonl'
+        args.compress = 'none'
+        args.index_every = 0
+        args.flush_every = 1
+        args.flush_ms = 0
+        args.prefetch_count = 1
+        args.prefetch_max = 8
+        args.rotate_size = 0
+        args.rotate_interval = 0
+        args.write_queue = 0
+        args.stats = 0
+        args.prefetch_interval = 0.5
+        connection = MagicMock()
+        channel = MagicMock()
+        messages.connect.return_value = (connection, channel)
+        messages.Adaptive.return_value.tune.return_value = 'changed'
+
         # Run the test.
         record.record(args)
+        tune = connection.add_timeout.call_args[0][1]
+        tune()
+
+        # Check the result.
+        self.assertEqual(messages.Adaptive.call_args[0][2:4], (1, 8))
+        self.assertEqual(connection.add_timeout.call_args[0][0], 0.5)
+        builtins.print_error.assert_called_once_with('changed')
 
     @patch('amtk.apps.record.record')
     @patch('amtk.apps.record.options')
@@ -122,6 +477,11 @@ class Record(unittest.TestCase):
         '''
         A test for the main function.
         '''
+        # Create fake data.
+        args = options.parse.return_value.parse_args.return_value
+        args.profile = False
+        args.codec = 'auto'
+
         # Run the test.
         record.main()
 
@@ -165,59 +525,253 @@ class Play(unittest.TestCase):
         self.assertFalse(time.sleep.called)
 
     @patch('amtk.apps.play.time')
-    def test_wait_timestamp(self, time):
+    def test_wait_schedule(self, time):
         '''
-        Tests the wait_timestamp function.
+        Tests the wait_schedule function. Time spent between waits is taken
+        out of the next wait.
         '''
         # Create test data.
         last = TIMESTAMPS['last'][2]
         now = TIMESTAMPS['now'][2]
+        time.monotonic.side_effect = (100.0, 100.5)
 
         # Run the test.
-        play.wait_timestamp(last, now)
+        result = play.wait_schedule()
+        result(None, last)
+        result(last, now)
 
         # Check the result.
-        time.sleep.assert_called_once_with(60.001)
+        self.assertEqual(time.sleep.call_count, 1)
+        self.assertAlmostEqual(time.sleep.call_args[0][0], 59.501)
 
     @patch('amtk.apps.play.time')
-    def test_wait_timestamp_none(self, time):
+    def test_wait_schedule_none(self, time):
         '''
-        Tests the wait_timestamp function with a None last.
+        Tests the wait_schedule function with a None last.
         '''
         # Create test data.
         last = None
         now = TIMESTAMPS['now'][2]
+        time.monotonic.return_value = 100.0
 
         # Run the test.
-        play.wait_timestamp(last, now)
+        result = play.wait_schedule()
+        result(last, now)
+
+        # Check the result.
+        self.assertFalse(time.sleep.called)
+
+    @patch('amtk.apps.play.time')
+    def test_wait_schedule_late(self, time):
+        '''
+        A message that is already late is published immediately, and its
+        lag is returned.
+        '''
+        # Create test data.
+        last = TIMESTAMPS['last'][2]
+        now = TIMESTAMPS['now'][2]
+        time.monotonic.side_effect = (100.0, 200.0)
+
+        # Run the test.
+        result = play.wait_schedule()
+        result(None, last)
+        lag = result(last, now)
 
         # Check the result.
         self.assertFalse(time.sleep.called)
+        self.assertAlmostEqual(lag, 100.0 - (now - last).total_seconds())
+
+    @patch('amtk.apps.play.time')
+    def test_wait_schedule_speed(self, time):
+        '''
+        Tests the speed and max_gap parameters, with a shared start.
+        '''
+        # Create test data.
+        last = TIMESTAMPS['last'][2]
+        now = TIMESTAMPS['now'][2]
+        created = TIMESTAMPS['created'][2]
+        time.monotonic.side_effect = (100.0, 100.0)
+
+        # Run the test.
+        result = play.wait_schedule(speed=10, max_gap=100, start=100.0)
+        result(last, now)
+        result(now, created)
+
+        # Check the result.
+        delays = [call[0][0] for call in time.sleep.call_args_list]
+        self.assertAlmostEqual(delays[0], 6.0001)
+        self.assertAlmostEqual(delays[1], 16.0001)
+
+    @patch('amtk.apps.play.time')
+    def test_wait_offset(self, time):
+        '''
+        Messages are published at their offset from the start, whatever
+        messages came before them.
+        '''
+        # Create test data.
+        time.monotonic.side_effect = (100.5, 150.0)
+
+        # Run the test.
+        result = play.wait_offset(speed=2, start=100.0)
+        first = result(None, 10.0)
+        undated = result(None, None)
+        late = result(None, 90.0)
+
+        # Check the result.
+        time.sleep.assert_called_once_with(4.5)
+        self.assertEqual(first, 0.0)
+        self.assertEqual(undated, 0.0)
+        self.assertEqual(late, 5.0)
+
+    def test_schedule(self):
+        '''
+        Offsets follow the whole recording, with long gaps cut down, so
+        that workers share one timeline.
+        '''
+        # Create test data. Key a has a long gap, filled by key b.
+        args = MagicMock()
+        args.timing = 'record'
+        args.max_gap = 10
+        moment = '2015-01-01T00:%02d:%02d+00:00'
+        times = [0] + list(range(1, 200, 20)) + [200, 215]
+        data = [{'record_time': moment % divmod(value, 60)}
+                for value in times]
+        data.insert(3, {'record_time': None})
+
+        # Run the test.
+        offset = play.schedule(args)
+        result = [offset(value) for value in data]
+
+        # Check the result. The gap around the undated message is skipped,
+        # as it is when publishing without workers.
+        self.assertEqual(result[:6], [0.0, 1.0, 11.0, None, 11.0, 21.0])
+        self.assertEqual(result[-2:], [91.0, 101.0])
+
+        args.timing = 'none'
+        self.assertIsNone(play.schedule(args)(data[0]))
+
+    def test_schedule_delta(self):
+        '''
+        With a delta timing, messages are delta seconds apart on the shared
+        timeline, however they are shared between workers.
+        '''
+        # Create test data.
+        args = MagicMock()
+        args.timing = '0.5'
 
-    def check_get_timing(self, timing):
+        # Run the test.
+        offset = play.schedule(args)
+        result = [offset({}) for number in range(3)]
+
+        # Check the result.
+        self.assertEqual(result, [0.0, 0.5, 1.0])
+
+    @patch('amtk.apps.play.time')
+    def test_wait_rate(self, time):
+        '''
+        The token bucket sleeps once per batch, not once per message.
+        '''
+        # Create test data. The clock stands still, except while sleeping.
+        clock = [0.0]
+        time.monotonic.side_effect = lambda: clock[0]
+
+        def sleep(delay):
+            clock[0] += delay
+
+        time.sleep.side_effect = sleep
+
+        # Run the test.
+        result = play.wait_rate(1000)
+        for number in range(100):
+            result(None, None)
+
+        # Check the result. After the first batch, each sleep buys roughly
+        # another batch of ten messages.
+        self.assertEqual(time.sleep.call_count, 9)
+        self.assertAlmostEqual(clock[0], 0.09)
+
+    def test_wait_all(self):
+        '''
+        Tests the wait_all function.
+        '''
+        # Create test data.
+        first = MagicMock(return_value=0.5)
+        second = MagicMock(return_value=None)
+
+        # Run the test.
+        result = play.wait_all(first, second)('last', 'now')
+
+        # Check the result.
+        first.assert_called_once_with('last', 'now')
+        second.assert_called_once_with('last', 'now')
+        self.assertEqual(result, 0.5)
+
+    def check_get_timing(self, timing, speed=1.0, rate=None):
         '''
         Tests the get_timing function.
         '''
         # Create test data.
         args = MagicMock()
         args.timing = timing
+        args.speed = speed
+        args.max_gap = None
+        args.rate = rate
+        args.workers = 2
 
         # Run the test.
         return play.get_timing(args)
 
-    def test_get_timing_record(self):
+    @patch('amtk.apps.play.wait_schedule')
+    def test_get_timing_record(self, wait_schedule):
         '''
         Tests the get_timing function in record mode.
         '''
         result = self.check_get_timing('record')
-        self.assertIs(result, play.wait_timestamp)
+        self.assertIs(result, wait_schedule.return_value)
+        wait_schedule.assert_called_once_with(1.0, None, None)
 
-    def test_get_timing_created(self):
+    @patch('amtk.apps.play.wait_schedule')
+    def test_get_timing_created(self, wait_schedule):
         '''
         Tests the get_timing function in created mode.
         '''
         result = self.check_get_timing('created')
-        self.assertIs(result, play.wait_timestamp)
+        self.assertIs(result, wait_schedule.return_value)
+
+    def test_get_timing_none(self):
+        '''
+        Tests the get_timing function with no timing.
+        '''
+        result = self.check_get_timing('none')
+        self.assertIs(result, play.wait_none)
+
+    @patch('amtk.apps.play.wait_all')
+    @patch('amtk.apps.play.wait_rate')
+    def test_get_timing_rate(self, wait_rate, wait_all):
+        '''
+        The rate is shared between workers and combined with the timing.
+        '''
+        result = self.check_get_timing('none', rate=100)
+        wait_rate.assert_called_once_with(50.0)
+        wait_all.assert_called_once_with(play.wait_none,
+                                         wait_rate.return_value)
+        self.assertIs(result, wait_all.return_value)
+
+    def test_get_timing_rate_negative(self):
+        '''
+        The rate must be positive.
+        '''
+        expected = 'positive'
+        with self.assertRaisesRegexp(ValueError, expected):
+            self.check_get_timing('none', rate=-1)
+
+    def test_get_timing_speed_negative(self):
+        '''
+        The speed must be positive.
+        '''
+        expected = 'positive'
+        with self.assertRaisesRegexp(ValueError, expected):
+            self.check_get_timing('record', speed=0)
 
     @patch('amtk.apps.play.wait_delta')
     def test_get_timing_delta(self, wait_delta):
@@ -227,6 +781,18 @@ class Play(unittest.TestCase):
         self.check_get_timing('1.1')
         wait_delta.assert_called_once_with(1.1)
 
+    @patch('amtk.apps.play.wait_offset')
+    def test_get_timing_delta_offsets(self, wait_offset):
+        '''
+        Workers time a delta by the offsets they are sent.
+        '''
+        args = MagicMock()
+        args.timing = '1.1'
+        args.rate = None
+        result = play.get_timing(args, 100.0, True)
+        self.assertIs(result, wait_offset.return_value)
+        wait_offset.assert_called_once_with(1.0, 100.0)
+
     def test_get_timing_delta_invalid(self):
         '''
         A positive test for get_timing with a delta.
@@ -244,7 +810,7 @@ class Play(unittest.TestCase):
             self.check_get_timing('-1.1')
 
     @patch('amtk.apps.play.pika')
-    def check_publish(self, routing_key, pika, line=None):
+    def check_publish(self, routing_key, pika, line=None, format='jsonl'):
         '''
         Structure for testing the publish function.
         '''
@@ -252,6 +818,7 @@ class Play(unittest.TestCase):
         last = None
         wait = MagicMock()
         args = MagicMock()
+        args.format = format
         args.routing_key = routing_key
         args.mandatory = 'no'
         args.immediate = 'no'
@@ -272,7 +839,7 @@ class Play(unittest.TestCase):
             'body': 'body',
             'headers': {'test': 'test'},
         }
-        line = line if line else json.dumps(data)
+        line = line if line else formats.get(format).dumps(data)
 
         # Run the test.
         result = play.publish(last, wait, args, channel, line)
@@ -325,6 +892,20 @@ class Play(unittest.TestCase):
         }
         self.assertEqual(basic_publish.call_args[1], expected)
 
+    def test_publish_binary(self):
+        '''
+        A positive test for the publish function in the binary format.
+        '''
+        # Run the test.
+        result = self.check_publish(None, format='binary')
+        result, properties, basic_publish = result
+
+        # Check the result.
+        self.assertEqual(result, TIMESTAMPS['now'][2])
+        timestamp = properties.call_args[1]['timestamp']
+        self.assertEqual(timestamp, TIMESTAMPS['created'][0])
+        self.assertEqual(basic_publish.call_args[1]['body'], b'body')
+
     def test_publish_routing_key(self):
         '''
         Tests routing key override.
@@ -366,7 +947,17 @@ class Play(unittest.TestCase):
         '''
         # Create fake data.
         args = MagicMock()
+        args.stats = 0
+        args.format = 'jsonl'
+        args.compress = 'none'
+        args.start = None
+        args.end = None
         args.timing = 'record'
+        args.speed = 1.0
+        args.max_gap = None
+        args.rate = None
+        args.confirm = 0
+        args.workers = 1
         connection = MagicMock()
         channel = MagicMock()
         messages.connect.return_value = (
@@ -389,16 +980,222 @@ class Play(unittest.TestCase):
         self.assertTrue(channel.close.called)
         self.assertTrue(connection.close.called)
 
-    @patch('amtk.apps.play.play')
-    @patch('amtk.apps.play.options')
-    def test_main(self, options, _play):
+    @patch('amtk.apps.play.builtins')
+    @patch('amtk.apps.play.publish')
+    @patch('amtk.apps.play.messages')
+    def test_play_confirm(self, messages, publish, builtins):
         '''
-        A test for the main function.
+        Tests the play function with publisher confirms.
         '''
+        # Create fake data.
+        args = MagicMock()
+        args.stats = 0
+        args.format = 'jsonl'
+        args.compress = 'none'
+        args.start = None
+        args.end = None
+        args.timing = 'record'
+        args.speed = 1.0
+        args.max_gap = None
+        args.rate = None
+        args.confirm = 10
+        args.confirm_timeout = 5
+        args.workers = 1
+        messages.connect.return_value = (MagicMock(), MagicMock())
+        args.input.readline.side_effect = (json.dumps({}), '')
+        confirmed = messages.Confirmed.return_value
+        confirmed.drain.return_value = ['lost']
+        confirmed.acked = 1
+
         # Run the test.
-        play.main()
+        play.play(args)
 
-    @patch('amtk.apps.play.play')
+        # Check the result.
+        self.assertIs(publish.call_args[0][3], confirmed)
+        confirmed.drain.assert_called_once_with(5)
+        self.assertEqual(builtins.print_error.call_args_list[0][0][0],
+                         'Unconfirmed message: lost')
+        self.assertEqual(builtins.print_error.call_args_list[1][0][0],
+                         'Confirmed 1 messages, 1 unconfirmed.')
+        self.assertTrue(confirmed.close.called)
+
+    def test_partition(self):
+        '''
+        Messages are partitioned by routing key or header.
+        '''
+        # Create fake data.
+        args = MagicMock()
+        args.workers = 4
+        args.routing_key = None
+        args.partition_header = None
+        data = {'routing_key': 'a', 'headers': {'key': 'b'}}
+
+        # Run the test.
+        first = play.partition(args, data)
+        second = play.partition(args, {'routing_key': 'a'})
+        args.routing_key = 'b'
+        override = play.partition(args, data)
+        other = play.partition(args, {'routing_key': 'b'})
+        args.partition_header = 'key'
+        header = play.partition(args, data)
+
+        # Check the result. The routing key override is only published.
+        self.assertEqual(first, second)
+        self.assertEqual(first, override)
+        self.assertEqual(header, other)
+        self.assertNotEqual(first, header)
+        self.assertIn(first, range(4))
+
+    @patch('amtk.apps.play.replay')
+    def test_worker(self, replay):
+        '''
+        Workers publish the lines in their queue until None is received.
+        '''
+        # Create fake data.
+        args = MagicMock()
+        args.profile = False
+        args.codec = 'auto'
+        queue = MagicMock()
+        queue.get.side_effect = ('a', 'b', None, 'c')
+        replay.side_effect = lambda args, lines, start, offsets: list(lines)
+
+        # Run the test.
+        play.worker(args, queue, 'start')
+
+        # Check the result.
+        self.assertEqual(queue.get.call_count, 3)
+        self.assertEqual(replay.call_args[0][2:], ('start', True))
+
+    def test_send_stopped(self):
+        '''
+        A stopped worker raises an error rather than blocking forever.
+        '''
+        # Create fake data.
+        queue = MagicMock()
+        queue.put.side_effect = play.Queue.Full
+        process = MagicMock()
+        process.is_alive.return_value = False
+
+        # Run the test.
+        with self.assertRaises(RuntimeError):
+            play.send(queue, process, 'line')
+
+    @patch('amtk.apps.play.builtins')
+    @patch('amtk.apps.play.multiprocessing')
+    def test_parallel(self, multiprocessing, builtins):
+        '''
+        Lines are shared between the workers by routing key.
+        '''
+        # Create fake data.
+        args = MagicMock()
+        args.stats = 0
+        args.format = 'jsonl'
+        args.start = None
+        args.end = None
+        args.timing = 'record'
+        args.speed = 1.0
+        args.max_gap = None
+        args.rate = None
+        args.workers = 2
+        args.routing_key = None
+        args.partition_header = None
+        last = TIMESTAMPS['last']
+        now = TIMESTAMPS['now']
+        lines = [
+            json.dumps({'routing_key': 'a', 'record_time': last[1]}),
+            'invalid\n',
+            json.dumps({'routing_key': 'd', 'record_time': now[1]}),
+            json.dumps({'routing_key': 'a', 'record_time': now[1]}),
+        ]
+        args.input.readline.side_effect = lines + ['']
+        queues = [MagicMock(), MagicMock()]
+        multiprocessing.Queue.side_effect = queues
+        multiprocessing.Process.return_value.exitcode = 0
+
+        # Run the test.
+        play.parallel(args)
+
+        # Check the result.
+        self.assertEqual(multiprocessing.Process.call_count, 2)
+        settings, queue, start = multiprocessing.Process.call_args[1]['args']
+        self.assertIsNone(settings.input)
+        self.assertTrue(builtins.print_text.called)
+
+        sent = [
+            [call[0][0] for call in queue.put.call_args_list]
+            for queue in queues
+        ]
+        first = play.partition(args, {'routing_key': 'a'})
+        second = play.partition(args, {'routing_key': 'd'})
+        self.assertNotEqual(first, second)
+        self.assertEqual(sent[first], [(lines[0], 0.0), (lines[3], 60.001),
+                                       None])
+        self.assertEqual(sent[second], [(lines[2], 60.001), None])
+
+    @patch('amtk.apps.play.multiprocessing')
+    def test_parallel_failed(self, multiprocessing):
+        '''
+        Play fails if a worker fails, and bad timings fail before any worker
+        is started.
+        '''
+        # Create fake data.
+        args = MagicMock()
+        args.stats = 0
+        args.format = 'jsonl'
+        args.start = None
+        args.end = None
+        args.timing = 'none'
+        args.rate = None
+        args.workers = 2
+        args.routing_key = None
+        args.partition_header = None
+        line = json.dumps({'routing_key': 'a', 'record_time': None})
+        args.input.readline.side_effect = [line, '']
+        multiprocessing.Process.return_value.exitcode = 1
+
+        # Run the test.
+        with self.assertRaises(RuntimeError):
+            play.parallel(args)
+
+        args.timing = 'record'
+        args.speed = 0
+        self.assertRaises(ValueError, play.parallel, args)
+
+        # Check the result.
+        self.assertEqual(multiprocessing.Process.call_count, 2)
+
+    @patch('amtk.apps.play.parallel')
+    @patch('amtk.apps.play.replay')
+    def test_play_workers(self, replay, parallel):
+        '''
+        Play uses the workers when more than one is requested.
+        '''
+        # Create fake data.
+        args = MagicMock()
+        args.workers = 2
+
+        # Run the test.
+        play.play(args)
+
+        # Check the result.
+        parallel.assert_called_once_with(args)
+        self.assertFalse(replay.called)
+
+    @patch('amtk.apps.play.play')
+    @patch('amtk.apps.play.options')
+    def test_main(self, options, _play):
+        '''
+        A test for the main function.
+        '''
+        # Create fake data.
+        args = options.parse.return_value.parse_args.return_value
+        args.profile = False
+        args.codec = 'auto'
+
+        # Run the test.
+        play.main()
+
+    @patch('amtk.apps.play.play')
     @patch('amtk.apps.play.options')
     def test_main_interrupt(self, options, _play):
         '''
@@ -406,6 +1203,9 @@ class Play(unittest.TestCase):
         '''
         # Create fake data.
         _play.side_effect = KeyboardInterrupt
+        args = options.parse.return_value.parse_args.return_value
+        args.profile = False
+        args.codec = 'auto'
 
         # Run the test.
         play.main()
@@ -416,7 +1216,7 @@ class Merge(unittest.TestCase):
     Tests for functions in the merge module.
     '''
     @patch('amtk.apps.merge.builtins')
-    def check_merge(self, order, builtins):
+    def check_merge(self, order, engine, dedup, builtins):
         '''
         A test for the merge function.
         '''
@@ -424,7 +1224,16 @@ class Merge(unittest.TestCase):
 
         # Create fake data.
         args = MagicMock()
+        args.format = 'jsonl'
+        args.compress = 'none'
+        args.start = None
+        args.end = None
         args.order = order
+        args.engine = engine
+        args.dedup = dedup
+        args.dedup_expected = 10
+        args.memory_limit = 0
+        args.stats = 0
         args.files = (
             file((CONTENT[0], CONTENT[3], CONTENT[4])),
             file((CONTENT[1], CONTENT[2], CONTENT[5])),
@@ -435,30 +1244,291 @@ class Merge(unittest.TestCase):
         merge.merge(args)
 
         # Check the result.
-        result = builtins.print_text.call_args_list
+        result = builtins.stdout.return_value.write.call_args_list
         expected = [
             json.loads(CONTENT[4]),
             json.loads(CONTENT[5]),
             json.loads(CONTENT[6]),
             json.loads(CONTENT[7]),
         ]
-        for index, value in enumerate(result):
+        self.assertEqual(len(result), len(expected))
+        for number, value in enumerate(result):
             data = json.loads(value[0][0])
-            self.assertEqual(data, expected[index])
+            self.assertEqual(data, expected[number])
+
+        # Check the duplicate report.
+        expected = 'Dropped 1 duplicate messages.'
+        builtins.print_error.assert_called_once_with(expected)
 
     def test_merge_record(self):
         '''
         Test merge ordered by record.
         '''
         # Run the test.
-        self.check_merge('record')
+        self.check_merge('record', 'memory', 'exact')
 
     def test_merge_created(self):
         '''
         Test merge ordered by created.
         '''
         # Run the test.
-        self.check_merge('created')
+        self.check_merge('created', 'memory', 'exact')
+
+    def test_merge_stream(self):
+        '''
+        Test the streaming merge.
+        '''
+        # Run the test.
+        self.check_merge('record', 'stream', 'exact')
+
+    def test_merge_hashed(self):
+        '''
+        Test merge with hashed duplicate detection.
+        '''
+        # Run the test.
+        self.check_merge('record', 'stream', 'hashed')
+
+    def test_merge_disk(self):
+        '''
+        Test merge with duplicate detection on disk.
+        '''
+        # Run the test.
+        self.check_merge('record', 'memory', 'disk')
+
+    @patch('amtk.apps.merge.builtins')
+    def test_merge_binary(self, builtins):
+        '''
+        Test merge in the binary format.
+        '''
+        # Create fake data.
+        def recording(*lines):
+            result = io.BytesIO()
+            formats.Binary.header(result)
+            for line in lines:
+                data = json.loads(line)
+                formats.Binary.write(result, formats.Binary.dumps(data))
+            result.seek(0)
+            return result
+
+        args = MagicMock()
+        args.format = 'binary'
+        args.compress = 'none'
+        args.start = None
+        args.end = None
+        args.order = 'record'
+        args.engine = 'external'
+        args.dedup = 'exact'
+        args.memory_limit = 0
+        args.stats = 0
+        args.files = (
+            recording(CONTENT[3], CONTENT[4], CONTENT[6]),
+            recording(CONTENT[2], CONTENT[5], CONTENT[7]),
+        )
+
+        # Run the test.
+        merge.merge(args)
+
+        # Check the result.
+        output = builtins.stdout.return_value.buffer.write.call_args_list
+        output = io.BytesIO(b''.join(call[0][0] for call in output))
+        result = formats.Binary.read(output)
+        ids = [formats.Binary.loads(value)['message_id'] for value in result]
+        self.assertEqual(ids, ['1', '2', '3', '4'])
+
+    def test_merge_external(self):
+        '''
+        Test the external merge.
+        '''
+        # Run the test.
+        self.check_merge('created', 'external', 'exact')
+
+    @patch('amtk.apps.merge.builtins')
+    def test_merge_passthrough(self, builtins):
+        '''
+        With passthrough, merged messages are written exactly as they were
+        read, by every engine.
+        '''
+        # Create fake data.
+        line = ('{"record_time":  "2015-01-01T00:00:0%d+00:00", '
+                '"message_id": "%s"}')
+        for engine in ('memory', 'stream', 'external'):
+            args = MagicMock()
+            args.format = 'jsonl'
+            args.compress = 'none'
+            args.start = None
+            args.end = None
+            args.order = 'record'
+            args.engine = engine
+            args.dedup = 'exact'
+            args.memory_limit = 1
+            args.stats = 0
+            args.passthrough = 'yes'
+            args.files = (
+                unittest.file((line % (0, 'a'), line % (2, 'c'))),
+                unittest.file((line % (1, 'b'), line % (2, 'c'))),
+            )
+            builtins.reset_mock()
+
+            # Run the test.
+            merge.merge(args)
+
+            # Check the result.
+            output = builtins.stdout.return_value.write.call_args_list
+            result = ''.join(call[0][0] for call in output)
+            expected = [line % (0, 'a'), line % (1, 'b'), line % (2, 'c')]
+            self.assertEqual(result, '\n'.join(expected) + '\n')
+
+    @patch('amtk.apps.merge.builtins')
+    def test_merge_duplicates(self, builtins):
+        '''
+        memory and external keep the copy of a message from the first file;
+        stream keeps the earliest copy.
+        '''
+        # Create fake data. The second recording saw message b earlier.
+        line = ('{"record_time": "2015-01-01T00:00:0%d+00:00", '
+                '"message_id": "%s", "body": "%s"}')
+        first = (line % (0, 'a', 1), line % (3, 'b', 1))
+        second = (line % (1, 'b', 2), line % (2, 'c', 2))
+
+        def run(engine):
+            args = MagicMock()
+            args.format = 'jsonl'
+            args.compress = 'none'
+            args.start = None
+            args.end = None
+            args.order = 'record'
+            args.engine = engine
+            args.dedup = 'exact'
+            args.memory_limit = 0
+            args.stats = 0
+            args.passthrough = 'yes'
+            args.files = (unittest.file(first), unittest.file(second))
+            builtins.reset_mock()
+            merge.merge(args)
+
+            output = builtins.stdout.return_value.write.call_args_list
+            return ''.join(call[0][0] for call in output).splitlines()
+
+        # Run the test.
+        memory = run('memory')
+        external = run('external')
+        stream = run('stream')
+
+        # Check the result.
+        self.assertEqual(memory, [first[0], second[1], first[1]])
+        self.assertEqual(external, memory)
+        self.assertEqual(stream, [first[0], second[0], second[1]])
+
+    @patch('amtk.apps.merge.OVERHEAD', 0)
+    def test_external_runs(self):
+        '''
+        The external merge sorts unordered files across several runs.
+        '''
+        # Create fake data.
+        line = ('{"creation_time": "2015-01-01T00:00:0%d+00:00", '
+                '"record_time": null, "message_id": "%s"}')
+        args = MagicMock()
+        args.format = 'jsonl'
+        args.start = None
+        args.end = None
+        args.memory_limit = 0.0001
+        args.files = (
+            unittest.file((line % (3, 'd'), line % (0, 'a'), line % (2, 'c'))),
+            unittest.file((line % (4, 'e'), line % (1, 'b'), line % (2, 'c'))),
+        )
+
+        # Run the test.
+        with patch('amtk.apps.merge.spill', wraps=merge.spill) as spill:
+            index = dedup.Exact()
+            result = list(merge.external(args, 'creation_time', index))
+
+        # Check the result.
+        ids = [json.loads(value)['message_id'] for value in result]
+        self.assertEqual(ids, ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(spill.call_count, 3)
+        self.assertEqual(index.duplicates, 1)
+
+    @patch('amtk.apps.merge.FAN_IN', 2)
+    def test_external_fan_in(self):
+        '''
+        The external merge never reads more than FAN_IN runs at once, and
+        keeps messages at the same time in the order they were read.
+        '''
+        # Create fake data. Every message is spilled to a run of its own.
+        line = ('{"creation_time": "2015-01-01T00:00:0%d+00:00", '
+                '"record_time": null, "message_id": "%s"}')
+        args = MagicMock()
+        args.format = 'jsonl'
+        args.start = None
+        args.end = None
+        args.memory_limit = 0
+        args.passthrough = 'yes'
+        args.files = (
+            unittest.file((line % (3, 'd'), line % (0, 'a'), line % (2, 'c'),
+                           line % (1, 'b1'), line % (4, 'e'))),
+            unittest.file((line % (1, 'b2'), line % (2, 'c'),
+                           line % (0, 'a2'))),
+        )
+
+        # Run the test.
+        with patch('amtk.apps.merge.combine', wraps=merge.combine) as combine:
+            index = dedup.Exact()
+            result = list(merge.external(args, 'creation_time', index))
+
+        # Check the result.
+        ids = [json.loads(value)['message_id'] for value in result]
+        self.assertEqual(ids, ['a', 'a2', 'b1', 'b2', 'c', 'd', 'e'])
+        self.assertEqual(index.duplicates, 1)
+        sizes = [len(call[0][1]) for call in combine.call_args_list]
+        self.assertTrue(all(size <= 2 for size in sizes))
+        self.assertGreater(len(sizes), 4)
+
+    def test_stream_interleaved(self):
+        '''
+        The streaming merge interleaves sorted files and keeps the first copy
+        of each message.
+        '''
+        # Create fake data.
+        line = ('{"creation_time": null, "record_time": '
+                '"2015-01-01T00:00:0%d+00:00", "message_id": "%s"}')
+        args = MagicMock()
+        args.format = 'jsonl'
+        args.start = None
+        args.end = None
+        args.files = (
+            unittest.file((line % (0, 'a'), line % (2, 'c'), line % (3, 'd'))),
+            unittest.file((line % (1, 'b'), line % (2, 'c'), line % (4, 'e'))),
+        )
+
+        # Run the test.
+        index = dedup.Exact()
+        result = merge.stream(args, 'record_time', index)
+
+        # Check the result.
+        ids = [json.loads(value)['message_id'] for value in result]
+        self.assertEqual(ids, ['a', 'b', 'c', 'd', 'e'])
+
+    def test_stream_unsorted(self):
+        '''
+        The streaming merge rejects files that are not in order, rather
+        than writing unsorted output.
+        '''
+        # Create fake data.
+        line = ('{"creation_time": null, "record_time": '
+                '"2015-01-01T00:00:0%d+00:00", "message_id": "%s"}')
+        args = MagicMock()
+        args.format = 'jsonl'
+        args.start = None
+        args.end = None
+        args.files = (
+            unittest.file((line % (0, 'a'), line % (2, 'c'))),
+            unittest.file((line % (1, 'b'), line % (0, 'd'))),
+        )
+
+        # Run the test.
+        result = merge.stream(args, 'record_time', dedup.Exact())
+        with self.assertRaisesRegexp(ValueError, 'Message 2 of file 2'):
+            list(result)
 
     @patch('amtk.apps.merge.merge')
     @patch('amtk.apps.merge.options')
@@ -466,10 +1536,364 @@ class Merge(unittest.TestCase):
         '''
         A test for the main function.
         '''
+        # Create fake data.
+        args = options.parse.return_value.parse_args.return_value
+        args.profile = False
+        args.codec = 'auto'
+
         # Run the test.
         merge.main()
 
 
+class Convert(unittest.TestCase):
+    '''
+    Tests for functions in the convert module.
+    '''
+    def run_convert(self, source, target, data, name=None):
+        '''
+        Converts data from the source to the target format.
+        '''
+        # Create fake data. Files are opened in text mode, as they are on
+        # the command line.
+        input = io.BufferedReader(io.BytesIO(data))
+        output = io.BytesIO()
+        output.name = name
+        output.close = MagicMock()
+        args = MagicMock()
+        args.format = source
+        args.compress = 'auto'
+        args.to = target
+        args.input = io.TextIOWrapper(input, encoding='utf-8')
+        args.output = io.TextIOWrapper(output, encoding='utf-8')
+
+        # Run the test.
+        convert.convert(args)
+
+        return output.getvalue()
+
+    @patch('amtk.apps.convert.builtins')
+    def test_convert(self, builtins):
+        '''
+        Converting to binary and back preserves the messages.
+        '''
+        # Create fake data.
+        lines = [CONTENT[7], CONTENT[0], CONTENT[2]]
+        data = '\n'.join(lines).encode('utf-8') + b'\n'
+
+        # Run the test.
+        binary = self.run_convert('jsonl', 'binary', data)
+        result = self.run_convert('binary', 'jsonl', binary)
+
+        # Check the result.
+        result = result.decode('utf-8').splitlines()
+        self.assertEqual(len(result), 2)
+
+        # Fields missing from the source are written as null.
+        for value, line in zip(result, (CONTENT[7], CONTENT[2])):
+            value = json.loads(value)
+            for key, expected in json.loads(line).items():
+                self.assertEqual(value[key], expected)
+        self.assertEqual(builtins.print_error.call_count, 1)
+
+    def test_convert_compressed(self):
+        '''
+        Outputs are compressed by extension and inputs by their contents.
+        '''
+        # Create fake data.
+        data = (CONTENT[7] + '\n').encode('utf-8')
+
+        # Run the test.
+        binary = self.run_convert('jsonl', 'binary', data, 'test.bin.gz')
+        result = self.run_convert('binary', 'jsonl', binary)
+
+        # Check the result.
+        self.assertEqual(binary[:2], b'\x1f\x8b')
+        self.assertEqual(json.loads(result)['message_id'], '4')
+
+    @patch('amtk.apps.convert.convert')
+    @patch('amtk.apps.convert.options')
+    def test_main(self, options, _convert):
+        '''
+        A test for the main function.
+        '''
+        # Create fake data.
+        args = options.parse.return_value.parse_args.return_value
+        args.codec = 'auto'
+
+        # Run the test.
+        convert.main()
+
+
+class Index(unittest.TestCase):
+    '''
+    Tests for functions in the index module.
+    '''
+    @patch('amtk.apps.index.builtins')
+    def test_index(self, builtins):
+        '''
+        Recordings in record order are indexed, and others are reported.
+        '''
+        # Create test data.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        names = []
+        for name, lines in (('a', CONTENT[5:8]), ('b', CONTENT[7:4:-1])):
+            names.append(os.path.join(directory, name))
+            with open(names[-1], 'w') as file:
+                file.write('\n'.join(lines) + '\n')
+
+        args = MagicMock()
+        args.format = 'jsonl'
+        args.compress = 'none'
+        args.index_every = 2
+        args.files = [open(name) for name in names]
+        args.files.append(MagicMock())
+
+        # Run the test.
+        index.index(args)
+        for file in args.files[:2]:
+            file.close()
+
+        # Check the result.
+        with open(names[0]) as file:
+            entries = seek.load(file)
+        self.assertEqual([entry[2] for entry in entries], [0, 2])
+        self.assertFalse(os.path.exists(names[1] + seek.EXTENSION))
+        self.assertEqual(builtins.print_error.call_count, 2)
+
+    @patch('amtk.apps.index.index')
+    @patch('amtk.apps.index.options')
+    def test_main(self, options, _index):
+        '''
+        A test for the main function.
+        '''
+        # Run the test.
+        index.main()
+
+
+class Benchmark(unittest.TestCase):
+    '''
+    Tests for functions in the benchmark module.
+    '''
+    def settings(self, format):
+        '''
+        Returns the settings of a small benchmark.
+        '''
+        result = MagicMock()
+        result.messages = 6
+        result.body_size = 8
+        result.headers = 1
+        result.files = 2
+        result.engine = 'stream'
+        result.format = format
+        result.codec = 'auto'
+        result.passthrough = 'yes'
+        result.label = 'test'
+        return result
+
+    def test_benchmarks(self):
+        '''
+        Every benchmark handles every message in either format, and the
+        stand-ins are removed afterwards.
+        '''
+        # Create test data.
+        connect = benchmark.messages.connect
+        stdout = benchmark.builtins.stdout
+
+        for format in ('jsonl', 'binary'):
+            for name in list(benchmark.BENCHMARKS)[:-1]:
+                # Run the test.
+                result = benchmark.measure(name, self.settings(format))
+
+                # Check the result.
+                self.assertEqual(result['benchmark'], name)
+                self.assertEqual(result['label'], 'test')
+                self.assertEqual(result['messages'], 6)
+                self.assertGreater(result['bytes'], 6 * 8)
+                self.assertGreater(result['message_rate'], 0)
+
+        self.assertIs(benchmark.messages.connect, connect)
+        self.assertIs(benchmark.builtins.stdout, stdout)
+
+    def test_startup(self):
+        '''
+        Every tool is started as many times as asked.
+        '''
+        # Create test data.
+        settings = self.settings('jsonl')
+        settings.launches = 1
+
+        # Run the test.
+        result = benchmark.measure('startup', settings)
+
+        # Check the result.
+        self.assertEqual(result['messages'], len(benchmark.TOOLS))
+        self.assertGreater(result['seconds'], 0)
+
+    def test_startup_imports(self):
+        '''
+        Starting a tool doesn't import the modules that are slow to import.
+        '''
+        # Create test data.
+        tools = ', '.join(benchmark.TOOLS)
+        script = ('import sys, json; from amtk.apps import %s; '
+                  'print(json.dumps(list(sys.modules)))' % tools)
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(benchmark.__file__)
+        )))
+
+        # Run the test.
+        output = subprocess.check_output(
+            [sys.executable, '-c', script], cwd=root
+        )
+
+        # Check the result.
+        modules = set(json.loads(output.decode('utf-8')))
+        slow = ('pika', 'pkg_resources', 'dateutil', 'pytz', 'asyncio',
+                'multiprocessing', 'sqlite3')
+        self.assertFalse(modules.intersection(slow))
+
+    @patch('amtk.apps.benchmark.builtins')
+    @patch('amtk.apps.benchmark.isolated')
+    def test_benchmark(self, isolated, builtins):
+        '''
+        Each chosen benchmark is run in its own process as many times as
+        asked, and printed as json.
+        '''
+        # Create test data.
+        args = self.settings('jsonl')
+        args.only = ['play.play']
+        args.repeat = 2
+        isolated.side_effect = lambda name, settings: {'benchmark': name}
+
+        # Run the test.
+        benchmark.benchmark(args)
+
+        # Check the result.
+        lines = [call[0][0] for call in builtins.print_text.call_args_list]
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'benchmark': 'play.play', 'run': 0},
+            {'benchmark': 'play.play', 'run': 1},
+        ])
+
+    @patch('amtk.apps.benchmark.benchmark')
+    @patch('amtk.apps.benchmark.options')
+    def test_main(self, options, _benchmark):
+        '''
+        A test for the main function.
+        '''
+        # Run the test.
+        benchmark.main()
+
+
+class Generate(unittest.TestCase):
+    '''
+    Tests for functions in the generate module.
+    '''
+    def settings(self, format):
+        '''
+        Returns the arguments of a small recording.
+        '''
+        result = MagicMock()
+        result.messages = 5
+        result.rate = 10.0
+        result.arrival = 'poisson'
+        result.burst = 1
+        result.body_size = 4
+        result.body_distribution = 'uniform'
+        result.routing_keys = 2
+        result.header = [('tenant', 't-{key}')]
+        result.exchange = 'test'
+        result.start = '2015-01-01T00:00:00'
+        result.seed = 0
+        result.format = format
+        result.compress = 'auto'
+        result.output = io.StringIO()
+        result.output.close = MagicMock()
+        return result
+
+    @patch('amtk.apps.play.pika')
+    def test_generate(self, pika):
+        '''
+        Generated recordings can be played.
+        '''
+        # Create test data.
+        args = self.settings('jsonl')
+
+        # Run the test.
+        generate.generate(args)
+
+        # Check the result.
+        lines = args.output.getvalue().splitlines()
+        self.assertEqual(len(lines), 5)
+
+        settings = MagicMock()
+        settings.format = 'jsonl'
+        settings.timing = 'none'
+        settings.routing_key = None
+        channel = MagicMock()
+        for line in lines:
+            play.publish(None, play.wait_none, settings, channel, line)
+
+        self.assertEqual(channel.basic_publish.call_count, 5)
+        headers = pika.spec.BasicProperties.call_args[1]['headers']
+        self.assertTrue(headers['tenant'].startswith('t-synthetic.'))
+
+    def test_generate_binary(self):
+        '''
+        Binary recordings hold the same messages.
+        '''
+        # Create test data.
+        args = self.settings('binary')
+        expected = self.settings('jsonl')
+
+        # Run the test.
+        output = io.BytesIO()
+        output.close = MagicMock()
+        args.output = io.TextIOWrapper(output, encoding='utf-8')
+        generate.generate(args)
+        generate.generate(expected)
+
+        # Check the result.
+        file = io.BytesIO(output.getvalue())
+        result = [
+            formats.Binary.loads(record)
+            for record in formats.Binary.read(file)
+        ]
+        lines = expected.output.getvalue().splitlines()
+        self.assertEqual(len(result), 5)
+        for data, line in zip(result, lines):
+            line = json.loads(line)
+            self.assertEqual(data['message_id'], line['message_id'])
+            self.assertEqual(data['body'], line['body'].encode('utf-8'))
+            self.assertEqual(data['record_time'],
+                             time.parse(line['record_time']))
+
+    def test_generate_invalid(self):
+        '''
+        The rate must be positive, and bursts must have messages.
+        '''
+        # Create test data.
+        args = self.settings('jsonl')
+        args.rate = 0
+
+        # Run the test.
+        self.assertRaises(ValueError, generate.generate, args)
+        args.rate = 1
+        args.burst = 0
+        self.assertRaises(ValueError, generate.generate, args)
+        self.assertEqual(args.output.getvalue(), '')
+
+    @patch('amtk.apps.generate.generate')
+    @patch('amtk.apps.generate.options')
+    def test_main(self, options, _generate):
+        '''
+        A test for the main function.
+        '''
+        # Run the test.
+        generate.main()
+
+
 class Integration(unittest.TestCase):
     '''
     Ensures that play can play recordings and vice versa.
@@ -485,6 +1909,8 @@ class Integration(unittest.TestCase):
 
         # Create test data.
         args = MagicMock()
+        args.writer = None
+        args.format = 'jsonl'
         channel = MagicMock()
         method = MagicMock()
         method.exchange = 'exchange'
@@ -505,6 +1931,7 @@ class Integration(unittest.TestCase):
         last = None
         wait = MagicMock()
         args = MagicMock()
+        args.format = 'jsonl'
         args.mandatory = 'no'
         args.immediate = 'no'
         args.timing = 'record'
@@ -599,7 +2026,8 @@ class Integration(unittest.TestCase):
         result = self.run_record(prop, body)
 
         # Check the line.
-        self.assertEqual(result, line)
+        self.assertTrue(result.endswith('\n'))
+        self.assertEqual(json.loads(result), json.loads(line))
 
 
 # Run the tests if the file is called directly.
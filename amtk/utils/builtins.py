@@ -1,9 +1,25 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import sys
+
 
 def print_text(target):
     '''
     To allow the mocking of printing.
     '''
     print(target)
+
+
+def stdout():
+    '''
+    To allow the mocking of the standard output.
+    '''
+    return sys.stdout
+
+
+def print_error(target):
+    '''
+    To allow the mocking of printing to stderr.
+    '''
+    sys.stderr.write('%s\n' % target)
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# orjson decodes integers wider than 64 bits as floats at least this large.
+WIDE = 2.0 ** 63
+
+# The types that orjson always decodes exactly.
+EXACT = frozenset((str, int, bool, type(None)))
+
+
+def wide(value):
+    '''
+    Returns True if value, as decoded by orjson, may have had an integer
+    wider than 64 bits.
+    '''
+    kind = type(value)
+    if kind is dict:
+        value = value.values()
+    elif kind is not list:
+        return kind is float and abs(value) >= WIDE
+
+    # Most values are strings, so containers are only searched if they
+    # hold anything else.
+    if EXACT.issuperset(map(type, value)):
+        return False
+
+    for item in value:
+        if type(item) not in EXACT and wide(item):
+            return True
+
+    return False
+
+
+class Json(object):
+    '''
+    The json module of the standard library.
+    '''
+    @staticmethod
+    def loads(text):
+        return json.loads(text)
+
+    @staticmethod
+    def dumps(data, default=None):
+        return json.dumps(data, default=default)
+
+
+class Orjson(object):
+    '''
+    orjson, which encodes and decodes several times faster than the standard
+    library. It writes json without spaces, and writes NaN and infinite
+    floats as null. Messages it can't encode, or decode exactly, are handled
+    by the standard library instead; such as those with integers wider than
+    64 bits, or with the NaN and Infinity the standard library writes.
+    '''
+    @staticmethod
+    def loads(text):
+        try:
+            result = orjson.loads(text)
+        except orjson.JSONDecodeError:
+            return json.loads(text)
+
+        if wide(result):
+            return json.loads(text)
+
+        return result
+
+    @staticmethod
+    def dumps(data, default=None):
+        try:
+            return orjson.dumps(data, default=default).decode('utf-8')
+        except TypeError:
+            return json.dumps(data, default=default)
+
+
+# The available codecs, from the fastest. orjson is optional.
+CODECS = {
+    'json': Json,
+}
+if orjson is not None:
+    CODECS['orjson'] = Orjson
+
+PREFERENCE = ('orjson', 'json')
+
+
+def get(name):
+    '''
+    Returns the named codec. auto picks the fastest that is installed.
+    Raises a ValueError if the codec isn't installed.
+    '''
+    if name == 'auto':
+        name = next(name for name in PREFERENCE if name in CODECS)
+
+    result = CODECS.get(name)
+    if result is None:
+        raise ValueError('The %s codec is not installed.' % name)
+
+    return result
+
+
+# The codec used to read and write recordings.
+ACTIVE = get('auto')
+
+
+def use(name):
+    '''
+    Reads and writes recordings with the named codec from now on.
+    '''
+    global ACTIVE
+    ACTIVE = get(name)
+
+
+def loads(text):
+    '''
+    Decodes json. Raises a ValueError if it is invalid.
+    '''
+    return ACTIVE.loads(text)
+
+
+def dumps(data, default=None):
+    '''
+    Encodes json. default is called with values that can't be encoded, as
+    it is by json.dumps.
+    '''
+    return ACTIVE.dumps(data, default)
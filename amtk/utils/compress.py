@@ -0,0 +1,295 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import bz2
+import gzip
+import zlib
+import threading
+import queue as Queue
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+# The number of writes that can wait to be compressed before writers block.
+QUEUE_SIZE = 1024
+
+# Tells the compression thread to flush what it has compressed so far.
+FLUSH = object()
+
+
+class Gzip(object):
+    '''
+    gzip compression. Flushes are written as sync points, so a reader piped
+    to the output sees every flushed message straight away.
+    '''
+    extensions = ('.gz', '.gzip')
+    magic = b'\x1f\x8b'
+
+    @staticmethod
+    def compressor():
+        '''
+        Returns a compressor that writes a gzip stream.
+        '''
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    @staticmethod
+    def sync(compressor):
+        '''
+        Returns everything compressed so far.
+        '''
+        return compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    @staticmethod
+    def open(file):
+        '''
+        Returns a binary file that decompresses the file.
+        '''
+        return gzip.GzipFile(fileobj=file, mode='rb')
+
+
+class Bzip2(object):
+    '''
+    bzip2 compression. Data is only written once a whole block is compressed,
+    so flushes do not reach readers straight away.
+    '''
+    extensions = ('.bz2', '.bzip2')
+    magic = b'BZh'
+
+    @staticmethod
+    def compressor():
+        '''
+        Returns a compressor that writes a bzip2 stream.
+        '''
+        return bz2.BZ2Compressor()
+
+    @staticmethod
+    def sync(compressor):
+        '''
+        bzip2 cannot flush part of a block.
+        '''
+        return b''
+
+    @staticmethod
+    def open(file):
+        '''
+        Returns a binary file that decompresses the file.
+        '''
+        return bz2.BZ2File(file, mode='rb')
+
+
+class Xz(object):
+    '''
+    xz compression. Like bzip2, flushes do not reach readers straight away.
+    '''
+    extensions = ('.xz', )
+    magic = b'\xfd7zXZ\x00'
+
+    @staticmethod
+    def compressor():
+        '''
+        Returns a compressor that writes an xz stream.
+        '''
+        return lzma.LZMACompressor()
+
+    @staticmethod
+    def sync(compressor):
+        '''
+        xz cannot flush part of a block.
+        '''
+        return b''
+
+    @staticmethod
+    def open(file):
+        '''
+        Returns a binary file that decompresses the file.
+        '''
+        return lzma.LZMAFile(file, mode='rb')
+
+
+# The available compression methods. xz requires the lzma module.
+METHODS = {
+    'gzip': Gzip,
+    'bz2': Bzip2,
+}
+if lzma is not None:
+    METHODS['xz'] = Xz
+
+
+class Writer(io.BufferedIOBase):
+    '''
+    Compresses data on a background thread and writes it to a binary file.
+    Writes and flushes only queue work for the thread, so they don't wait for
+    compression unless the queue is full. Errors raised by the thread are
+    raised by the next write or close.
+    '''
+    def __init__(self, file, method, size=QUEUE_SIZE):
+        super(Writer, self).__init__()
+        self.file = file
+        self.method = method
+        self.compressor = method.compressor()
+        self.queue = Queue.Queue(size)
+        self.error = None
+
+        # Start compressing.
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def writable(self):
+        return True
+
+    def check(self):
+        '''
+        Raises any error from the compression thread.
+        '''
+        if self.error is not None:
+            raise IOError('Compression failed: %s' % self.error)
+
+    def write(self, data):
+        '''
+        Queues data to be compressed.
+        '''
+        self.check()
+        data = bytes(data)
+        self.queue.put(data)
+        return len(data)
+
+    def flush(self):
+        '''
+        Queues a flush of everything written so far.
+        '''
+        if self.thread.is_alive():
+            self.queue.put(FLUSH)
+
+    def join(self):
+        '''
+        Waits until everything written so far has been compressed, flushed
+        and written to the file.
+        '''
+        self.flush()
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        '''
+        Waits for the queued data to be compressed and ends the stream. The
+        underlying file is flushed but left open.
+        '''
+        if self.closed:
+            return
+
+        self.queue.put(None)
+        self.thread.join()
+        super(Writer, self).close()
+        self.check()
+
+    def run(self):
+        '''
+        Compresses queued data until the writer is closed.
+        '''
+        item = True
+        while item is not None:
+            item = self.queue.get()
+
+            try:
+                # Drain the queue after an error, so that writers never block.
+                if self.error is not None:
+                    continue
+
+                elif item is None:
+                    self.file.write(self.compressor.flush())
+                    self.file.flush()
+
+                elif item is FLUSH:
+                    self.file.write(self.method.sync(self.compressor))
+                    self.file.flush()
+
+                else:
+                    self.file.write(self.compressor.compress(item))
+
+            except Exception as error:
+                self.error = error
+
+            finally:
+                self.queue.task_done()
+
+
+def binary(file):
+    '''
+    Returns the binary stream underlying a file.
+    '''
+    return getattr(file, 'buffer', file)
+
+
+def detect(file, method, magic=False, name=None):
+    '''
+    Returns the compression method to use for a file, or None. auto picks the
+    method from the file extension and, if magic is set, from the first bytes
+    of the file. name overrides the name of the file.
+    '''
+    if method != 'auto':
+        return METHODS.get(method)
+
+    # Check the extension.
+    if name is None:
+        name = getattr(file, 'name', None)
+    if isinstance(name, str):
+        extension = os.path.splitext(name)[1].lower()
+        for result in METHODS.values():
+            if extension in result.extensions:
+                return result
+
+    # Check the first bytes.
+    peek = getattr(binary(file), 'peek', None)
+    if magic and peek is not None:
+        start = peek(8)
+        for result in METHODS.values():
+            if start.startswith(result.magic):
+                return result
+
+    return None
+
+
+def text(stream, file):
+    '''
+    Returns a text file that reads or writes the binary stream, which wraps
+    file.
+    '''
+    result = io.TextIOWrapper(stream, encoding='utf-8')
+
+    # The file closes once it is garbage collected, so keep it for as long as
+    # the result is in use.
+    result.source = file
+    return result
+
+
+def output(file, method, name=None):
+    '''
+    Returns a text file that compresses what is written to the file, or the
+    file itself if it is not compressed. Binary data can be written to the
+    buffer attribute of the result. name overrides the name of the file when
+    picking the method.
+    '''
+    method = detect(file, method, name=name)
+    if method is None:
+        return file
+
+    return text(Writer(binary(file), method), file)
+
+
+def input(file, method):
+    '''
+    Returns a text file that decompresses the file, or the file itself if it
+    is not compressed. Binary data can be read from the buffer attribute of
+    the result.
+    '''
+    method = detect(file, method, magic=True)
+    if method is None:
+        return file
+
+    return text(method.open(binary(file)), file)
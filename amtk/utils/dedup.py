@@ -0,0 +1,179 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import math
+import array
+import hashlib
+from amtk.utils import misc
+
+
+# sqlite3 is only imported once ids are kept on disk.
+sqlite3 = misc.Lazy('sqlite3')
+
+
+def digest(id, size=8):
+    '''
+    Returns a hash of the message id as an integer of size bytes.
+    '''
+    value = ('%s' % id).encode('utf-8')
+    result = hashlib.blake2b(value, digest_size=size).digest()
+    return int.from_bytes(result, 'big')
+
+
+class Exact(object):
+    '''
+    Remembers message ids using a set. Fast, but the memory used grows with
+    the size of the ids.
+    '''
+    def __init__(self):
+        self.ids = set()
+        self.duplicates = 0
+
+    def add(self, id):
+        '''
+        Adds the id to the index. Returns True if the id is new.
+        '''
+        if id in self.ids:
+            self.duplicates += 1
+            return False
+
+        self.ids.add(id)
+        return True
+
+    def close(self):
+        pass
+
+
+class Hashed(object):
+    '''
+    Remembers 64 bit hashes of message ids in an open addressed table. Each
+    id costs between 16 and 32 bytes regardless of its size. Two different
+    ids can collide, but with 100 million ids the chance of any collision is
+    roughly one in four thousand.
+    '''
+    def __init__(self, capacity=1024):
+        self.table = array.array('Q', [0]) * capacity
+        self.size = 0
+        self.duplicates = 0
+
+    def probe(self, table, value):
+        '''
+        Returns the slot holding the value, or the empty slot where it
+        belongs.
+        '''
+        mask = len(table) - 1
+        slot = value & mask
+        while table[slot] and table[slot] != value:
+            slot = (slot + 1) & mask
+
+        return slot
+
+    def grow(self):
+        '''
+        Doubles the size of the table.
+        '''
+        table = array.array('Q', [0]) * (len(self.table) * 2)
+        for value in self.table:
+            if value:
+                table[self.probe(table, value)] = value
+
+        self.table = table
+
+    def add(self, id):
+        '''
+        Adds the id to the index. Returns True if the id is new.
+        '''
+        # Zero marks an empty slot.
+        value = digest(id) or 1
+
+        slot = self.probe(self.table, value)
+        if self.table[slot]:
+            self.duplicates += 1
+            return False
+
+        self.table[slot] = value
+        self.size += 1
+
+        # Keep the table at most half full so that probes stay short.
+        if self.size * 2 > len(self.table):
+            self.grow()
+
+        return True
+
+    def close(self):
+        pass
+
+
+class Disk(object):
+    '''
+    Remembers message ids in a temporary database on disk, using a bloom
+    filter in memory to skip the database for ids that are clearly new. The
+    memory used is fixed by the expected number of ids, and the answer is
+    always exact; if more ids arrive than expected, the database is simply
+    consulted more often.
+    '''
+    def __init__(self, expected, error=0.01):
+        # Size the bloom filter for the expected number of ids.
+        expected = max(expected, 1)
+        bits = int(-expected * math.log(error) / math.log(2) ** 2)
+        self.bits = max(bits, 8)
+        self.hashes = max(int(round(self.bits / expected * math.log(2))), 1)
+        self.filter = bytearray((self.bits + 7) // 8)
+        self.duplicates = 0
+
+        # An empty name creates a private database that is deleted when it's
+        # closed.
+        self.database = sqlite3.connect('')
+        self.database.execute('PRAGMA journal_mode = OFF')
+        self.database.execute('PRAGMA synchronous = OFF')
+        self.database.execute(
+            'CREATE TABLE ids (id TEXT PRIMARY KEY) WITHOUT ROWID'
+        )
+
+    def positions(self, id):
+        '''
+        Returns the bloom filter bits for the id.
+        '''
+        value = digest(id, size=16)
+        first, second = value >> 64, value & 0xFFFFFFFFFFFFFFFF
+        for index in range(self.hashes):
+            yield (first + index * second) % self.bits
+
+    def add(self, id):
+        '''
+        Adds the id to the index. Returns True if the id is new.
+        '''
+        key = '%s' % id
+        positions = list(self.positions(key))
+
+        # If every bit is set, the id may have been seen before.
+        seen = all(self.filter[bit >> 3] & (1 << (bit & 7))
+                   for bit in positions)
+        if seen:
+            query = 'SELECT 1 FROM ids WHERE id = ?'
+            if self.database.execute(query, (key, )).fetchone():
+                self.duplicates += 1
+                return False
+
+        # Remember the id.
+        for bit in positions:
+            self.filter[bit >> 3] |= 1 << (bit & 7)
+        self.database.execute('INSERT INTO ids VALUES (?)', (key, ))
+
+        return True
+
+    def close(self):
+        self.database.close()
+
+
+def create(args):
+    '''
+    Returns the index selected by the command line arguments.
+    '''
+    if args.dedup == 'hashed':
+        return Hashed()
+
+    if args.dedup == 'disk':
+        return Disk(args.dedup_expected)
+
+    return Exact()
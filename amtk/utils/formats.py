@@ -0,0 +1,324 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import mmap
+import base64
+import struct
+import datetime
+from amtk.utils import time, codec
+
+
+# The fields of a recorded message, as they are stored in the binary format.
+STRINGS = (
+    'exchange',
+    'routing_key',
+    'message_id',
+    'user_id',
+    'reply_to',
+    'correlation_id',
+    'content_type',
+    'content_encoding',
+)
+TIMES = (
+    'absolute_expiry_time',
+    'creation_time',
+    'record_time',
+)
+
+# Binary recordings start with a magic number and a version.
+MAGIC = b'AMTK'
+VERSION = 1
+HEADER = struct.Struct('>4sH')
+
+# Each binary record is prefixed with its length. Within a record, strings
+# are prefixed with their length, or -1 if they are null, and timestamps are
+# stored as microseconds since the epoch.
+LENGTH = struct.Struct('>I')
+STRING = struct.Struct('>i')
+TIME = struct.Struct('>q')
+NULL = -2 ** 63
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+# Bytes that aren't valid utf-8 are stored base64 encoded, wrapped in an
+# object with this single key.
+BASE64 = 'base64'
+
+
+def encode(value):
+    '''
+    Used by the codec to encode the values that the binary format decodes.
+    Bytes are stored as text if they are utf-8, and base64 encoded if not;
+    see decode.
+    '''
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+
+    if isinstance(value, bytes):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return {BASE64: base64.b64encode(value).decode('ascii')}
+
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def decode(value):
+    '''
+    Returns the bytes encode base64 encoded, found in a body or anywhere in
+    the headers. Other values are returned as they are.
+    '''
+    if isinstance(value, dict):
+        if len(value) == 1 and BASE64 in value:
+            return base64.b64decode(value[BASE64])
+        return {key: decode(item) for key, item in value.items()}
+
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+
+    return value
+
+
+class Jsonl(object):
+    '''
+    One json object per line. Timestamps are ISO 8601 strings.
+    '''
+    # The mode suffix used to open files in this format.
+    mode = ''
+
+    @staticmethod
+    def stream(file):
+        '''
+        Returns the stream the format is read from or written to.
+        '''
+        return file
+
+    @staticmethod
+    def header(file):
+        '''
+        Writes the file header.
+        '''
+
+    @staticmethod
+    def begin(file):
+        '''
+        Reads the file header. Returns False if the file is empty.
+        '''
+        return True
+
+    @staticmethod
+    def records(file):
+        '''
+        Yields each record from the current position in the file. Memory
+        mapped files yield bytes, which json decodes directly.
+        '''
+        return iter(file.readline, b'' if isinstance(file, mmap.mmap) else '')
+
+    @staticmethod
+    def read(file):
+        '''
+        Yields each record in the file.
+        '''
+        return Jsonl.records(file)
+
+    @staticmethod
+    def loads(record):
+        '''
+        Decodes a record. Raises a ValueError if the record is invalid.
+        '''
+        return codec.loads(record)
+
+    @staticmethod
+    def dumps(data):
+        '''
+        Encodes a record.
+        '''
+        return codec.dumps(data, encode)
+
+    @staticmethod
+    def original(record):
+        '''
+        Returns a record as it was read, ready to be written again without
+        being encoded again.
+        '''
+        if isinstance(record, bytes):
+            record = record.decode('utf-8')
+        return record.rstrip('\r\n')
+
+    @staticmethod
+    def write(file, record):
+        '''
+        Writes a record to the file.
+        '''
+        file.write(record + '\n')
+
+
+class Binary(object):
+    '''
+    Length prefixed records following a versioned file header. Bodies are
+    stored as raw bytes and timestamps as integers.
+    '''
+    # The mode suffix used to open files in this format.
+    mode = 'b'
+
+    @staticmethod
+    def stream(file):
+        '''
+        Returns the stream the format is read from or written to. Text files
+        are read and written through their underlying binary buffer.
+        '''
+        return getattr(file, 'buffer', file)
+
+    @staticmethod
+    def header(file):
+        '''
+        Writes the file header.
+        '''
+        file.write(HEADER.pack(MAGIC, VERSION))
+
+    @staticmethod
+    def begin(file):
+        '''
+        Reads the file header. Returns False if the file is empty. Raises a
+        ValueError if the file is not a binary recording.
+        '''
+        header = file.read(HEADER.size)
+        if not header:
+            return False
+        if len(header) < HEADER.size or header[:4] != MAGIC:
+            raise ValueError('The file is not a binary recording.')
+        magic, version = HEADER.unpack(header)
+        if version != VERSION:
+            raise ValueError('Unsupported recording version %d.' % version)
+
+        return True
+
+    @staticmethod
+    def read(file):
+        '''
+        Yields each record in the file. Raises a ValueError if the file is not
+        a binary recording.
+        '''
+        if Binary.begin(file):
+            for record in Binary.records(file):
+                yield record
+
+    @staticmethod
+    def records(file):
+        '''
+        Yields each record from the current position in the file. A truncated
+        record ends the file.
+        '''
+        while True:
+            prefix = file.read(LENGTH.size)
+            if len(prefix) < LENGTH.size:
+                return
+
+            size, = LENGTH.unpack(prefix)
+            record = file.read(size)
+            if len(record) < size:
+                return
+
+            yield record
+
+    @staticmethod
+    def loads(record):
+        '''
+        Decodes a record. Raises a ValueError if the record is invalid.
+        '''
+        def string(offset):
+            size, = STRING.unpack_from(record, offset)
+            offset += STRING.size
+            if size < 0:
+                return None, offset
+            return record[offset:offset + size], offset + size
+
+        try:
+            data = {}
+            offset = 0
+
+            # Decode the strings.
+            for field in STRINGS:
+                value, offset = string(offset)
+                data[field] = None if value is None else value.decode('utf-8')
+
+            # Decode the timestamps.
+            for field in TIMES:
+                value, = TIME.unpack_from(record, offset)
+                offset += TIME.size
+                if value == NULL:
+                    data[field] = None
+                else:
+                    data[field] = time.EPOCH + value * MICROSECOND
+
+            # Decode the headers and body.
+            value, offset = string(offset)
+            headers = None if value is None else value.decode('utf-8')
+            data['headers'] = None if headers is None else codec.loads(headers)
+            data['body'], offset = string(offset)
+
+        except struct.error as error:
+            raise ValueError('Invalid record: %s' % error)
+
+        return data
+
+    @staticmethod
+    def dumps(data):
+        '''
+        Encodes a record. Timestamps can be datetimes or strings.
+        '''
+        def string(value):
+            if value is None:
+                return STRING.pack(-1)
+            if not isinstance(value, bytes):
+                value = (u'%s' % value).encode('utf-8')
+            return STRING.pack(len(value)) + value
+
+        parts = [string(data.get(field)) for field in STRINGS]
+
+        # Encode the timestamps.
+        parser = time.parse
+        for field in TIMES:
+            value = data.get(field)
+            if value is not None:
+                value = (parser(value) - time.EPOCH) // MICROSECOND
+            parts.append(TIME.pack(NULL if value is None else value))
+
+        # Encode the headers and body. Header values pika decodes as
+        # timestamps and byte arrays are encoded as they are in jsonl.
+        headers = data.get('headers')
+        if headers is not None:
+            headers = codec.dumps(headers, encode)
+        parts.append(string(headers))
+        parts.append(string(decode(data.get('body'))))
+
+        return b''.join(parts)
+
+    @staticmethod
+    def original(record):
+        '''
+        Returns a record as it was read, ready to be written again without
+        being encoded again.
+        '''
+        return record
+
+    @staticmethod
+    def write(file, record):
+        '''
+        Writes a record to the file.
+        '''
+        file.write(LENGTH.pack(len(record)) + record)
+
+
+# The available formats.
+FORMATS = {
+    'jsonl': Jsonl,
+    'binary': Binary,
+}
+
+
+def get(name):
+    '''
+    Returns the format with the given name.
+    '''
+    return FORMATS[name]
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import mmap
+import stat
+
+
+def view(stream):
+    '''
+    Returns a read only memory map of a stream that reads a regular file,
+    positioned where the stream is. Anything else, such as a pipe or a
+    decompressed stream, is returned as it is.
+
+    Maps are read as bytes rather than text, and share the page cache with
+    every other tool reading the same recording.
+    '''
+    # Only plain files are mapped; compressed streams also have a fileno.
+    binary = getattr(stream, 'buffer', stream)
+    if not isinstance(binary, (io.BufferedReader, io.BufferedRandom,
+                               io.FileIO)):
+        return stream
+
+    try:
+        fileno = binary.fileno()
+        if not stat.S_ISREG(os.fstat(fileno).st_mode):
+            return stream
+
+        result = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+    except (EnvironmentError, ValueError):
+        # Empty files cannot be mapped.
+        return stream
+
+    # Recordings are read from start to end.
+    if hasattr(result, 'madvise'):
+        result.madvise(mmap.MADV_SEQUENTIAL)
+
+    result.seek(binary.tell())
+    return result
+
+
+def close(stream):
+    '''
+    Closes a stream returned by view if it is a memory map.
+    '''
+    if isinstance(stream, mmap.mmap):
+        stream.close()
@@ -1,12 +1,20 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import pika
+import time
+import collections
+from amtk.utils import misc, transport
+
+
+# pika is only imported once a connection is made.
+pika = misc.Lazy('pika')
 
 
 def connect(args):
     '''
     Connect to the amqp server. Returns the connection and channel objects.
+    With the asyncio transport, broker I/O runs on a background event loop;
+    see transport.Connection.
     '''
     # Decode the connection parameters.
     credentials = pika.credentials.PlainCredentials(
@@ -21,36 +29,71 @@ def connect(args):
     )
 
     # Create the connection and channel.
-    connection = pika.BlockingConnection(parameters)
+    if args.transport == 'asyncio':
+        connection = transport.Connection(parameters)
+    else:
+        connection = pika.BlockingConnection(parameters)
     channel = connection.channel()
 
-    # Declare the exchange.
-    channel.exchange_declare(
-        exchange=args.exchange,
-        passive=True,
-    )
+    # Declare the exchanges.
+    for exchange in exchanges(args):
+        channel.exchange_declare(
+            exchange=exchange,
+            passive=True,
+        )
 
     return connection, channel
 
 
+def bindings(args):
+    '''
+    Returns the (exchange, routing key) pairs to subscribe to; the one given
+    by the exchange and routing key, followed by any extra bindings.
+    '''
+    result = [(args.exchange, args.routing_key)]
+    for binding in getattr(args, 'bind', None) or ():
+        if binding not in result:
+            result.append(binding)
+
+    return result
+
+
+def exchanges(args):
+    '''
+    Returns every exchange used, in order, without duplicates.
+    '''
+    result = []
+    for exchange, routing_key in bindings(args):
+        if exchange not in result:
+            result.append(exchange)
+
+    return result
+
+
 def subscribe(channel, args):
     '''
-    Create a queue to subscribe to the exchange.
+    Create a queue to subscribe to the exchange, and to any extra bindings;
+    every binding shares the queue. When messages are acked, a named queue
+    outlives the subscriber, so that messages that were not acked are
+    delivered to the next one.
     '''
     # Create the queue.
+    durable = args.ack == 'yes' and bool(args.queue)
     result = channel.queue_declare(
         queue=args.queue,
-        exclusive=True,
-        auto_delete=True,
+        durable=durable,
+        exclusive=not durable,
+        auto_delete=not durable,
     )
     queue = result.method.queue
 
-    # Bind to the exchange.
-    channel.queue_bind(
-        queue=queue,
-        exchange=args.exchange,
-        routing_key=args.routing_key,
-    )
+    # Bind to the exchanges.
+    for exchange, routing_key in bindings(args):
+        channel.queue_bind(
+            queue=queue,
+            exchange=exchange,
+            routing_key=routing_key,
+        )
 
     return queue
 
@@ -63,3 +106,196 @@ def qos(channel, args):
         prefetch_size=args.prefetch_size,
         prefetch_count=args.prefetch_count,
     )
+
+
+class Adaptive(object):
+    '''
+    Tunes the prefetch count of a consumer between low and high. The queue
+    depth is sampled with a passive declare every time tune is called. While
+    messages are waiting in the queue the prefetch count is doubled, and once
+    the queue is empty it's halved for as long as fewer messages than the
+    prefetch count were consumed since the last sample.
+    '''
+    def __init__(self, channel, queue, low, high, size=0, clock=time.time):
+        self.channel = channel
+        self.queue = queue
+        self.low = low
+        self.high = high
+        self.size = size
+        self.clock = clock
+
+        # The current prefetch count, and the messages consumed since the
+        # last sample was taken.
+        self.count = low
+        self.consumed = 0
+        self.last = clock()
+
+    def add(self):
+        '''
+        Counts a consumed message.
+        '''
+        self.consumed += 1
+
+    def tune(self):
+        '''
+        Samples the queue and changes the prefetch count if needed. Returns
+        a description of the change, or None if the count is unchanged.
+        '''
+        # Sample the queue depth and the consumer throughput.
+        result = self.channel.queue_declare(queue=self.queue, passive=True)
+        depth = result.method.message_count
+        now = self.clock()
+        elapsed = now - self.last
+        rate = self.consumed / elapsed if elapsed > 0 else 0.0
+
+        # Pick the new count.
+        count = self.count
+        if depth > 0:
+            count = min(self.high, self.count * 2)
+        elif self.consumed < self.count:
+            count = max(self.low, self.count // 2)
+
+        consumed = self.consumed
+        self.consumed = 0
+        self.last = now
+
+        if count == self.count:
+            return None
+
+        self.channel.basic_qos(prefetch_size=self.size, prefetch_count=count)
+        change = ('Prefetch count changed from %d to %d; %d messages queued, '
+                  '%d consumed at %.1f messages per second.')
+        change %= (self.count, count, depth, consumed, rate)
+        self.count = count
+
+        return change
+
+
+class Acknowledged(object):
+    '''
+    Acks consumed messages in batches. Once the messages written so far are
+    safely stored, store marks them, and ack acks all of them at once with a
+    single multiple ack. Messages can be added and stored on a writer
+    thread; only ack uses the channel.
+    '''
+    def __init__(self, channel):
+        self.channel = channel
+
+        # The delivery tags of the last message written, the last message
+        # stored and the last message acked.
+        self.tag = None
+        self.stored = None
+        self.acked = None
+
+    def add(self, tag):
+        '''
+        Adds the delivery tag of a message that has been written.
+        '''
+        self.tag = tag
+
+    def store(self):
+        '''
+        Marks every message added so far as safely stored.
+        '''
+        self.stored = self.tag
+
+    def ack(self):
+        '''
+        Acks every message stored so far.
+        '''
+        tag = self.stored
+        if tag is None or tag == self.acked:
+            return
+
+        self.channel.basic_ack(delivery_tag=tag, multiple=True)
+        self.acked = tag
+
+
+def confirms(channel, callback):
+    '''
+    Enables publisher confirms on channel, calling callback with the frame
+    of every ack and nack. Unlike the channel's own confirm_delivery, this
+    doesn't make publishes wait for their confirms.
+    '''
+    # The channels of the asyncio transport hand confirms back to the thread
+    # using the connection.
+    if isinstance(channel, transport.Channel):
+        channel.confirm_delivery(callback)
+        return
+
+    # The blocking channel of pika 1.x has no public way to take confirms as
+    # callbacks; its confirm_delivery makes every publish wait for the
+    # broker. The underlying asynchronous channel does take a callback, and
+    # the blocking connection runs it whenever it processes events. This is
+    # the only place the private channel is used.
+    channel._impl.confirm_delivery(callback)
+
+
+class Confirmed(object):
+    '''
+    Wraps a channel so that the broker confirms every publish. Rather than
+    waiting for each confirm in turn, up to window publishes are allowed to
+    be in flight; acks and nacks are collected as they arrive.
+    '''
+    def __init__(self, connection, channel, window):
+        self.connection = connection
+        self.channel = channel
+        self.window = window
+
+        # A map between the delivery tags that have not been confirmed and
+        # the message ids that were published with them. Tags are assigned
+        # by the broker in publish order, starting at 1.
+        self.tag = 0
+        self.pending = collections.OrderedDict()
+        self.acked = 0
+        self.nacked = []
+
+        # Confirms are handled whenever the connection processes events.
+        confirms(channel, self.confirm)
+
+    def confirm(self, frame):
+        '''
+        Called by pika when the broker acks or nacks a publish.
+        '''
+        method = frame.method
+        nack = isinstance(method, pika.spec.Basic.Nack)
+
+        # Get the confirmed tags.
+        if method.multiple:
+            tags = [tag for tag in self.pending if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+
+        # Record the outcome.
+        for tag in tags:
+            id = self.pending.pop(tag, None)
+            if nack:
+                self.nacked.append(id)
+            else:
+                self.acked += 1
+
+    def basic_publish(self, **kwargs):
+        '''
+        Publishes a message once there's room in the window.
+        '''
+        while len(self.pending) >= self.window:
+            self.connection.process_data_events(time_limit=1)
+
+        self.channel.basic_publish(**kwargs)
+
+        self.tag += 1
+        self.pending[self.tag] = kwargs['properties'].message_id
+
+    def drain(self, timeout):
+        '''
+        Waits up to timeout seconds for the outstanding confirms. Returns the
+        message ids that were nacked or never confirmed.
+        '''
+        deadline = time.time() + timeout
+        while self.pending and time.time() < deadline:
+            self.connection.process_data_events(time_limit=1)
+
+        return self.nacked + list(self.pending.values())
+
+    def close(self):
+        self.channel.close()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import importlib
 from contextlib import contextmanager
 
 
@@ -26,3 +27,23 @@ def suppress_interrupt():
 
     except KeyboardInterrupt:
         pass
+
+
+class Lazy(object):
+    '''
+    Stands in for a module that is only imported once one of its attributes
+    is used, so that tools start quickly and only pay for the modules they
+    use. Attributes are kept once they have been looked up.
+    '''
+    def __init__(self, name):
+        self.__name = name
+
+    def __getattr__(self, attribute):
+        # Special attributes, such as those looked up by copy and pickle,
+        # don't import the module.
+        if attribute.startswith('__'):
+            raise AttributeError(attribute)
+
+        result = getattr(importlib.import_module(self.__name), attribute)
+        setattr(self, attribute, result)
+        return result
@@ -1,19 +1,46 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import pkg_resources
 import argparse
 import sys
 
 
+def installed(target):
+    '''
+    Returns the installed version of a package. The metadata is only read
+    when it is asked for, since reading it is slow.
+    '''
+    from importlib import metadata
+    return metadata.version(target)
+
+
+class Version(argparse.Action):
+    '''
+    Prints the version of a package and exits, like the version action.
+    '''
+    def __init__(self, option_strings, target, dest=argparse.SUPPRESS,
+                 default=argparse.SUPPRESS, help=None):
+        super(Version, self).__init__(
+            option_strings=option_strings,
+            dest=dest,
+            default=default,
+            nargs=0,
+            help=help,
+        )
+        self.target = target
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        sys.stdout.write('%s %s\n' % (parser.prog, installed(self.target)))
+        parser.exit()
+
+
 def version(parser, target='amtk'):
     '''
     Adds a version flag to the parser.
     '''
-    # Meta-data about the package comes from pkg_resources.
-    metadata = pkg_resources.require(target)[0]
-    version = '%(prog)s ' + metadata.version
-    parser.add_argument('--version', action='version', version=version)
+    help = "show program's version number and exit"
+    parser.add_argument('--version', action=Version, target=target,
+                        help=help)
 
 
 def order(parser):
@@ -27,6 +54,191 @@ def order(parser):
     parser.add_argument(name, choices=choices, default=default, help=help)
 
 
+def engine(parser):
+    '''
+    Used to choose how the merge is performed.
+    '''
+    help = ('How the merge is performed. memory loads every message before '
+            'sorting them. stream assumes that each file is already in '
+            'order, such as a recording ordered by record time, and merges '
+            'the files without loading them into memory; it stops with an '
+            'error at the first message out of order. external sorts the '
+            'files in runs that fit within the memory limit, spilling each '
+            'run to a temporary file before merging them. memory and '
+            'external keep the copy of a duplicated message from the first '
+            'file given; stream keeps the earliest copy.')
+    name = '--engine'
+    default = 'memory'
+    choices = ('memory', 'stream', 'external')
+    parser.add_argument(name, choices=choices, default=default, help=help)
+
+
+def memory_limit(parser):
+    '''
+    Used to bound the memory used by the external merge.
+    '''
+    help = ('The approximate memory, in megabytes, used to sort each run in '
+            'the external merge. Runs are spilled to the temporary directory, '
+            'which can be set using TMPDIR.')
+    parser.add_argument('--memory_limit', type=int, default=256, help=help)
+
+
+def dedup(parser):
+    '''
+    Used to choose how duplicate messages are detected in the merge.
+    '''
+    help = ('How message ids are remembered to drop duplicates. exact keeps '
+            'every id in memory. hashed keeps a fixed width hash of each id, '
+            'which is compact but can mistake two ids for each other in '
+            'very rare cases. disk keeps the ids in a temporary database, '
+            'using a bloom filter sized by --dedup_expected to avoid most '
+            'lookups.')
+    name = '--dedup'
+    default = 'exact'
+    choices = ('exact', 'hashed', 'disk')
+    parser.add_argument(name, choices=choices, default=default, help=help)
+
+    help = 'The expected number of messages, used to size the bloom filter.'
+    parser.add_argument('--dedup_expected', type=int, default=10000000,
+                        help=help)
+
+
+def stats(parser):
+    '''
+    Adds progress reporting parameters.
+    '''
+    help = ('Report the message and byte rates, totals, invalid messages '
+            'and lag on stderr every this many seconds. 0 disables '
+            'reporting.')
+    parser.add_argument('--stats', type=float, default=0, help=help)
+
+    name = '--stats_format'
+    choices = ('text', 'json')
+    help = 'Report as text, or as one json object per line.'
+    parser.add_argument(name, choices=choices, default='text', help=help)
+
+
+def profile(parser):
+    '''
+    Adds profiling parameters.
+    '''
+    help = ('Time each stage of the tool, such as decoding, parsing '
+            'timestamps, writing and publishing, and report latency '
+            'histograms and peak memory on stderr at the end.')
+    parser.add_argument('--profile', action='store_true', help=help)
+
+    help = ('With --profile, also run cProfile and write its stats to this '
+            'file. Worker processes write to the file name followed by '
+            'their process id.')
+    parser.add_argument('--profile_dump', type=str, help=help)
+
+
+def benchmark(parser):
+    '''
+    Adds the benchmark parameters.
+    '''
+    help = 'The number of messages in each synthetic recording.'
+    parser.add_argument('--messages', type=int, default=100000, help=help)
+
+    help = 'The size of each message body in bytes.'
+    parser.add_argument('--body_size', type=int, default=256, help=help)
+
+    help = 'The number of headers on each message.'
+    parser.add_argument('--headers', type=int, default=4, help=help)
+
+    help = 'The number of recordings the messages are split into for merge.'
+    parser.add_argument('--files', type=int, default=4, help=help)
+
+    help = 'The number of times each benchmark is run.'
+    parser.add_argument('--repeat', type=int, default=1, help=help)
+
+    help = ('Only run this benchmark. Can be given more than once. Defaults '
+            'to every benchmark.')
+    choices = (
+        'record.write', 'play.publish', 'play.play', 'merge.merge', 'startup'
+    )
+    parser.add_argument('--only', action='append', choices=choices,
+                        default=[], help=help)
+
+    help = 'The number of times each tool is started by the startup benchmark.'
+    parser.add_argument('--launches', type=int, default=10, help=help)
+
+    help = ('A label added to every result, such as the version being '
+            'measured, so that results can be compared.')
+    parser.add_argument('--label', type=str, default='', help=help)
+
+
+def header(value):
+    '''
+    Parses a name=template header. The template can use the message number,
+    routing key and message id; for example tenant-{key}.
+    '''
+    name, equals, template = value.partition('=')
+    if not equals or not name:
+        message = 'Headers must be name=template. %s provided.'
+        raise argparse.ArgumentTypeError(message % value)
+
+    try:
+        template.format(number=0, key='', message_id='')
+    except (KeyError, IndexError, ValueError):
+        message = ('Header templates can only use {number}, {key} and '
+                   '{message_id}. %s provided.')
+        raise argparse.ArgumentTypeError(message % value)
+
+    return name, template
+
+
+def generate(parser):
+    '''
+    Adds the synthetic load parameters.
+    '''
+    help = 'The number of messages to generate.'
+    parser.add_argument('--messages', type=int, default=1000000, help=help)
+
+    help = 'The average number of messages recorded per second.'
+    parser.add_argument('--rate', type=float, default=1000, help=help)
+
+    help = ('How messages arrive. constant spaces them evenly. poisson has '
+            'them arrive independently. bursty has them arrive together in '
+            'bursts that arrive independently.')
+    choices = ('constant', 'poisson', 'bursty')
+    parser.add_argument('--arrival', choices=choices, default='constant',
+                        help=help)
+
+    help = 'The average number of messages in each burst.'
+    parser.add_argument('--burst', type=int, default=100, help=help)
+
+    help = 'The average size of each message body in bytes.'
+    parser.add_argument('--body_size', type=int, default=256, help=help)
+
+    help = ('How body sizes vary. fixed makes every body the same size. '
+            'uniform spreads them evenly up to twice the average. '
+            'exponential makes most bodies small with a long tail.')
+    choices = ('fixed', 'uniform', 'exponential')
+    parser.add_argument('--body_distribution', choices=choices,
+                        default='fixed', help=help)
+
+    help = 'The number of distinct routing keys.'
+    parser.add_argument('--routing_keys', type=int, default=16, help=help)
+
+    help = ('Add a header to every message. The template can use {number}, '
+            '{key} and {message_id}; for example tenant={key}. Can be '
+            'repeated.')
+    parser.add_argument('--header', type=header, action='append',
+                        default=[], metavar='NAME=TEMPLATE', help=help)
+
+    help = 'The exchange the messages are recorded from.'
+    parser.add_argument('--exchange', type=str, default='synthetic',
+                        help=help)
+
+    help = ('The time the first message is recorded at. Times without a '
+            'timezone are at UTC.')
+    parser.add_argument('--start', default='2015-01-01T00:00:00', help=help)
+
+    help = 'Seeds the random numbers, so that recordings can be repeated.'
+    parser.add_argument('--seed', type=int, default=0, help=help)
+
+
 def files(parser):
     '''
     Adds a varidac positional option to list files.
@@ -58,18 +270,168 @@ def output(parser):
     parser.add_argument(name, nargs='?', type=type, help=help, default=default)
 
 
+def flush(parser):
+    '''
+    Adds output flushing parameters.
+    '''
+    help = ('Flush the output after this many messages. By default every '
+            'message is flushed as soon as it is written, which is useful '
+            'when piping to another tool.')
+    parser.add_argument('--flush_every', type=int, default=1, help=help)
+
+    help = ('Flush the output once the oldest unflushed message is this many '
+            'milliseconds old. 0 disables the time limit.')
+    parser.add_argument('--flush_ms', type=int, default=0, help=help)
+
+
+def writer(parser):
+    '''
+    Adds writer thread parameters.
+    '''
+    help = ('Write messages on a background thread, queueing up to this many '
+            'messages for it, so that a slow disk does not hold up the '
+            'connection. The deepest the queue got is reported on stderr '
+            'at the end. 0 writes messages as they are consumed.')
+    parser.add_argument('--write_queue', type=int, default=0, help=help)
+
+    name = '--write_policy'
+    choices = ('block', 'drop')
+    help = ('What to do when the write queue is full. block stops consuming '
+            'until there is room. drop drops the message and counts it; '
+            'with --ack it is requeued instead.')
+    parser.add_argument(name, choices=choices, default='block', help=help)
+
+
+def rotate(parser):
+    '''
+    Adds output rotation parameters.
+    '''
+    help = ('Write the recording as numbered segment files next to the '
+            'output, starting a new segment once the current one holds this '
+            'many megabytes before compression. Each segment is written as '
+            'a .part file and renamed once complete, so finished segments '
+            'can be processed while recording continues. 0 disables the '
+            'size limit.')
+    parser.add_argument('--rotate_size', type=int, default=0, help=help)
+
+    help = ('Start a new segment once the first message in the current one '
+            'is this many seconds old. 0 disables the time limit.')
+    parser.add_argument('--rotate_interval', type=float, default=0,
+                        help=help)
+
+
+def index(default=0):
+    '''
+    Adds the number of messages between time index entries.
+    '''
+    def result(parser):
+        help = ('Write a time index next to each recording, with an entry '
+                'every this many messages. The index lets play and merge '
+                'seek to --start instead of reading the whole recording.')
+        if not default:
+            help += ' 0 disables the index.'
+        parser.add_argument('--index_every', type=int, default=default,
+                            help=help)
+
+    return result
+
+
+def window(parser):
+    '''
+    Adds the time window of the messages to read.
+    '''
+    help = ('Only read messages recorded at or after this time; for example '
+            '2015-01-18T14:00:00. Times without a timezone are at UTC.')
+    parser.add_argument('--start', default=None, help=help)
+
+    help = 'Only read messages recorded before this time.'
+    parser.add_argument('--end', default=None, help=help)
+
+
+def format(parser):
+    '''
+    Adds the recording format.
+    '''
+    help = ('The recording format. jsonl stores one json message per line. '
+            'binary stores length prefixed records with raw bodies and '
+            'integer timestamps, which are smaller and faster to read.')
+    name = '--format'
+    choices = ('jsonl', 'binary')
+    parser.add_argument(name, choices=choices, default='jsonl', help=help)
+
+
+def codec(parser):
+    '''
+    Adds the json codec.
+    '''
+    help = ('The json library used to read and write recordings. auto uses '
+            'orjson if it is installed, which is faster but writes json '
+            'without spaces and NaN as null, and the standard library '
+            'otherwise.')
+    name = '--codec'
+    choices = ('auto', 'json', 'orjson')
+    parser.add_argument(name, choices=choices, default='auto', help=help)
+
+
+def passthrough(parser):
+    '''
+    Adds whether merged messages are written as they were read.
+    '''
+    help = ('Write each merged message exactly as it was read. With no, '
+            'every message is decoded and encoded again, which is slower '
+            'but writes every message in the same style.')
+    name = '--passthrough'
+    choices = ('yes', 'no')
+    parser.add_argument(name, choices=choices, default='yes', help=help)
+
+
+def compress(parser):
+    '''
+    Adds the compression method.
+    '''
+    help = ('How recordings are compressed. auto picks the method from the '
+            'file extension (.gz, .bz2 or .xz), or from the start of the '
+            'input when reading. Compression runs on a background thread.')
+    name = '--compress'
+    choices = ('auto', 'none', 'gzip', 'bz2', 'xz')
+    parser.add_argument(name, choices=choices, default='auto', help=help)
+
+
+def convert(parser):
+    '''
+    Adds the format to convert recordings to.
+    '''
+    help = 'The format to convert the recording to.'
+    name = '--to'
+    choices = ('jsonl', 'binary')
+    parser.add_argument(name, choices=choices, default='binary', help=help)
+
+
 def timing(parser):
     '''
     Adds timing parameters.
     '''
     help = ('Configures the time interval between messages. Can be one of '
-            'record, create or the number of seconds between messages. If '
-            'record is specified, the original record timing is used. If '
+            'record, create, none or the number of seconds between messages. '
+            'If record is specified, the original record timing is used. If '
             'create is specified, the created on timestamp is used; note '
-            'that this timing is only accurate to the second. If no timing '
-            'is specified, record is used.')
+            'that this timing is only accurate to the second. If none is '
+            'specified, messages are published as fast as possible. If no '
+            'timing is specified, record is used.')
     parser.add_argument('--timing', default='record', help=help)
 
+    help = ('Limit publishing to this many messages per second, on top of '
+            'the timing.')
+    parser.add_argument('--rate', type=float, help=help)
+
+    help = ('Replay the record or create timing this many times faster. For '
+            'example, 24 replays a day in an hour.')
+    parser.add_argument('--speed', type=float, default=1.0, help=help)
+
+    help = ('Shorten any gap between messages longer than this many recorded '
+            'seconds to this many seconds.')
+    parser.add_argument('--max_gap', type=float, help=help)
+
 
 def publish(parser):
     '''
@@ -86,6 +448,77 @@ def publish(parser):
     parser.add_argument(name, choices=choices, default='no', help=help)
 
 
+def confirm(parser):
+    '''
+    Adds publisher confirm parameters.
+    '''
+    help = ('Ask the broker to confirm every publish, allowing this many '
+            'publishes to wait for a confirm at once. Messages that are '
+            'rejected or never confirmed are reported at the end. 0 '
+            'disables confirms.')
+    parser.add_argument('--confirm', type=int, default=0, help=help)
+
+    help = 'The number of seconds to wait for the last confirms.'
+    parser.add_argument('--confirm_timeout', type=float, default=30,
+                        help=help)
+
+
+def workers(parser):
+    '''
+    Adds parallel publishing parameters.
+    '''
+    help = ('The number of processes used to publish messages, each with its '
+            'own connection. Messages are shared between the processes by '
+            'their recorded routing key, so messages with the same routing '
+            'key are published in order.')
+    parser.add_argument('--workers', type=int, default=1, help=help)
+
+    help = ('Share messages between the workers using this header instead '
+            'of the routing key.')
+    parser.add_argument('--partition_header', type=str, help=help)
+
+
+def ack(parser):
+    '''
+    Adds the acknowledgement mode.
+    '''
+    name = '--ack'
+    choices = ('yes', 'no')
+    help = ('Acknowledge messages once they have been flushed to disk, '
+            'acknowledging every message written since the last flush at '
+            'once. Unacknowledged messages are redelivered if the recorder '
+            'stops. Use with a larger --prefetch_count and --flush_every; '
+            '--flush_every cannot exceed --prefetch_count unless --flush_ms '
+            'is set. '
+            'A named --queue is kept when the recorder stops, so that no '
+            'messages are lost between runs.')
+    parser.add_argument(name, choices=choices, default='no', help=help)
+
+
+def binding(value):
+    '''
+    Parses an exchange:routing_key pair. The routing key follows the last
+    colon, and may be empty.
+    '''
+    exchange, colon, routing_key = value.rpartition(':')
+    if not colon or not exchange:
+        message = 'Bindings must be exchange:routing_key. %s provided.'
+        raise argparse.ArgumentTypeError(message % value)
+
+    return exchange, routing_key
+
+
+def bind(parser):
+    '''
+    Adds extra bindings.
+    '''
+    help = ('Also record messages from this exchange with this routing key. '
+            'Can be repeated; every binding shares one connection and queue, '
+            'and each message records the exchange it came from.')
+    parser.add_argument('--bind', type=binding, action='append', default=[],
+                        metavar='EXCHANGE:ROUTING_KEY', help=help)
+
+
 def prefetch(parser):
     '''
     Adds prefetch parameters.
@@ -96,6 +529,15 @@ def prefetch(parser):
     help = 'The prefetch message count.'
     parser.add_argument('--prefetch_count', type=int, default=1, help=help)
 
+    help = ('Tune the prefetch count between --prefetch_count and this '
+            'count as the queue fills and drains. Each change is reported '
+            'on stderr. 0 disables tuning.')
+    parser.add_argument('--prefetch_max', type=int, default=0, help=help)
+
+    help = 'The number of seconds between each prefetch tuning.'
+    parser.add_argument('--prefetch_interval', type=float, default=1.0,
+                        help=help)
+
 
 def amqp(routing_key, queue=False):
     '''
@@ -137,6 +579,13 @@ def amqp(routing_key, queue=False):
         help = 'The rabbitmq virtual host.'
         parser.add_argument('--virtual_host', type=str, default='/', help=help)
 
+        # Add transport parameters.
+        help = ('How to talk to rabbitmq. asyncio reads and writes the '
+                'socket on a background event loop, so that network I/O '
+                'overlaps with reading and writing recordings.')
+        parser.add_argument('--transport', type=str, default='blocking',
+                            choices=('blocking', 'asyncio'), help=help)
+
     return result
 
 
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import cProfile
+import contextlib
+import collections
+from amtk.utils import builtins
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# The most precise clock available.
+clock = time.perf_counter
+
+
+class Histogram(object):
+    '''
+    Counts durations in buckets that double in size, in microseconds. Bucket
+    k holds durations from 2 ** (k - 1) up to 2 ** k microseconds; bucket 0
+    holds anything under a microsecond.
+    '''
+    def __init__(self):
+        self.buckets = []
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        '''
+        Counts a duration.
+        '''
+        bucket = int(seconds * 1000000).bit_length()
+        while len(self.buckets) <= bucket:
+            self.buckets.append(0)
+
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        '''
+        Returns an upper bound, in microseconds, on the given fraction of the
+        durations.
+        '''
+        target = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target:
+                return 2 ** bucket
+
+        return 2 ** len(self.buckets)
+
+
+class Stage(object):
+    '''
+    Times a block of code into a histogram. A stage should only be timed by
+    one thread.
+    '''
+    def __init__(self):
+        self.histogram = Histogram()
+        self.start = None
+
+    def __enter__(self):
+        self.start = clock()
+
+    def __exit__(self, *args):
+        self.histogram.add(clock() - self.start)
+
+
+class Idle(object):
+    '''
+    Times nothing; used when profiling is off.
+    '''
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+# Shared by every stage while profiling is off.
+IDLE = Idle()
+
+# Marks the end of a timed iterable.
+END = object()
+
+
+class Profiler(object):
+    '''
+    Collects the time taken by each stage of a tool, such as decoding,
+    parsing timestamps, writing and publishing.
+    '''
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+
+    def stage(self, name):
+        '''
+        Returns a context manager that times the named stage.
+        '''
+        result = self.stages.get(name)
+        if result is None:
+            result = self.stages[name] = Stage()
+
+        return result
+
+    def report(self, title):
+        '''
+        Returns the lines of a report on the stages and peak memory.
+        '''
+        header = '%-12s %10s %10s %10s %10s %10s %10s'
+        row = '%-12s %10d %10.3f %10.1f %10s %10s %10.1f'
+        result = ['%s profile:' % title]
+        result.append(header % ('stage', 'count', 'total s', 'mean us',
+                                'p50 us', 'p99 us', 'max us'))
+
+        for name, stage in self.stages.items():
+            histogram = stage.histogram
+            if not histogram.count:
+                continue
+
+            mean = histogram.total / histogram.count * 1000000
+            result.append(row % (
+                name,
+                histogram.count,
+                histogram.total,
+                mean,
+                '<%d' % histogram.percentile(0.5),
+                '<%d' % histogram.percentile(0.99),
+                histogram.max * 1000000,
+            ))
+
+        # Each histogram, leaving out empty buckets.
+        for name, stage in self.stages.items():
+            buckets = [
+                '<%dus %d' % (2 ** bucket, count)
+                for bucket, count in enumerate(stage.histogram.buckets)
+                if count
+            ]
+            if buckets:
+                result.append('%s: %s' % (name, ', '.join(buckets)))
+
+        peak = memory()
+        if peak is not None:
+            result.append('peak memory: %.1f MB' % (peak / 1048576.0))
+
+        return result
+
+
+def memory():
+    '''
+    Returns the peak memory used by the process in bytes, or None if it
+    cannot be measured.
+    '''
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, and macOS bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# The profiler of the running tool, if it is being profiled.
+ACTIVE = None
+
+
+def stage(name):
+    '''
+    Returns a context manager that times the named stage of the running tool.
+    '''
+    if ACTIVE is None:
+        return IDLE
+
+    return ACTIVE.stage(name)
+
+
+def timed(name, iterable):
+    '''
+    Yields each item of iterable, timing how long each takes to produce as
+    the named stage.
+    '''
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            item = next(iterator, END)
+
+        if item is END:
+            return
+
+        yield item
+
+
+@contextlib.contextmanager
+def profile(args, title, dump=None):
+    '''
+    Profiles the block if --profile is given, and reports on stderr when the
+    block ends. If --profile_dump is given, cProfile runs too and its stats
+    are written to the file, or to dump if given.
+    '''
+    global ACTIVE
+
+    if not args.profile:
+        yield
+        return
+
+    ACTIVE = Profiler()
+    tracer = cProfile.Profile() if args.profile_dump else None
+
+    try:
+        if tracer is not None:
+            tracer.enable()
+
+        yield
+
+    finally:
+        if tracer is not None:
+            tracer.disable()
+            tracer.dump_stats(dump or args.profile_dump)
+
+        for line in ACTIVE.report(title):
+            builtins.print_error(line)
+
+        ACTIVE = None
+
+
+def worker(args):
+    '''
+    Returns the title and cProfile file of a worker process.
+    '''
+    pid = os.getpid()
+    dump = '%s.%d' % (args.profile_dump, pid) if args.profile_dump else None
+    return 'worker %d' % pid, dump
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import bisect
+from amtk.utils import time, misc, mapped
+
+
+# Indexes are kept next to the recording, with this extension appended.
+EXTENSION = '.idx'
+
+
+def moment(value):
+    '''
+    Returns a datetime from a command line timestamp. Timestamps without a
+    timezone are taken to be at UTC, like recorded timestamps.
+    '''
+    result = time.parse(value)
+    if result.tzinfo is None:
+        result = result.replace(tzinfo=time.UTC)
+
+    return result
+
+
+def path(file):
+    '''
+    Returns the path of the index for a file, or None if the file has no
+    path, such as stdin and stdout.
+    '''
+    name = getattr(file, 'name', None)
+    if not isinstance(name, str) or name.startswith('<'):
+        return None
+
+    return name + EXTENSION
+
+
+def dumps(date, offset, number):
+    '''
+    Encodes an index entry. number is the position of the message in the
+    recording, counting from 0.
+    '''
+    data = {
+        'record_time': date,
+        'offset': offset,
+        'message': number,
+    }
+    return json.dumps(data, sort_keys=True) + '\n'
+
+
+def load(file):
+    '''
+    Returns the (record time, offset, number) entries in the index of a file,
+    or None if it has no index or cannot be seeked.
+    '''
+    name = path(file)
+    if name is None or not os.path.exists(name) or not file.seekable():
+        return None
+
+    result = []
+    with open(name) as index:
+        for line in index:
+            data = json.loads(line)
+            date = time.parse(data['record_time'])
+            result.append((date, data['offset'], data['message']))
+
+    return result
+
+
+def save(file, entries):
+    '''
+    Writes the index entries of a file.
+    '''
+    with open(path(file), 'w') as index:
+        for date, offset, number in entries:
+            index.write(dumps(date.isoformat(), offset, number))
+
+
+def build(format, file, count):
+    '''
+    Returns the index entries of a recording, with an entry for every count
+    messages. Raises a ValueError if the recording is not in record order.
+    '''
+    parser = misc.optional(time.parse)
+    stream = format.stream(file)
+    result = []
+    if not format.begin(stream):
+        return result
+
+    records = format.records(stream)
+    number = 0
+    last = None
+    due = True
+    while True:
+        # Only look up the offset when an entry is due.
+        offset = stream.tell() if due else None
+        record = next(records, None)
+        if record is None:
+            break
+
+        try:
+            date = parser(format.loads(record).get('record_time'))
+        except ValueError:
+            date = None
+
+        # The entry goes to the first dated message once it is due.
+        if date is not None:
+            if last is not None and date < last:
+                raise ValueError('Message %d is out of order.' % number)
+            last = date
+
+            if due:
+                result.append((date, offset, number))
+                due = False
+
+        number += 1
+        if not number % count:
+            due = True
+
+    return result
+
+
+class Writer(object):
+    '''
+    Writes an index entry for every count messages as a recording is written.
+    '''
+    def __init__(self, file, count):
+        self.file = file
+        self.count = count
+
+        # The number of messages added so far.
+        self.number = 0
+
+    def add(self, date, tell):
+        '''
+        Adds a message with the given record time. tell returns the offset
+        of the message, and is only called when an entry is due.
+        '''
+        if not self.number % self.count:
+            self.file.write(dumps(date, tell(), self.number))
+
+        self.number += 1
+
+    def close(self):
+        '''
+        Closes the index.
+        '''
+        self.file.close()
+
+
+def window(format, file, start=None, end=None):
+    '''
+    Yields the records in a recording with a record time from start up to,
+    but not including, end. Undated records are left out. Regular files are
+    read through a memory map.
+
+    If the recording has an index, reading starts from the last entry before
+    start and stops at the first entry after end. Only the messages around
+    start and end are decoded; recordings with an index are in record order,
+    so those in between fall within the window.
+    '''
+    stream = mapped.view(format.stream(file))
+
+    try:
+        for record in select(format, file, stream, start, end):
+            yield record
+
+    finally:
+        mapped.close(stream)
+
+
+def select(format, file, stream, start, end):
+    '''
+    Yields the records read from the stream of a file that fall within the
+    window. See window.
+    '''
+    # Nothing to filter.
+    if start is None and end is None:
+        for record in format.read(stream):
+            yield record
+        return
+
+    parser = misc.optional(time.parse)
+
+    def date(record):
+        try:
+            return parser(format.loads(record).get('record_time'))
+        except ValueError:
+            return None
+
+    def inside(value):
+        after = start is None or value >= start
+        before = end is None or value < end
+        return value is not None and after and before
+
+    # Without an index, every message is checked.
+    entries = load(file)
+    if entries is None:
+        for record in format.read(stream):
+            if inside(date(record)):
+                yield record
+        return
+
+    if not format.begin(stream):
+        return
+
+    # Seek to the last entry before start.
+    times = [entry[0] for entry in entries]
+    number = 0
+    if start is not None:
+        position = bisect.bisect_left(times, start) - 1
+        if position >= 0:
+            offset, number = entries[position][1:]
+            stream.seek(offset)
+
+    # Messages are checked against end from the last entry before it, and
+    # none are read past the first entry after it.
+    limit = None
+    check = 0
+    if end is not None:
+        position = bisect.bisect_left(times, end)
+        if position < len(entries):
+            limit = entries[position][2]
+        if position > 0:
+            check = entries[position - 1][2]
+
+    started = start is None
+    for number, record in enumerate(format.records(stream), number):
+        if limit is not None and number >= limit:
+            return
+
+        # Messages between start and the end checks need no decoding.
+        if started and (end is None or number < check):
+            yield record
+            continue
+
+        # Skip to the first message in the window.
+        value = date(record)
+        if value is None or (not started and value < start):
+            continue
+        started = True
+
+        # Stop at the end of the window.
+        if end is not None and value >= end:
+            return
+
+        yield record
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import time
+from amtk.utils import builtins
+
+
+class Silent(object):
+    '''
+    Ignores everything; used when statistics are off.
+    '''
+    def add(self, size, lag=None):
+        pass
+
+    def skip(self):
+        pass
+
+    def since(self, timestamp):
+        return None
+
+    def check(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class Stats(object):
+    '''
+    Counts the messages a tool handles and reports every interval seconds.
+    Each report has the message and byte rates since the last report, the
+    totals so far, the number of invalid messages skipped and, where the
+    tool knows it, how far behind the timeline of the messages it is.
+
+    Reports are printed on stderr as text, or with the json style as one
+    json object per line.
+    '''
+    def __init__(self, interval, style='text', clock=time.time,
+                 output=builtins.print_error):
+        self.interval = interval
+        self.style = style
+        self.clock = clock
+        self.output = output
+
+        # The totals so far.
+        self.messages = 0
+        self.bytes = 0
+        self.invalid = 0
+
+        # The counts since the last report.
+        self.last = clock()
+        self.reset()
+
+    def reset(self):
+        '''
+        Starts a new report.
+        '''
+        self.window = {'messages': 0, 'bytes': 0}
+        self.lags = {'total': 0.0, 'count': 0, 'max': None}
+
+    def add(self, size, lag=None):
+        '''
+        Counts a message of size bytes, lag seconds behind its timeline.
+        '''
+        self.messages += 1
+        self.bytes += size
+        self.window['messages'] += 1
+        self.window['bytes'] += size
+
+        if lag is not None:
+            self.lags['total'] += lag
+            self.lags['count'] += 1
+            if self.lags['max'] is None or lag > self.lags['max']:
+                self.lags['max'] = lag
+
+        self.check()
+
+    def skip(self):
+        '''
+        Counts an invalid message.
+        '''
+        self.invalid += 1
+        self.check()
+
+    def since(self, timestamp):
+        '''
+        Returns the number of seconds since a unix timestamp, or None if
+        there is no timestamp.
+        '''
+        if timestamp is None:
+            return None
+
+        return self.clock() - timestamp
+
+    def check(self):
+        '''
+        Reports if a report is due.
+        '''
+        if self.clock() - self.last >= self.interval:
+            self.report()
+
+    def report(self):
+        '''
+        Prints a report and starts the next one.
+        '''
+        now = self.clock()
+        elapsed = now - self.last
+        data = {
+            'messages': self.messages,
+            'bytes': self.bytes,
+            'invalid': self.invalid,
+            'message_rate': self.rate(self.window['messages'], elapsed),
+            'byte_rate': self.rate(self.window['bytes'], elapsed),
+            'lag_mean': None,
+            'lag_max': self.lags['max'],
+        }
+        if self.lags['count']:
+            data['lag_mean'] = self.lags['total'] / self.lags['count']
+
+        self.output(self.dumps(data))
+        self.last = now
+        self.reset()
+
+    @staticmethod
+    def rate(count, elapsed):
+        return count / elapsed if elapsed > 0 else 0.0
+
+    def dumps(self, data):
+        '''
+        Formats a report.
+        '''
+        if self.style == 'json':
+            return json.dumps(data, sort_keys=True)
+
+        result = ('%(messages)d messages (%(message_rate).1f/s), %(bytes)d '
+                  'bytes (%(byte_rate).1f/s), %(invalid)d invalid')
+        result %= data
+        if data['lag_mean'] is not None:
+            lag = ', lag %(lag_mean).3fs mean, %(lag_max).3fs max'
+            result += lag % data
+
+        return result
+
+    def close(self):
+        '''
+        Prints the final report.
+        '''
+        self.report()
+
+
+def create(args):
+    '''
+    Returns the statistics selected by the command line arguments.
+    '''
+    if args.stats > 0:
+        return Stats(args.stats, args.stats_format)
+
+    return Silent()
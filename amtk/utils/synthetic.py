@@ -0,0 +1,367 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import random
+import string
+import datetime
+import collections
+from amtk.utils import time
+
+
+# Synthetic recordings start at this time unless told otherwise.
+START = datetime.datetime(2015, 1, 1, tzinfo=time.UTC)
+
+# The exchange synthetic messages are recorded from.
+EXCHANGE = 'synthetic'
+
+# The message ids and routing keys of synthetic messages.
+ID = 'synthetic-%d'
+ROUTING_KEY = 'synthetic.%d'
+
+# The number of messages generated at a time.
+BATCH = 10000
+
+
+def data(exchange, routing_key, message_id, created, recorded, body,
+         headers):
+    '''
+    Returns the data of a message, in the form record writes it.
+    '''
+    return {
+        'exchange': exchange,
+        'routing_key': routing_key,
+        'message_id': message_id,
+        'user_id': None,
+        'reply_to': None,
+        'correlation_id': None,
+        'content_type': 'text/plain',
+        'content_encoding': 'utf-8',
+        'absolute_expiry_time': None,
+        'creation_time': created,
+        'record_time': recorded,
+        'body': body,
+        'headers': headers,
+    }
+
+
+def body(number, size):
+    '''
+    Returns a body of size characters that starts with the message number.
+    '''
+    prefix = '%d:' % number
+    return (prefix + 'x' * max(size - len(prefix), 0))[:size]
+
+
+def headers(number, count):
+    '''
+    Returns count headers, or None if there are none; recordings store
+    missing headers as null.
+    '''
+    if count <= 0:
+        return None
+
+    return dict(('header_%d' % index, number) for index in range(count))
+
+
+def message(number, date, size=256, count=0):
+    '''
+    Returns the data of a message recorded at date, with a body of size
+    characters and count headers.
+    '''
+    # Creation times come from amqp timestamps, which are whole seconds.
+    return data(
+        EXCHANGE,
+        ROUTING_KEY % (number % 16),
+        ID % number,
+        date.replace(microsecond=0).isoformat(),
+        date.isoformat(),
+        body(number, size),
+        headers(number, count),
+    )
+
+
+def recording(count, size=256, headers=0, start=START, interval=0.001):
+    '''
+    Yields the data of count messages, recorded interval seconds apart from
+    start. See message.
+    '''
+    step = datetime.timedelta(seconds=interval)
+    for number in range(count):
+        yield message(number, start + number * step, size, headers)
+
+
+def constant(generator, rate, count, burst):
+    '''
+    Returns the gaps between messages that arrive exactly rate times a
+    second.
+    '''
+    return [1.0 / rate] * count
+
+
+def poisson(generator, rate, count, burst):
+    '''
+    Returns the gaps between messages that arrive independently, rate times
+    a second on average.
+    '''
+    draw = generator.expovariate
+    return [draw(rate) for number in range(count)]
+
+
+def bursty(generator, rate, count, burst):
+    '''
+    Returns the gaps between messages that arrive together in bursts of
+    burst messages on average. Bursts arrive independently, so that messages
+    still arrive rate times a second on average.
+    '''
+    draw = generator.expovariate
+    chance = generator.random
+    start = 1.0 / burst
+    return [
+        draw(rate * start) if chance() < start else 0.0
+        for number in range(count)
+    ]
+
+
+# The arrival processes.
+ARRIVALS = {
+    'constant': constant,
+    'poisson': poisson,
+    'bursty': bursty,
+}
+
+
+def fixed(generator, mean, count):
+    '''
+    Returns body sizes that are all mean bytes.
+    '''
+    return [mean] * count
+
+
+def uniform(generator, mean, count):
+    '''
+    Returns body sizes spread evenly from 0 to twice mean bytes.
+    '''
+    draw = generator.randint
+    return [draw(0, 2 * mean) for number in range(count)]
+
+
+def exponential(generator, mean, count):
+    '''
+    Returns body sizes that are mostly small with a long tail, mean bytes on
+    average.
+    '''
+    if mean <= 0:
+        return [0] * count
+
+    draw = generator.expovariate
+    rate = 1.0 / mean
+    return [int(draw(rate)) for number in range(count)]
+
+
+# The body size distributions.
+SIZES = {
+    'fixed': fixed,
+    'uniform': uniform,
+    'exponential': exponential,
+}
+
+
+class Generator(object):
+    '''
+    Generates count synthetic messages, for recordings larger than any that
+    have been captured. Messages arrive rate times a second following the
+    named arrival process, with bodies sized by the named distribution to
+    mean bytes on average. Routing keys are drawn from keys distinct keys,
+    and headers are rendered from (name, template) pairs; templates can use
+    the message {number}, routing {key} and {message_id}.
+
+    Messages are generated in batches a column at a time; the arrival times,
+    body sizes and routing keys of a whole batch are drawn before any message
+    is built. jsonl lines are rendered from a template of the line that only
+    has the fields that change filled in, which is much faster than encoding
+    every message. The same seed and batch size always generate the same
+    messages.
+    '''
+    def __init__(self, count, rate=1000.0, arrival='constant', burst=100,
+                 mean=256, sizes='fixed', keys=16, headers=(),
+                 exchange=EXCHANGE, start=START, seed=0):
+        self.count = count
+        self.rate = rate
+        self.arrival = ARRIVALS[arrival]
+        self.burst = burst
+        self.mean = mean
+        self.sizes = SIZES[sizes]
+        self.keys = [ROUTING_KEY % number for number in range(max(keys, 1))]
+        self.headers = collections.OrderedDict(headers)
+        self.exchange = exchange
+        self.start = time.timestamp(start) * 1000000 + start.microsecond
+        self.seed = seed
+
+    def columns(self, size=BATCH):
+        '''
+        Yields (number, keys, created, recorded, sizes) for each batch of up
+        to size messages. number is that of the first message in the batch,
+        keys are indexes into the routing keys, the times are formatted as
+        record writes them and sizes are in bytes.
+        '''
+        generator = random.Random(self.seed)
+        offset = 0.0
+        second = None
+
+        for number in range(0, self.count, size):
+            count = min(size, self.count - number)
+
+            # Draw the columns.
+            gaps = self.arrival(generator, self.rate, count, self.burst)
+            sizes = self.sizes(generator, self.mean, count)
+            draw = generator.random
+            total = len(self.keys)
+            keys = [int(draw() * total) for index in range(count)]
+
+            # Format the times. Messages arrive many times a second, so the
+            # formatted second is reused.
+            created = []
+            recorded = []
+            for gap in gaps:
+                moment = self.start + int(offset * 1000000)
+                offset += gap
+
+                whole, fraction = divmod(moment, 1000000)
+                if whole != second:
+                    second = whole
+                    date = time.EPOCH + datetime.timedelta(seconds=whole)
+                    prefix = date.strftime('%Y-%m-%dT%H:%M:%S')
+                    stamp = prefix + '+00:00'
+
+                created.append(stamp)
+                if fraction:
+                    recorded.append('%s.%06d+00:00' % (prefix, fraction))
+                else:
+                    recorded.append(stamp)
+
+            yield number, keys, created, recorded, sizes
+
+    def render(self, number, key):
+        '''
+        Returns the headers of a message, or None if there are none.
+        '''
+        if not self.headers:
+            return None
+
+        fields = {
+            'number': number,
+            'key': self.keys[key],
+            'message_id': ID % number,
+        }
+        return collections.OrderedDict(
+            (name, template.format(**fields))
+            for name, template in self.headers.items()
+        )
+
+    def messages(self, size=BATCH):
+        '''
+        Yields the data of each message.
+        '''
+        filler = ''
+        for number, keys, created, recorded, sizes in self.columns(size):
+            # Bodies are cut from a string of the largest size.
+            longest = max(sizes)
+            if longest > len(filler):
+                filler = 'x' * longest
+
+            for index, key in enumerate(keys):
+                yield data(
+                    self.exchange,
+                    self.keys[key],
+                    ID % (number + index),
+                    created[index],
+                    recorded[index],
+                    filler[:sizes[index]],
+                    self.render(number + index, key),
+                )
+
+    def template(self):
+        '''
+        Returns the template of a jsonl line, exactly as json.dumps encodes
+        the data of a message. The routing key and headers are filled in
+        with json, the message id with the message number, and the times and
+        body with their text.
+        '''
+        # Encode the message with markers for the fields that change, then
+        # swap the markers for placeholders.
+        markers = [u'\x00%d' % index for index in range(6)]
+        line = json.dumps(data(self.exchange, *markers)).replace('%', '%%')
+        placeholders = ('%s', json.dumps(ID), '"%s"', '"%s"', '"%s"', '%s')
+        for marker, placeholder in zip(markers, placeholders):
+            line = line.replace(json.dumps(marker), placeholder)
+
+        return line
+
+    def encoder(self):
+        '''
+        Returns a function of the message number and routing key index that
+        encodes the headers of a message, exactly as json.dumps would.
+        '''
+        if not self.headers:
+            return lambda number, key: 'null'
+
+        # Encode the headers with markers for the templates, then swap the
+        # markers for the templates encoded as json. Every field is plain
+        # text, so filling in the encoded templates gives valid json.
+        markers = [u'\x00%d' % index for index in range(len(self.headers))]
+        line = collections.OrderedDict(zip(self.headers, markers))
+        line = json.dumps(line).replace('{', '{{').replace('}', '}}')
+        for marker, template in zip(markers, self.headers.values()):
+            line = line.replace(json.dumps(marker), json.dumps(template))
+
+        # Headers that only use the routing key are encoded once per key.
+        names = set(
+            name
+            for template in self.headers.values()
+            for text, name, spec, conversion in string.Formatter().parse(
+                template
+            )
+            if name
+        )
+        if names <= set(['key']):
+            encoded = [line.format(key=key) for key in self.keys]
+            return lambda number, key: encoded[key]
+
+        def result(number, key):
+            return line.format(
+                number=number,
+                key=self.keys[key],
+                message_id=ID % number,
+            )
+
+        return result
+
+    def lines(self, size=BATCH):
+        '''
+        Yields the jsonl lines of each batch as one string, with a newline
+        after every line.
+        '''
+        template = self.template()
+        keys = [json.dumps(key) for key in self.keys]
+        headers = self.encoder()
+
+        filler = ''
+        for number, indexes, created, recorded, sizes in self.columns(size):
+            longest = max(sizes)
+            if longest > len(filler):
+                filler = 'x' * longest
+
+            lines = [
+                template % (
+                    keys[key],
+                    number + index,
+                    created[index],
+                    recorded[index],
+                    filler[:sizes[index]],
+                    headers(number + index, key),
+                )
+                for index, key in enumerate(indexes)
+            ]
+            lines.append('')
+            yield '\n'.join(lines)
@@ -4,13 +4,22 @@
 # Testing tools.
 from amtk.utils import testcase as unittest
 from mock import patch, MagicMock
-import StringIO
+import io
+import os
+import json
+import gzip
+import shutil
+import tempfile
 import datetime
-import pytz
+import random
 import argparse
+import threading
 
 # To be tested.
-from amtk.utils import options, messages, time, misc
+from amtk.utils import (
+    options, messages, time, misc, writers, dedup, formats, compress,
+    seek, mapped, transport, stats, profiler, synthetic, codec
+)
 
 
 class Options(unittest.TestCase):
@@ -75,13 +84,15 @@ class Options(unittest.TestCase):
                     'host': 'localhost',
                     'port': 5672,
                     'virtual_host': '/',
+                    'transport': 'blocking',
                 },
             },
             {
                 'test': ('test test --queue test --user user '
                          '--password password --host host --port 123 '
-                         '--virtual_host virtual_host'),
+                         '--virtual_host virtual_host --transport asyncio'),
                 'expected': {
+                    'transport': 'asyncio',
                     'queue': 'test',
                     'user': 'user',
                     'password': 'password',
@@ -139,13 +150,108 @@ class Options(unittest.TestCase):
                 'expected': {
                     'prefetch_size': 0,
                     'prefetch_count': 1,
+                    'prefetch_max': 0,
+                    'prefetch_interval': 1.0,
                 },
             },
             {
-                'test': '--prefetch_size 2 --prefetch_count 3',
+                'test': ('--prefetch_size 2 --prefetch_count 3 '
+                         '--prefetch_max 100 --prefetch_interval 0.5'),
                 'expected': {
                     'prefetch_size': 2,
                     'prefetch_count': 3,
+                    'prefetch_max': 100,
+                    'prefetch_interval': 0.5,
+                },
+            },
+        )
+
+        # Run the test.
+        parser = options.parse(description, parameters)
+        self.check_parser(parser, cases)
+
+    def test_flush(self):
+        '''
+        A test for the flush function.
+        '''
+        # Create test data.
+        description = 'test'
+        parameters = (options.flush, )
+
+        # Create test cases.
+        cases = (
+            {
+                'test': '',
+                'expected': {
+                    'flush_every': 1,
+                    'flush_ms': 0,
+                },
+            },
+            {
+                'test': '--flush_every 100 --flush_ms 250',
+                'expected': {
+                    'flush_every': 100,
+                    'flush_ms': 250,
+                },
+            },
+        )
+
+        # Run the test.
+        parser = options.parse(description, parameters)
+        self.check_parser(parser, cases)
+
+    def test_confirm(self):
+        '''
+        A test for the confirm function.
+        '''
+        # Create test data.
+        description = 'test'
+        parameters = (options.confirm, )
+
+        # Create test cases.
+        cases = (
+            {
+                'test': '',
+                'expected': {
+                    'confirm': 0,
+                    'confirm_timeout': 30,
+                },
+            },
+            {
+                'test': '--confirm 100 --confirm_timeout 1.5',
+                'expected': {
+                    'confirm': 100,
+                    'confirm_timeout': 1.5,
+                },
+            },
+        )
+
+        # Run the test.
+        parser = options.parse(description, parameters)
+        self.check_parser(parser, cases)
+
+    def test_workers(self):
+        '''
+        A test for the workers function.
+        '''
+        # Create test data.
+        description = 'test'
+        parameters = (options.workers, )
+
+        # Create test cases.
+        cases = (
+            {
+                'test': '',
+                'expected': {
+                    'workers': 1,
+                    'partition_header': None,
+                },
+            },
+            {
+                'test': '--workers 4 --partition_header key',
+                'expected': {
+                    'workers': 4,
+                    'partition_header': 'key',
                 },
             },
         )
@@ -174,6 +280,17 @@ class Options(unittest.TestCase):
                 'test': '--timing 0',
                 'expected': {
                     'timing': '0',
+                    'speed': 1.0,
+                    'max_gap': None,
+                },
+            },
+            {
+                'test': '--timing none --speed 24 --max_gap 5 --rate 1000',
+                'expected': {
+                    'timing': 'none',
+                    'speed': 24.0,
+                    'max_gap': 5.0,
+                    'rate': 1000.0,
                 },
             },
         )
@@ -226,7 +343,7 @@ class Options(unittest.TestCase):
         # TODO: For some reason, when this function is called by the nose
         # test runner for a writable file, the result is a StrioIO instance,
         # whose name cannot be directly tested.
-        if isinstance(result, StringIO.StringIO):
+        if isinstance(result, io.StringIO):
             return
 
         # Check the result.
@@ -259,26 +376,32 @@ class Options(unittest.TestCase):
         # Run the test.
         options.files(parser)
 
-    def test_order(self):
+    def test_engine(self):
         '''
-        A test for the order function.
+        A test for the engine function.
         '''
         # Create test data.
         description = 'test'
-        parameters = (options.order, )
+        parameters = (options.engine, )
 
         # Create test cases.
         cases = (
             {
                 'test': '',
                 'expected': {
-                    'order': 'record',
+                    'engine': 'memory',
                 },
             },
             {
-                'test': '--order created',
+                'test': '--engine stream',
                 'expected': {
-                    'order': 'created',
+                    'engine': 'stream',
+                },
+            },
+            {
+                'test': '--engine external',
+                'expected': {
+                    'engine': 'external',
                 },
             },
         )
@@ -287,148 +410,2027 @@ class Options(unittest.TestCase):
         parser = options.parse(description, parameters)
         self.check_parser(parser, cases)
 
-    def test_version(self):
+    def test_memory_limit(self):
         '''
-        A test for the version function. This function is difficult to test
-        because when parsed, because calling the parser immediately exits
-        the program after printing the version.
-
-        The SystemExit exception can be caught, but the test still pollutes
-        stdout when run.
+        A test for the memory_limit function.
         '''
         # Create test data.
-        parser = argparse.ArgumentParser(prog='test')
+        description = 'test'
+        parameters = (options.memory_limit, )
 
-        # Run the test.
-        options.version(parser)
+        # Create test cases.
+        cases = (
+            {
+                'test': '',
+                'expected': {
+                    'memory_limit': 256,
+                },
+            },
+            {
+                'test': '--memory_limit 16',
+                'expected': {
+                    'memory_limit': 16,
+                },
+            },
+        )
 
+        # Run the test.
+        parser = options.parse(description, parameters)
+        self.check_parser(parser, cases)
 
-class Messages(unittest.TestCase):
-    '''
-    Tests for functions in the messages module. These tests are fairly mocky.
-    '''
-    @patch('amtk.utils.messages.pika')
-    def test_connect(self, pika):
+    def test_dedup(self):
         '''
-        A test for the connect function for completion.
+        A test for the dedup function.
         '''
         # Create test data.
-        args = MagicMock()
-        args.user = 'user'
-        args.password = 'password'
-        args.host = 'host'
-        args.port = 123
-        args.virtual_host = 'vhost'
-        args.exchange = 'exchange'
+        description = 'test'
+        parameters = (options.dedup, )
 
-        # Run the test.
-        messages.connect(args)
+        # Create test cases.
+        cases = (
+            {
+                'test': '',
+                'expected': {
+                    'dedup': 'exact',
+                    'dedup_expected': 10000000,
+                },
+            },
+            {
+                'test': '--dedup disk --dedup_expected 100',
+                'expected': {
+                    'dedup': 'disk',
+                    'dedup_expected': 100,
+                },
+            },
+        )
 
-        # Check the result.
-        self.assertTrue(pika.credentials.PlainCredentials.called)
-        self.assertTrue(pika.ConnectionParameters.called)
-        self.assertTrue(pika.BlockingConnection.called)
+        # Run the test.
+        parser = options.parse(description, parameters)
+        self.check_parser(parser, cases)
 
-    @patch('amtk.utils.messages.pika')
-    def test_subscribe(self, pika):
+    def test_format(self):
         '''
-        A test for the subscribe function for completion.
+        A test for the format and convert functions.
         '''
         # Create test data.
-        channel = MagicMock()
-        args = MagicMock()
-        args.queue = 'queue'
-        args.exchange = 'exchange'
-        args.routing_key = 'routing_key'
+        description = 'test'
+        parameters = (options.format, options.convert)
 
-        # Run the test.
-        messages.subscribe(channel, args)
+        # Create test cases.
+        cases = (
+            {
+                'test': '',
+                'expected': {
+                    'format': 'jsonl',
+                    'to': 'binary',
+                },
+            },
+            {
+                'test': '--format binary --to jsonl',
+                'expected': {
+                    'format': 'binary',
+                    'to': 'jsonl',
+                },
+            },
+        )
 
-        # Check the result.
-        self.assertTrue(channel.queue_declare.called)
-        self.assertTrue(channel.queue_bind.called)
+        # Run the test.
+        parser = options.parse(description, parameters)
+        self.check_parser(parser, cases)
 
-    @patch('amtk.utils.messages.pika')
-    def test_qos(self, pika):
+    def test_codec(self):
         '''
-        A test for the qos function for completion.
+        A test for the codec and passthrough functions.
         '''
         # Create test data.
-        channel = MagicMock()
-        args = MagicMock()
-        args.prefetch_size = 2
-        args.prefetch_count = 3
-
-        # Run the test.
-        messages.qos(channel, args)
+        description = 'test'
+        parameters = (options.codec, options.passthrough)
 
-        # Check the result.
-        channel.basic_qos.assert_called_once_with(
-            prefetch_size=2,
-            prefetch_count=3,
+        # Create test cases.
+        cases = (
+            {
+                'test': '',
+                'expected': {
+                    'codec': 'auto',
+                    'passthrough': 'yes',
+                },
+            },
+            {
+                'test': '--codec json --passthrough no',
+                'expected': {
+                    'codec': 'json',
+                    'passthrough': 'no',
+                },
+            },
         )
 
+        # Run the test.
+        parser = options.parse(description, parameters)
+        self.check_parser(parser, cases)
 
-class Time(unittest.TestCase):
-    '''
-    Tests for functions in the time module.
-    '''
-    def test_server_time(self):
+    def test_compress(self):
         '''
-        A test for the server_time function.
+        A test for the compress function.
         '''
         # Create test data.
-        timestamp = 1421562419
+        description = 'test'
+        parameters = (options.compress, )
 
-        # Run the test.
-        result = time.server_time(timestamp)
+        # Create test cases.
+        cases = (
+            {
+                'test': '',
+                'expected': {
+                    'compress': 'auto',
+                },
+            },
+            {
+                'test': '--compress gzip',
+                'expected': {
+                    'compress': 'gzip',
+                },
+            },
+        )
 
-        # Check the result.
-        expected = '2015-01-18T06:26:59+00:00'
-        self.assertEqual(result, expected)
+        # Run the test.
+        parser = options.parse(description, parameters)
+        self.check_parser(parser, cases)
 
-    def test_server_time_none(self):
+    def test_index(self):
         '''
-        If no timestamp is given, the parser should return None.
+        A test for the index and window functions.
         '''
         # Create test data.
-        timestamp = None
+        description = 'test'
+        parameters = (options.index(default=10), options.window)
 
-        # Run the test.
-        result = time.server_time(timestamp)
+        # Create test cases.
+        cases = (
+            {
+                'test': '',
+                'expected': {
+                    'index_every': 10,
+                    'start': None,
+                    'end': None,
+                },
+            },
+            {
+                'test': '--index_every 5 --start 2015 --end 2016',
+                'expected': {
+                    'index_every': 5,
+                    'start': '2015',
+                    'end': '2016',
+                },
+            },
+        )
 
-        # Check the result.
-        self.assertIsNone(result)
+        # Run the test.
+        parser = options.parse(description, parameters)
+        self.check_parser(parser, cases)
 
-    def test_timestamp(self):
+    def test_bind(self):
         '''
-        A positive test for timestamp.
+        A test for the bind function.
         '''
         # Create test data.
-        value = datetime.datetime(2015, 1, 18, 17, 44, 24, 0, pytz.utc)
-
-        # Run the test.
-        result = time.timestamp(value)
-
-        # Check the result.
-        expected = 1421603064
-        self.assertEqual(result, expected)
+        description = 'test'
+        parameters = (options.bind, )
+
+        # Create test cases.
+        cases = (
+            {
+                'test': '',
+                'expected': {
+                    'bind': [],
+                },
+            },
+            {
+                'test': '--bind a:b.# --bind c: --bind d:e:f',
+                'expected': {
+                    'bind': [('a', 'b.#'), ('c', ''), ('d:e', 'f')],
+                },
+            },
+        )
+
+        # Run the test.
+        parser = options.parse(description, parameters)
+        self.check_parser(parser, cases)
+
+        # Bindings need an exchange and a colon.
+        for value in ('test', ':test'):
+            with self.assertRaises(SystemExit):
+                with patch('sys.stderr'):
+                    parser.parse_args(['--bind', value])
+
+    def test_header(self):
+        '''
+        A test for the header templates of the generate options.
+        '''
+        # Create test data.
+        description = 'test'
+        parameters = (options.generate, )
+
+        # Create test cases.
+        cases = (
+            {
+                'test': '',
+                'expected': {
+                    'header': [],
+                },
+            },
+            {
+                'test': '--header a=b --header c={key}-{number}= --header d=',
+                'expected': {
+                    'header': [('a', 'b'), ('c', '{key}-{number}='),
+                               ('d', '')],
+                },
+            },
+        )
+
+        # Run the test.
+        parser = options.parse(description, parameters)
+        self.check_parser(parser, cases)
+
+        # Headers need a name, an equals sign and known fields.
+        for value in ('test', '=test', 'a={other}', 'a={'):
+            with self.assertRaises(SystemExit):
+                with patch('sys.stderr'):
+                    parser.parse_args(['--header', value])
+
+    def test_ack(self):
+        '''
+        A test for the ack function.
+        '''
+        # Create test data.
+        description = 'test'
+        parameters = (options.ack, )
+
+        # Create test cases.
+        cases = (
+            {
+                'test': '',
+                'expected': {
+                    'ack': 'no',
+                },
+            },
+            {
+                'test': '--ack yes',
+                'expected': {
+                    'ack': 'yes',
+                },
+            },
+        )
+
+        # Run the test.
+        parser = options.parse(description, parameters)
+        self.check_parser(parser, cases)
+
+    def test_order(self):
+        '''
+        A test for the order function.
+        '''
+        # Create test data.
+        description = 'test'
+        parameters = (options.order, )
+
+        # Create test cases.
+        cases = (
+            {
+                'test': '',
+                'expected': {
+                    'order': 'record',
+                },
+            },
+            {
+                'test': '--order created',
+                'expected': {
+                    'order': 'created',
+                },
+            },
+        )
+
+        # Run the test.
+        parser = options.parse(description, parameters)
+        self.check_parser(parser, cases)
+
+    def test_version(self):
+        '''
+        A test for the version function. The version is only looked up when
+        it is asked for.
+        '''
+        # Create test data.
+        parser = argparse.ArgumentParser(prog='test')
+
+        # Run the test.
+        options.version(parser)
+        with patch('amtk.utils.options.installed') as installed:
+            installed.return_value = '1.2.3'
+            with patch('sys.stdout') as stdout:
+                with self.assertRaises(SystemExit):
+                    parser.parse_args(['--version'])
+
+        # Check the result.
+        installed.assert_called_once_with('amtk')
+        stdout.write.assert_called_once_with('test 1.2.3\n')
+
+
+class Messages(unittest.TestCase):
+    '''
+    Tests for functions in the messages module. These tests are fairly mocky.
+    '''
+    @patch('amtk.utils.messages.pika')
+    def test_connect(self, pika):
+        '''
+        A test for the connect function for completion.
+        '''
+        # Create test data.
+        args = MagicMock()
+        args.user = 'user'
+        args.password = 'password'
+        args.host = 'host'
+        args.port = 123
+        args.virtual_host = 'vhost'
+        args.exchange = 'exchange'
+
+        # Run the test.
+        messages.connect(args)
+
+        # Check the result.
+        self.assertTrue(pika.credentials.PlainCredentials.called)
+        self.assertTrue(pika.ConnectionParameters.called)
+        self.assertTrue(pika.BlockingConnection.called)
+
+    @patch('amtk.utils.messages.pika')
+    def test_subscribe(self, pika):
+        '''
+        A test for the subscribe function for completion.
+        '''
+        # Create test data.
+        channel = MagicMock()
+        args = MagicMock()
+        args.queue = 'queue'
+        args.exchange = 'exchange'
+        args.routing_key = 'routing_key'
+
+        # Run the test.
+        messages.subscribe(channel, args)
+
+        # Check the result.
+        self.assertTrue(channel.queue_declare.called)
+        self.assertTrue(channel.queue_bind.called)
+
+    def test_subscribe_bind(self):
+        '''
+        Extra bindings share the queue, and their exchanges are checked when
+        connecting.
+        '''
+        # Create test data.
+        channel = MagicMock()
+        args = MagicMock()
+        args.exchange = 'a'
+        args.routing_key = 'x'
+        args.bind = [('b', 'y'), ('a', 'z'), ('a', 'x')]
+
+        # Run the test.
+        queue = messages.subscribe(channel, args)
+
+        # Check the result.
+        bound = [
+            (kwargs['queue'], kwargs['exchange'], kwargs['routing_key'])
+            for name, positional, kwargs in channel.queue_bind.mock_calls
+        ]
+        expected = [(queue, 'a', 'x'), (queue, 'b', 'y'), (queue, 'a', 'z')]
+        self.assertEqual(bound, expected)
+        self.assertEqual(messages.exchanges(args), ['a', 'b'])
+
+    def test_subscribe_ack(self):
+        '''
+        Named queues outlive the subscriber when messages are acked.
+        '''
+        # Create test data.
+        channel = MagicMock()
+        args = MagicMock()
+        args.queue = 'queue'
+        args.ack = 'yes'
+
+        # Run the test.
+        messages.subscribe(channel, args)
+
+        # Check the result.
+        kwargs = channel.queue_declare.call_args[1]
+        self.assertTrue(kwargs['durable'])
+        self.assertFalse(kwargs['exclusive'])
+        self.assertFalse(kwargs['auto_delete'])
+
+    def test_adaptive(self):
+        '''
+        The prefetch count grows while messages are queued and shrinks when
+        the queue is idle, within its bounds.
+        '''
+        # Create test data.
+        channel = MagicMock()
+        clock = MagicMock(return_value=0.0)
+        adaptive = messages.Adaptive(channel, 'queue', 2, 8, clock=clock)
+        depths = (100, 100, 100, 0, 0, 0, 0)
+
+        # Run the test.
+        counts = []
+        for depth in depths:
+            channel.queue_declare.return_value.method.message_count = depth
+            clock.return_value += 1.0
+            adaptive.add()
+            adaptive.tune()
+            counts.append(adaptive.count)
+
+        # Check the result.
+        self.assertEqual(counts, [4, 8, 8, 4, 2, 2, 2])
+        self.assertEqual(channel.basic_qos.call_count, 4)
+        channel.queue_declare.assert_called_with(queue='queue', passive=True)
+        channel.basic_qos.assert_called_with(prefetch_size=0, prefetch_count=2)
+
+    def test_adaptive_change(self):
+        '''
+        Changes are described for logging.
+        '''
+        # Create test data.
+        channel = MagicMock()
+        channel.queue_declare.return_value.method.message_count = 50
+        clock = MagicMock(side_effect=[0.0, 2.0, 4.0])
+        adaptive = messages.Adaptive(channel, 'queue', 1, 10, clock=clock)
+
+        # Run the test.
+        for index in range(10):
+            adaptive.add()
+        result = adaptive.tune()
+
+        # Check the result.
+        expected = ('Prefetch count changed from 1 to 2; 50 messages queued, '
+                    '10 consumed at 5.0 messages per second.')
+        self.assertEqual(result, expected)
+
+    def test_acknowledged(self):
+        '''
+        Messages are acked in batches once they are stored, and only once.
+        '''
+        # Create test data.
+        channel = MagicMock()
+        acks = messages.Acknowledged(channel)
+
+        # Run the test.
+        acks.ack()
+        acks.add(1)
+        acks.add(2)
+        acks.store()
+        acks.add(3)
+        acks.ack()
+        acks.ack()
+
+        # Check the result.
+        channel.basic_ack.assert_called_once_with(delivery_tag=2,
+                                                  multiple=True)
+
+    @patch('amtk.utils.messages.pika')
+    def test_qos(self, pika):
+        '''
+        A test for the qos function for completion.
+        '''
+        # Create test data.
+        channel = MagicMock()
+        args = MagicMock()
+        args.prefetch_size = 2
+        args.prefetch_count = 3
+
+        # Run the test.
+        messages.qos(channel, args)
+
+        # Check the result.
+        channel.basic_qos.assert_called_once_with(
+            prefetch_size=2,
+            prefetch_count=3,
+        )
+
+
+class Confirmed(unittest.TestCase):
+    '''
+    Tests for the Confirmed channel wrapper.
+    '''
+    def frame(self, method, tag, multiple=False):
+        '''
+        Creates a fake ack or nack frame.
+        '''
+        result = MagicMock()
+        result.method = method(delivery_tag=tag, multiple=multiple)
+        return result
+
+    def publish(self, channel, *ids):
+        '''
+        Publishes fake messages with the given ids.
+        '''
+        for id in ids:
+            properties = MagicMock()
+            properties.message_id = id
+            channel.basic_publish(exchange='test', properties=properties)
+
+    def test_confirm(self):
+        '''
+        Acks and nacks, single and multiple, are tracked.
+        '''
+        # Create test data.
+        connection = MagicMock()
+        channel = MagicMock()
+        confirmed = messages.Confirmed(connection, channel, 10)
+        Ack = messages.pika.spec.Basic.Ack
+        Nack = messages.pika.spec.Basic.Nack
+
+        # Run the test.
+        self.publish(confirmed, 'a', 'b', 'c', 'd')
+        confirmed.confirm(self.frame(Ack, 2, multiple=True))
+        confirmed.confirm(self.frame(Nack, 4))
+
+        # Check the result.
+        channel._impl.confirm_delivery.assert_called_once_with(
+            confirmed.confirm
+        )
+        self.assertEqual(channel.basic_publish.call_count, 4)
+        self.assertEqual(confirmed.acked, 2)
+        self.assertEqual(confirmed.nacked, ['d'])
+        self.assertEqual(list(confirmed.pending.values()), ['c'])
+
+    def test_confirm_transport(self):
+        '''
+        Confirms are enabled through the channels of the asyncio transport.
+        '''
+        # Create test data.
+        connection = MagicMock()
+        channel = MagicMock(spec=transport.Channel)
+
+        # Run the test.
+        confirmed = messages.Confirmed(connection, channel, 10)
+
+        # Check the result.
+        channel.confirm_delivery.assert_called_once_with(confirmed.confirm)
+
+    def test_window(self):
+        '''
+        Publishing waits for confirms once the window is full.
+        '''
+        # Create test data.
+        connection = MagicMock()
+        channel = MagicMock()
+        confirmed = messages.Confirmed(connection, channel, 2)
+        Ack = messages.pika.spec.Basic.Ack
+
+        def process(time_limit):
+            confirmed.confirm(self.frame(Ack, confirmed.tag))
+
+        connection.process_data_events.side_effect = process
+
+        # Run the test.
+        self.publish(confirmed, 'a', 'b', 'c')
+
+        # Check the result.
+        self.assertEqual(connection.process_data_events.call_count, 1)
+        self.assertEqual(list(confirmed.pending.values()), ['a', 'c'])
+
+    def test_drain(self):
+        '''
+        Draining returns the nacked and unconfirmed messages.
+        '''
+        # Create test data.
+        connection = MagicMock()
+        channel = MagicMock()
+        confirmed = messages.Confirmed(connection, channel, 10)
+        Nack = messages.pika.spec.Basic.Nack
+        self.publish(confirmed, 'a', 'b')
+        confirmed.confirm(self.frame(Nack, 1))
+
+        # Run the test.
+        result = confirmed.drain(0)
+        confirmed.close()
+
+        # Check the result.
+        self.assertEqual(result, ['a', 'b'])
+        self.assertTrue(channel.close.called)
+
+
+class Time(unittest.TestCase):
+    '''
+    Tests for functions in the time module.
+    '''
+    def test_server_time(self):
+        '''
+        A test for the server_time function.
+        '''
+        # Create test data.
+        timestamp = 1421562419
+
+        # Run the test.
+        result = time.server_time(timestamp)
+
+        # Check the result.
+        expected = '2015-01-18T06:26:59+00:00'
+        self.assertEqual(result, expected)
+
+    def test_server_time_none(self):
+        '''
+        If no timestamp is given, the parser should return None.
+        '''
+        # Create test data.
+        timestamp = None
+
+        # Run the test.
+        result = time.server_time(timestamp)
+
+        # Check the result.
+        self.assertIsNone(result)
+
+    def test_timestamp(self):
+        '''
+        A positive test for timestamp.
+        '''
+        # Create test data.
+        value = datetime.datetime(2015, 1, 18, 17, 44, 24, 0, time.UTC)
+
+        # Run the test.
+        result = time.timestamp(value)
+
+        # Check the result.
+        expected = 1421603064
+        self.assertEqual(result, expected)
 
     @patch('amtk.utils.time.datetime')
     def test_now(self, _datetime):
         '''
-        A positive test for now, for completion.
+        A positive test for now, for completion.
+        '''
+        # Create fake data.
+        test = datetime.datetime(2015, 1, 1, tzinfo=time.UTC)
+        _datetime.datetime.now.return_value = test
+
+        # Run the test.
+        result = time.now()
+
+        # Check the result.
+        expected = '2015-01-01T00:00:00+00:00'
+        self.assertEqual(result, expected)
+
+    def test_parse(self):
+        '''
+        A positive test for parse with the server_time format.
+        '''
+        # Create test data.
+        value = '2015-01-18T06:26:59+00:00'
+
+        # Run the test.
+        result = time.parse(value)
+
+        # Check the result.
+        expected = datetime.datetime(2015, 1, 18, 6, 26, 59, 0, time.UTC)
+        self.assertEqual(result, expected)
+        self.assertIs(result.tzinfo, time.UTC)
+
+    def test_parse_fraction(self):
+        '''
+        Fractional seconds of any precision are supported.
+        '''
+        # Create test data.
+        cases = {
+            '2015-01-01T00:01:00.001+00:00': 1000,
+            '2015-01-01T00:01:00.123456+00:00': 123456,
+        }
+
+        for value, microsecond in cases.items():
+            # Run the test.
+            result = time.parse(value)
+
+            # Check the result.
+            expected = datetime.datetime(
+                2015, 1, 1, 0, 1, 0, microsecond, time.UTC
+            )
+            self.assertEqual(result, expected)
+
+    def test_parse_fallback(self):
+        '''
+        Other formats are parsed by dateutil.
+        '''
+        # Create test data.
+        value = '2015-01-18 11:26:59+05:00'
+
+        # Run the test.
+        result = time.parse(value)
+
+        # Check the result.
+        expected = datetime.datetime(2015, 1, 18, 6, 26, 59, 0, time.UTC)
+        self.assertEqual(result, expected)
+
+    def test_parse_invalid(self):
+        '''
+        Out of range values raise a ValueError.
+        '''
+        with self.assertRaises(ValueError):
+            time.parse('2015-13-18T06:26:59+00:00')
+
+    @patch('amtk.utils.time.CACHE_SIZE', 1)
+    @patch('amtk.utils.time.CACHE', {})
+    def test_parse_cache(self):
+        '''
+        Whole second timestamps are cached; the cache is bounded.
+        '''
+        # Run the test.
+        first = time.parse('2015-01-18T06:26:59+00:00')
+        second = time.parse('2015-01-18T06:26:59+00:00')
+        time.parse('2015-01-18T06:27:00+00:00')
+        time.parse('2015-01-18T06:27:00.5+00:00')
+
+        # Check the result.
+        self.assertIs(first, second)
+        self.assertEqual(list(time.CACHE), ['2015-01-18T06:27:00+00:00'])
+
+
+class Writers(unittest.TestCase):
+    '''
+    Tests for classes in the writers module.
+    '''
+    def test_buffered(self):
+        '''
+        The default buffer flushes every message.
+        '''
+        # Create test data.
+        file = MagicMock()
+        buffered = writers.Buffered(file)
+
+        # Run the test.
+        buffered.write('test')
+        buffered.flush()
+
+        # Check the result.
+        file.write.assert_called_once_with('test')
+        self.assertEqual(file.flush.call_count, 1)
+
+    def test_buffered_callback(self):
+        '''
+        The callback is called after every flush.
+        '''
+        # Create test data.
+        file = MagicMock()
+        callback = MagicMock()
+        buffered = writers.Buffered(file, count=2, callback=callback)
+
+        # Run the test.
+        for index in range(3):
+            buffered.write('test')
+            buffered.flush()
+        buffered.sync()
+
+        # Check the result.
+        self.assertEqual(callback.call_count, 2)
+
+    def test_durable(self):
+        '''
+        Compressed and plain files are written out before they are synced.
+        '''
+        for method in ('none', 'gzip'):
+            # Create test data.
+            with tempfile.NamedTemporaryFile('w') as file:
+                output = compress.output(file, method)
+                output.write(u'test')
+
+                # Run the test.
+                writers.durable(output)
+
+                # Check the result.
+                self.assertGreater(os.path.getsize(file.name), 0)
+
+    def test_durable_pipe(self):
+        '''
+        Files that cannot be synced are flushed.
+        '''
+        # Create test data.
+        file = MagicMock(spec=('flush', 'fileno'))
+        file.fileno.side_effect = io.UnsupportedOperation()
+
+        # Run the test.
+        writers.durable(file)
+
+        # Check the result.
+        self.assertTrue(file.flush.called)
+
+    def test_buffered_count(self):
+        '''
+        The buffer flushes once the count is reached.
+        '''
+        # Create test data.
+        file = MagicMock()
+        buffered = writers.Buffered(file, count=3)
+
+        # Run the test.
+        for index in range(5):
+            buffered.write('test')
+            buffered.flush()
+
+        # Check the result.
+        self.assertEqual(file.flush.call_count, 1)
+        self.assertEqual(buffered.pending, 2)
+
+    def test_buffered_interval(self):
+        '''
+        The buffer flushes once the oldest message is too old.
+        '''
+        # Create test data.
+        file = MagicMock()
+        clock = MagicMock(side_effect=(0.0, 0.5, 1.5))
+        buffered = writers.Buffered(file, count=100, interval=1, clock=clock)
+
+        # Run the test.
+        buffered.write('test')
+        buffered.flush()
+        self.assertFalse(file.flush.called)
+        buffered.flush()
+
+        # Check the result.
+        self.assertTrue(file.flush.called)
+        self.assertEqual(buffered.pending, 0)
+
+    def test_buffered_empty(self):
+        '''
+        An empty buffer is never due.
+        '''
+        # Create test data.
+        file = MagicMock()
+        buffered = writers.Buffered(file, count=1, interval=1)
+
+        # Run the test.
+        buffered.flush()
+
+        # Check the result.
+        self.assertFalse(file.flush.called)
+
+    def test_background(self):
+        '''
+        Items are written on the background thread, which idles while the
+        queue is empty.
+        '''
+        # Create test data.
+        written = []
+        idle = threading.Event()
+        background = writers.Background(
+            written.append, 10, idle=idle.set, interval=0.01
+        )
+
+        # Run the test.
+        for item in range(3):
+            background.put(item)
+        self.assertTrue(idle.wait(5))
+        background.close()
+
+        # Check the result.
+        self.assertEqual(written, [0, 1, 2])
+        self.assertFalse(background.thread.is_alive())
+        self.assertTrue(1 <= background.peak <= 3)
+        self.assertEqual(background.dropped, 0)
+
+    def test_background_drop(self):
+        '''
+        The drop policy drops items while the queue is full.
+        '''
+        # Create test data.
+        written = []
+        release = threading.Event()
+
+        def write(item):
+            release.wait(5)
+            written.append(item)
+
+        background = writers.Background(write, 1, 'drop')
+
+        # Run the test. The first item is taken by the thread and the second
+        # fills the queue.
+        results = [background.put(0)]
+        while background.queue.qsize():
+            pass
+        results += [background.put(item) for item in (1, 2, 3)]
+        release.set()
+        background.close()
+
+        # Check the result.
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(written, [0, 1])
+        self.assertEqual(background.dropped, 2)
+        self.assertEqual(background.peak, 1)
+
+    def test_background_error(self):
+        '''
+        Errors on the background thread are raised by the next put or close.
+        '''
+        # Create test data.
+        def write(item):
+            raise ValueError('test')
+
+        background = writers.Background(write, 10)
+
+        # Run the test.
+        background.put(0)
+        with self.assertRaises(IOError):
+            background.close()
+        with self.assertRaises(IOError):
+            background.put(1)
+
+    def test_segments(self):
+        '''
+        Segments are started once the current one is full or old enough,
+        and renamed once they are finished.
+        '''
+        # Create test data.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'recording.jsonl')
+        open(os.path.join(directory, 'recording.000000.jsonl'), 'w').close()
+        clock = MagicMock(side_effect=(0.0, 5.0, 10.0, 20.0, 30.0))
+        segments = writers.Segments(
+            path, formats.Jsonl, size=10, interval=10, count=1, clock=clock
+        )
+
+        # Run the test.
+        names = []
+        for record in ('1234567890\n', 'a\n', 'b\n', 'c\n'):
+            if segments.due():
+                segments.rotate()
+            names.append(os.path.basename(segments.final))
+            segments.add('date', segments.tell)
+            segments.write(record)
+        self.assertTrue(os.path.exists(segments.final + writers.PARTIAL))
+        segments.close()
+        segments.close()
+
+        # Check the result.
+        expected = [
+            'recording.000001.jsonl',
+            'recording.000002.jsonl',
+            'recording.000002.jsonl',
+            'recording.000003.jsonl',
+        ]
+        self.assertEqual(names, expected)
+        with open(os.path.join(directory, expected[1])) as file:
+            self.assertEqual(file.read(), 'a\nb\n')
+        index = os.path.join(directory, expected[3] + seek.EXTENSION)
+        self.assertTrue(os.path.exists(index))
+        self.assertFalse([name for name in os.listdir(directory)
+                          if name.endswith(writers.PARTIAL)])
+
+    def test_segments_compressed(self):
+        '''
+        Segments are compressed by their extension, and are not indexed.
+        '''
+        # Create test data.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'recording.gz')
+        segments = writers.Segments(path, formats.Jsonl, size=1, count=1)
+
+        # Run the test.
+        segments.add('date', segments.tell)
+        segments.write('test\n')
+        segments.close()
+
+        # Check the result.
+        with gzip.open(os.path.join(directory, 'recording.000000.gz')) as file:
+            self.assertEqual(file.read(), b'test\n')
+        self.assertEqual(len(os.listdir(directory)), 1)
+
+
+class Dedup(unittest.TestCase):
+    '''
+    Tests for classes in the dedup module.
+    '''
+    def check_index(self, index):
+        '''
+        Adds enough ids to the index to exercise growth and collisions.
+        '''
+        # Create test data.
+        ids = ['id %d' % value for value in range(2000)]
+
+        # Run the test.
+        first = [index.add(id) for id in ids]
+        second = [index.add(id) for id in ids[::2]]
+        index.close()
+
+        # Check the result.
+        self.assertTrue(all(first))
+        self.assertFalse(any(second))
+        self.assertEqual(index.duplicates, 1000)
+
+    def test_exact(self):
+        '''
+        A test for the Exact index.
+        '''
+        self.check_index(dedup.Exact())
+
+    def test_hashed(self):
+        '''
+        A test for the Hashed index. The table grows as ids are added.
+        '''
+        index = dedup.Hashed(capacity=8)
+        self.check_index(index)
+        self.assertEqual(len(index.table), 4096)
+
+    def test_disk(self):
+        '''
+        A test for the Disk index, with far more ids than expected.
+        '''
+        self.check_index(dedup.Disk(expected=100))
+
+    def test_digest(self):
+        '''
+        Digests are stable and fit in the requested width.
+        '''
+        # Run the test.
+        result = dedup.digest('test')
+
+        # Check the result.
+        self.assertEqual(result, dedup.digest(u'test'))
+        self.assertLess(result, 2 ** 64)
+
+    def test_create(self):
+        '''
+        A test for the create function.
+        '''
+        # Create test data.
+        args = MagicMock()
+        args.dedup_expected = 10
+        cases = {
+            'exact': dedup.Exact,
+            'hashed': dedup.Hashed,
+            'disk': dedup.Disk,
+        }
+
+        for name, expected in cases.items():
+            # Run the test.
+            args.dedup = name
+            result = dedup.create(args)
+
+            # Check the result.
+            self.assertIsInstance(result, expected)
+            result.close()
+
+
+class Formats(unittest.TestCase):
+    '''
+    Tests for classes in the formats module.
+    '''
+    def recording(self, *records):
+        '''
+        Writes a binary recording and returns it ready to be read.
+        '''
+        result = io.BytesIO()
+        formats.Binary.header(result)
+        for record in records:
+            formats.Binary.write(result, record)
+        result.seek(0)
+
+        return result
+
+    def test_binary(self):
+        '''
+        Binary records keep raw bodies and decode timestamps to datetimes.
+        '''
+        # Create test data.
+        data = {
+            'routing_key': u'r\xf6uting',
+            'message_id': '1',
+            'creation_time': '2015-01-18T06:27:00+00:00',
+            'record_time': '2015-01-18T06:27:00.000123+00:00',
+            'headers': {'test': 'test'},
+            'body': b'\x00\xff',
+        }
+
+        # Run the test.
+        result = formats.Binary.loads(formats.Binary.dumps(data))
+
+        # Check the result.
+        self.assertEqual(result['routing_key'], u'r\xf6uting')
+        self.assertEqual(result['message_id'], '1')
+        self.assertIsNone(result['exchange'])
+        self.assertIsNone(result['absolute_expiry_time'])
+        self.assertEqual(result['creation_time'], time.parse(
+            data['creation_time']))
+        self.assertEqual(result['record_time'].microsecond, 123)
+        self.assertEqual(result['headers'], {'test': 'test'})
+        self.assertEqual(result['body'], b'\x00\xff')
+
+    def test_binary_headers(self):
+        '''
+        Timestamps and byte arrays in headers are encoded as they are in
+        jsonl.
+        '''
+        # Create test data.
+        data = {
+            'headers': {
+                'time': time.parse('2015-01-18T06:27:00+00:00'),
+                'bytes': b'bytes',
+            },
+        }
+
+        self.addCleanup(codec.use, 'auto')
+
+        for name in codec.CODECS:
+            # Run the test.
+            codec.use(name)
+            result = formats.Binary.loads(formats.Binary.dumps(data))
+
+            # Check the result.
+            self.assertEqual(result['headers'], {
+                'time': '2015-01-18T06:27:00+00:00',
+                'bytes': 'bytes',
+            })
+
+    def test_encode_bytes(self):
+        '''
+        Bytes that aren't utf-8 are base64 encoded rather than replaced, and
+        decoded again before they're published or converted.
+        '''
+        # Create test data.
+        data = {
+            'headers': {'bytes': b'\xff', 'list': [b'\xfe'], 'text': b'a'},
+            'body': b'\x00\xff',
+        }
+
+        self.addCleanup(codec.use, 'auto')
+
+        for name in codec.CODECS:
+            # Run the test.
+            codec.use(name)
+            result = formats.Jsonl.loads(formats.Jsonl.dumps(data))
+            binary = formats.Binary.loads(formats.Binary.dumps(result))
+
+            # Check the result.
+            self.assertEqual(result['body'], {'base64': 'AP8='})
+            self.assertEqual(result['headers'], {
+                'bytes': {'base64': '/w=='},
+                'list': [{'base64': '/g=='}],
+                'text': 'a',
+            })
+            self.assertEqual(formats.decode(result['body']), b'\x00\xff')
+            self.assertEqual(formats.decode(result['headers']), {
+                'bytes': b'\xff',
+                'list': [b'\xfe'],
+                'text': 'a',
+            })
+            self.assertEqual(binary['body'], b'\x00\xff')
+
+    def test_binary_read(self):
+        '''
+        A truncated record ends the recording.
+        '''
+        # Create test data.
+        file = self.recording(b'first', b'second')
+        file = io.BytesIO(file.getvalue()[:-1])
+
+        # Run the test.
+        result = list(formats.Binary.read(file))
+
+        # Check the result.
+        self.assertEqual(result, [b'first'])
+
+    def test_binary_invalid(self):
+        '''
+        Files and records that are not binary recordings are rejected.
+        '''
+        # Run the test.
+        with self.assertRaises(ValueError):
+            list(formats.Binary.read(io.BytesIO(b'{"body": "body"}\n')))
+
+        with self.assertRaises(ValueError):
+            formats.Binary.loads(b'\x00')
+
+        # An empty file has no records.
+        self.assertEqual(list(formats.Binary.read(io.BytesIO())), [])
+
+    def test_jsonl(self):
+        '''
+        Datetimes and bytes are written as strings.
+        '''
+        # Create test data.
+        data = {
+            'record_time': time.parse('2015-01-18T06:27:00+00:00'),
+            'body': b'body',
+        }
+
+        # Run the test.
+        result = formats.Jsonl.loads(formats.Jsonl.dumps(data))
+
+        # Check the result.
+        expected = {
+            'record_time': '2015-01-18T06:27:00+00:00',
+            'body': 'body',
+        }
+        self.assertEqual(result, expected)
+
+    def test_original(self):
+        '''
+        Records are written again as they were read.
+        '''
+        # Create test data.
+        line = '{"body":  "body"}'
+
+        # Run the test.
+        text = formats.Jsonl.original(line + '\r\n')
+        raw = formats.Jsonl.original((line + '\n').encode('utf-8'))
+        binary = formats.Binary.original(b'\x00record')
+
+        # Check the result.
+        self.assertEqual(text, line)
+        self.assertEqual(raw, line)
+        self.assertEqual(binary, b'\x00record')
+
+
+class Codec(unittest.TestCase):
+    '''
+    Tests for functions in the codec module.
+    '''
+    def tearDown(self):
+        codec.use('auto')
+
+    def test_get(self):
+        '''
+        auto picks the fastest codec that is installed.
+        '''
+        # Run the test.
+        result = codec.get('auto')
+
+        # Check the result.
+        self.assertIs(codec.get('json'), codec.Json)
+        if 'orjson' in codec.CODECS:
+            self.assertIs(result, codec.Orjson)
+        else:
+            self.assertIs(result, codec.Json)
+
+    @patch.dict('amtk.utils.codec.CODECS', {'json': codec.Json}, clear=True)
+    def test_get_missing(self):
+        '''
+        Codecs that aren't installed are rejected.
+        '''
+        # Run the test.
+        self.assertIs(codec.get('auto'), codec.Json)
+        self.assertRaises(ValueError, codec.get, 'orjson')
+
+    def test_use(self):
+        '''
+        Every codec decodes what the others encode.
+        '''
+        # Create test data.
+        data = {'body': u'b\xf6dy', 'headers': {'count': 1}, 'id': None}
+
+        for name in codec.CODECS:
+            # Run the test.
+            codec.use(name)
+            result = codec.dumps(data)
+
+            # Check the result.
+            self.assertIs(codec.ACTIVE, codec.get(name))
+            self.assertEqual(json.loads(result), data)
+            self.assertEqual(codec.loads(json.dumps(data)), data)
+
+    def test_orjson(self):
+        '''
+        Messages that orjson can't encode are encoded by the standard
+        library.
+        '''
+        if 'orjson' not in codec.CODECS:
+            self.skipTest('orjson is not installed.')
+
+        # Create test data.
+        data = {'value': 2 ** 70, 'time': datetime.datetime(2015, 1, 1)}
+
+        # Run the test.
+        result = codec.Orjson.dumps(data, default=str)
+
+        # Check the result.
+        self.assertEqual(json.loads(result), {
+            'value': 2 ** 70,
+            'time': '2015-01-01 00:00:00',
+        })
+
+    def test_orjson_loads(self):
+        '''
+        Wide integers, NaN and Infinity are decoded as the standard library
+        decodes them.
+        '''
+        if 'orjson' not in codec.CODECS:
+            self.skipTest('orjson is not installed.')
+
+        # Create test data.
+        text = json.dumps({
+            'headers': {'wide': [2 ** 70, -2 ** 63 - 1], 'small': 1.5},
+            'body': 'body',
+        })
+
+        # Run the test.
+        wide = codec.Orjson.loads(text)
+        special = codec.Orjson.loads(b'{"nan": NaN, "inf": -Infinity}')
+
+        # Check the result.
+        self.assertEqual(wide, json.loads(text))
+        self.assertIsInstance(wide['headers']['wide'][0], int)
+        self.assertNotEqual(special['nan'], special['nan'])
+        self.assertEqual(special['inf'], float('-inf'))
+        self.assertRaises(ValueError, codec.Orjson.loads, '{invalid')
+        self.assertFalse(codec.wide({'headers': {'small': 1.5}}))
+
+
+class Compress(unittest.TestCase):
+    '''
+    Tests for the compress module.
+    '''
+    def file(self, data=b'', name=None):
+        '''
+        Returns a binary file that is not closed by the compressed files.
+        '''
+        result = io.BytesIO(data)
+        result.name = name
+        result.close = MagicMock()
+        return result
+
+    def test_output(self):
         '''
-        # Create fake data.
-        test = datetime.datetime(2015, 1, 1, tzinfo=pytz.utc)
-        _datetime.datetime.now.return_value = test
+        Text and binary data are compressed, and every method can read back
+        what it writes.
+        '''
+        for method in compress.METHODS:
+            # Create test data.
+            file = self.file()
+
+            # Run the test.
+            output = compress.output(file, method)
+            output.write(u'text\n')
+            output.flush()
+            output.buffer.write(b'\x00\xff')
+            output.close()
+            file.seek(0)
+            result = compress.input(io.BufferedReader(file), 'auto')
+
+            # Check the result.
+            self.assertEqual(result.buffer.read(), b'text\n\x00\xff')
+
+    def test_output_flush(self):
+        '''
+        gzip flushes reach the file before the stream ends.
+        '''
+        # Create test data.
+        file = self.file()
+        output = compress.output(file, 'gzip')
 
         # Run the test.
-        result = time.now()
+        output.write(u'text\n')
+        output.flush()
+        output.buffer.queue.join()
 
         # Check the result.
-        expected = '2015-01-01T00:00:00+00:00'
-        self.assertEqual(result, expected)
+        result = gzip.GzipFile(fileobj=io.BytesIO(file.getvalue()))
+        self.assertEqual(result.read1(5), b'text\n')
+        output.close()
+
+    def test_output_error(self):
+        '''
+        Errors on the compression thread are raised by the writer.
+        '''
+        # Create test data.
+        file = MagicMock(spec=('write', 'flush'))
+        file.write.side_effect = IOError('full')
+        output = compress.output(file, 'gzip')
+
+        # Run the test.
+        output.write(u'text\n')
+        output.flush()
+        with self.assertRaisesRegexp(IOError, 'full'):
+            output.close()
+
+    def test_detect(self):
+        '''
+        auto uses the extension of the file, and the start of inputs.
+        '''
+        # Create test data.
+        peekable = io.BufferedReader(self.file(b'\x1f\x8b\x08'))
+
+        # Check the result.
+        self.assertIs(compress.detect(self.file(name='a.gz'), 'auto'),
+                      compress.Gzip)
+        self.assertIs(compress.detect(self.file(name='a.BZ2'), 'auto'),
+                      compress.Bzip2)
+        self.assertIsNone(compress.detect(self.file(name='a.json'), 'auto'))
+        self.assertIsNone(compress.detect(self.file(), 'none'))
+        self.assertIs(compress.detect(self.file(), 'gzip'), compress.Gzip)
+        self.assertIs(compress.detect(peekable, 'auto', magic=True),
+                      compress.Gzip)
+        self.assertIsNone(compress.detect(peekable, 'auto'))
+
+    def test_input_plain(self):
+        '''
+        Files that are not compressed are returned as they are.
+        '''
+        # Create test data.
+        file = io.BufferedReader(self.file(b'text\n'))
+
+        # Run the test.
+        result = compress.input(file, 'auto')
+
+        # Check the result.
+        self.assertIs(result, file)
+
+
+class Seek(unittest.TestCase):
+    '''
+    Tests for the seek module.
+    '''
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def recording(self, format, count=100, name='recording'):
+        '''
+        Writes a recording with a message every second and returns its path.
+        '''
+        result = os.path.join(self.directory, name)
+        with open(result, 'w' + format.mode) as file:
+            format.header(file)
+            for number in range(count):
+                seconds = datetime.timedelta(seconds=number)
+                data = {
+                    'message_id': str(number),
+                    'record_time': (time.EPOCH + seconds).isoformat(),
+                }
+                format.write(file, format.dumps(data))
+
+        return result
+
+    def check_window(self, format, indexed):
+        '''
+        Reads a window of a recording.
+        '''
+        # Create test data.
+        name = '%s-%s' % (format.__name__, indexed)
+        name = self.recording(format, name=name)
+        if indexed:
+            with open(name) as file:
+                seek.save(file, seek.build(format, file, 10))
+
+        start = time.EPOCH + datetime.timedelta(seconds=25)
+        end = time.EPOCH + datetime.timedelta(seconds=62)
+
+        # Run the test.
+        with open(name) as file:
+            records = list(seek.window(format, file, start, end))
+
+        # Check the result.
+        result = [format.loads(record)['message_id'] for record in records]
+        self.assertEqual(result, [str(number) for number in range(25, 62)])
+
+    def test_window(self):
+        '''
+        Windows are read with and without an index, in both formats.
+        '''
+        for format in (formats.Jsonl, formats.Binary):
+            self.check_window(format, False)
+            self.check_window(format, True)
+
+    def test_window_all(self):
+        '''
+        Without a window, every record is read.
+        '''
+        # Create test data.
+        file = unittest.file(['{"message_id": "1"}\n', 'invalid\n'])
+
+        # Run the test.
+        result = list(seek.window(formats.Jsonl, file))
+
+        # Check the result.
+        self.assertEqual(len(result), 2)
+
+    def test_build(self):
+        '''
+        Entries point at the message they index.
+        '''
+        # Create test data.
+        name = self.recording(formats.Binary, 25)
+
+        # Run the test.
+        with open(name, 'rb') as file:
+            result = seek.build(formats.Binary, file, 10)
+
+        # Check the result.
+        self.assertEqual([entry[2] for entry in result], [0, 10, 20])
+        self.assertEqual(result[0][1], formats.HEADER.size)
+        self.assertEqual(result[2][0], time.parse('1970-01-01T00:00:20Z'))
+
+    def test_build_unordered(self):
+        '''
+        Recordings that are not in record order cannot be indexed.
+        '''
+        # Create test data.
+        file = unittest.file([
+            '{"record_time": "2015-01-01T00:00:01+00:00"}\n',
+            '{"record_time": "2015-01-01T00:00:00+00:00"}\n',
+        ])
+
+        # Run the test.
+        with self.assertRaisesRegexp(ValueError, 'Message 1'):
+            seek.build(formats.Jsonl, file, 10)
+
+    def test_writer(self):
+        '''
+        The Writer only asks for offsets when an entry is due.
+        '''
+        # Create test data.
+        file = MagicMock()
+        tell = MagicMock(return_value=0)
+        writer = seek.Writer(file, 2)
+
+        # Run the test.
+        for number in range(5):
+            writer.add('2015-01-01T00:00:00+00:00', tell)
+
+        # Check the result.
+        self.assertEqual(tell.call_count, 3)
+        self.assertEqual(file.write.call_count, 3)
+
+    def test_moment(self):
+        '''
+        Times without a timezone are at UTC.
+        '''
+        # Run the test.
+        result = seek.moment('2015-01-18T06:27:00')
+
+        # Check the result.
+        self.assertEqual(result, time.parse('2015-01-18T06:27:00+00:00'))
+        self.assertIsNone(seek.path(MagicMock()))
+
+
+class Mapped(unittest.TestCase):
+    '''
+    Tests for the mapped module.
+    '''
+    def test_view(self):
+        '''
+        Regular files are mapped from their current position.
+        '''
+        # Create test data.
+        with tempfile.TemporaryFile('w+') as file:
+            file.write('{"a": 1}\n{"b": 2}\n')
+            file.seek(0)
+            file.buffer.seek(9)
+
+            # Run the test.
+            result = mapped.view(file)
+            records = list(formats.Jsonl.records(result))
+            mapped.close(result)
+
+        # Check the result.
+        self.assertEqual(records, [b'{"b": 2}\n'])
+        self.assertTrue(result.closed)
+
+    def test_view_unmapped(self):
+        '''
+        Empty files and streams that are not regular files are not mapped.
+        '''
+        # Create test data.
+        empty = tempfile.TemporaryFile()
+        self.addCleanup(empty.close)
+        streams = (
+            empty,
+            io.BytesIO(b'test'),
+            compress.input(io.BufferedReader(io.BytesIO(b'\x1f\x8b')), 'auto'),
+            MagicMock(),
+        )
+
+        for stream in streams:
+            # Run the test.
+            result = mapped.view(stream)
+            mapped.close(result)
+
+            # Check the result.
+            self.assertIs(result, stream)
+
+
+class Transport(unittest.TestCase):
+    '''
+    Tests for the transport module. pika's asyncio connection is replaced
+    with one that replies to every method straight away, on the loop.
+    '''
+    def setUp(self):
+        if not transport.available():
+            self.skipTest('The asyncio transport is not available.')
+
+        # Remember the threads that callbacks are run on.
+        self.threads = []
+
+        def reply(**kwargs):
+            self.threads.append(threading.current_thread())
+            kwargs['callback'](MagicMock())
+
+        self.channel = MagicMock()
+        self.channel.is_open = True
+        for name in ('exchange_declare', 'queue_declare', 'queue_bind',
+                     'basic_qos'):
+            getattr(self.channel, name).side_effect = reply
+
+        def open(parameters, on_open_callback, custom_ioloop, **kwargs):
+            result = MagicMock()
+            result.is_closed = True
+            result.channel.side_effect = lambda on_open_callback: (
+                on_open_callback(self.channel)
+            )
+            custom_ioloop.call_soon(on_open_callback, result)
+            return result
+
+        patcher = patch('amtk.utils.transport.asyncio_connection')
+        self.adapter = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.adapter.AsyncioConnection.side_effect = open
+
+    def test_call(self):
+        '''
+        Methods the broker replies to run on the loop and wait for the reply.
+        '''
+        # Run the test.
+        connection = transport.Connection(MagicMock())
+        channel = connection.channel()
+        channel.queue_declare(queue='test', passive=True)
+        channel.basic_qos(prefetch_count=2)
+        connection.close()
+
+        # Check the result.
+        kwargs = self.channel.queue_declare.call_args[1]
+        self.assertEqual(kwargs['queue'], 'test')
+        self.assertTrue(self.channel.basic_qos.called)
+        self.assertNotIn(threading.current_thread(), self.threads)
+        self.assertFalse(connection.thread.is_alive())
+
+    def test_closed(self):
+        '''
+        Replies that are waited for fail if the broker closes the channel.
+        '''
+        # Create test data.
+        connection = transport.Connection(MagicMock())
+        self.addCleanup(connection.close)
+        channel = connection.channel()
+        self.channel.queue_declare.side_effect = (
+            lambda **kwargs: connection.closed(self.channel, 404, 'test')
+        )
+
+        # Run the test.
+        with self.assertRaises(IOError):
+            channel.queue_declare(queue='test', passive=True)
+
+    def test_closed_consuming(self):
+        '''
+        Consuming stops with an error if the broker closes the connection,
+        as it does with a blocking connection.
+        '''
+        # Create test data.
+        connection = transport.Connection(MagicMock())
+        self.addCleanup(connection.close)
+        channel = connection.channel()
+        self.channel.basic_consume.side_effect = (
+            lambda callback, **kwargs: connection.closed(None, 320, 'test')
+        )
+
+        # Run the test.
+        channel.basic_consume(MagicMock(), queue='test', no_ack=False)
+        start = profiler.clock()
+        with self.assertRaises(IOError):
+            channel.start_consuming()
+
+        # Check the result.
+        self.assertLess(profiler.clock() - start, 1)
+        self.assertRaises(IOError, channel.basic_ack, delivery_tag=1)
+        self.assertRaises(IOError, channel.basic_qos, prefetch_count=1)
+
+    def test_send_error(self):
+        '''
+        Errors raised on the loop by publishes are raised by the next method
+        that is used.
+        '''
+        # Create test data.
+        connection = transport.Connection(MagicMock())
+        self.addCleanup(connection.close)
+        channel = connection.channel()
+        self.channel.basic_publish.side_effect = ValueError('test')
+
+        # Run the test.
+        channel.basic_publish(exchange='test', routing_key='test', body='')
+        with self.assertRaises(ValueError):
+            connection.process_data_events(time_limit=1)
+
+        # Check the result.
+        with self.assertRaises(ValueError):
+            channel.basic_publish(exchange='test', routing_key='', body='')
+        self.assertEqual(self.channel.basic_publish.call_count, 1)
+
+    def test_consume(self):
+        '''
+        Deliveries and timeouts run on the thread that consumes, and acks
+        are sent from the loop.
+        '''
+        # Create test data.
+        connection = transport.Connection(MagicMock())
+        channel = connection.channel()
+        received = []
+
+        def consume(callback, **kwargs):
+            for tag in (1, 2):
+                callback(self.channel, tag, None, b'body')
+
+        self.channel.basic_consume.side_effect = consume
+
+        def callback(channel, method, properties, body):
+            received.append((threading.current_thread(), method))
+            channel.basic_ack(delivery_tag=method, multiple=True)
+
+        def stop():
+            received.append((threading.current_thread(), 'timeout'))
+            channel.stop_consuming()
+
+        # Run the test.
+        channel.basic_consume(callback, queue='test', no_ack=False)
+        connection.add_timeout(0.1, stop)
+        channel.start_consuming()
+        channel.close()
+        connection.close()
+
+        # Check the result.
+        thread = threading.current_thread()
+        expected = [(thread, 1), (thread, 2), (thread, 'timeout')]
+        self.assertEqual(received, expected)
+        self.channel.basic_ack.assert_called_with(
+            delivery_tag=2, multiple=True
+        )
+        self.assertTrue(self.channel.close.called)
+
+    def test_confirm(self):
+        '''
+        Publishes are sent from the loop, and confirms are handled when the
+        connection processes events.
+        '''
+        # Create test data.
+        connection = transport.Connection(MagicMock())
+        channel = connection.channel()
+        confirms = []
+
+        def publish(**kwargs):
+            self.channel.confirm_delivery.call_args[0][0]('frame')
+
+        self.channel.basic_publish.side_effect = publish
+
+        # Run the test.
+        channel.confirm_delivery(confirms.append)
+        channel.basic_publish(exchange='test', routing_key='test', body='')
+        connection.process_data_events(time_limit=1)
+        connection.close()
+
+        # Check the result.
+        self.assertEqual(confirms, ['frame'])
+
+
+class Stats(unittest.TestCase):
+    '''
+    Tests for the stats module.
+    '''
+    def test_stats(self):
+        '''
+        Rates are reported for each interval and totals for the whole run.
+        '''
+        # Create test data.
+        output = MagicMock()
+        clock = MagicMock(side_effect=(0.0, 1.0, 1.0, 1.5, 2.0, 2.0, 3.0, 4.0))
+        meter = stats.Stats(2, clock=clock, output=output)
+
+        # Run the test.
+        meter.add(100, meter.since(0.5))
+        meter.skip()
+        meter.add(50)
+        meter.add(10)
+        meter.close()
+
+        # Check the result.
+        expected = [
+            '2 messages (1.0/s), 150 bytes (75.0/s), 1 invalid, '
+            'lag 0.500s mean, 0.500s max',
+            '3 messages (0.5/s), 160 bytes (5.0/s), 1 invalid',
+        ]
+        reports = [call[0][0] for call in output.call_args_list]
+        self.assertEqual(reports, expected)
+
+    def test_stats_json(self):
+        '''
+        Reports can be printed as json.
+        '''
+        # Create test data.
+        output = MagicMock()
+        clock = MagicMock(side_effect=(0.0, 1.0, 1.0))
+        meter = stats.Stats(10, 'json', clock=clock, output=output)
+
+        # Run the test.
+        meter.add(10, 0.25)
+        meter.close()
+
+        # Check the result.
+        expected = {
+            'messages': 1,
+            'bytes': 10,
+            'invalid': 0,
+            'message_rate': 1.0,
+            'byte_rate': 10.0,
+            'lag_mean': 0.25,
+            'lag_max': 0.25,
+        }
+        self.assertEqual(json.loads(output.call_args[0][0]), expected)
+
+    def test_create(self):
+        '''
+        Statistics are only kept when an interval is given.
+        '''
+        # Create test data.
+        args = MagicMock()
+        args.stats = 0
+
+        # Run the test.
+        silent = stats.create(args)
+        args.stats = 1
+        result = stats.create(args)
+
+        # Check the result.
+        self.assertIsInstance(silent, stats.Silent)
+        self.assertIsInstance(result, stats.Stats)
+
+
+class Profiler(unittest.TestCase):
+    '''
+    Tests for the profiler module.
+    '''
+    def test_histogram(self):
+        '''
+        Durations are counted in buckets that double in size.
+        '''
+        # Create test data.
+        histogram = profiler.Histogram()
+
+        # Run the test.
+        for seconds in (0.0000005, 0.000003, 0.000003, 0.000003, 0.001):
+            histogram.add(seconds)
+
+        # Check the result.
+        self.assertEqual(histogram.buckets[:3], [1, 0, 3])
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.max, 0.001)
+        self.assertEqual(histogram.percentile(0.5), 4)
+        self.assertEqual(histogram.percentile(1.0), 1024)
+
+    def test_stage_idle(self):
+        '''
+        Nothing is timed unless a tool is being profiled.
+        '''
+        # Run the test.
+        with profiler.stage('test'):
+            pass
+        result = list(profiler.timed('test', 'ab'))
+
+        # Check the result.
+        self.assertIs(profiler.stage('test'), profiler.IDLE)
+        self.assertEqual(result, ['a', 'b'])
+
+    @patch('amtk.utils.profiler.builtins')
+    def test_profile(self, builtins):
+        '''
+        Stages are timed while profiling, reported at the end, and cProfile
+        stats are written if asked for.
+        '''
+        # Create test data.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        args = MagicMock()
+        args.profile = True
+        args.profile_dump = os.path.join(directory, 'test.prof')
+
+        # Run the test.
+        with profiler.profile(args, 'test'):
+            for item in profiler.timed('read', 'ab'):
+                with profiler.stage('decode'):
+                    pass
+
+        # Check the result.
+        lines = [call[0][0] for call in builtins.print_error.call_args_list]
+        self.assertEqual(lines[0], 'test profile:')
+        self.assertTrue(lines[2].startswith('read '))
+        self.assertIn(' 3 ', lines[2])
+        self.assertTrue(lines[3].startswith('decode '))
+        self.assertIn(' 2 ', lines[3])
+        self.assertTrue(os.path.getsize(args.profile_dump))
+        self.assertIsNone(profiler.ACTIVE)
+
+
+class Synthetic(unittest.TestCase):
+    '''
+    Tests for the synthetic module.
+    '''
+    def test_recording(self):
+        '''
+        Synthetic messages are sized as asked, in record order and can be
+        stored in either format.
+        '''
+        # Run the test.
+        result = list(synthetic.recording(3, size=10, headers=2))
+        bare = next(synthetic.recording(1, size=2))
+
+        # Check the result.
+        self.assertEqual(len(result), 3)
+        self.assertEqual(result[1]['body'], '1:xxxxxxxx')
+        self.assertEqual(result[2]['headers'], {'header_0': 2, 'header_1': 2})
+        self.assertEqual(result[0]['creation_time'],
+                         '2015-01-01T00:00:00+00:00')
+        self.assertEqual(result[1]['record_time'],
+                         '2015-01-01T00:00:00.001000+00:00')
+        self.assertEqual(bare['body'], '0:')
+        self.assertIsNone(bare['headers'])
+
+        for name in ('jsonl', 'binary'):
+            format = formats.get(name)
+            data = format.loads(format.dumps(result[2]))
+            self.assertEqual(data['message_id'], 'synthetic-2')
+            self.assertEqual(time.parse(data['record_time']),
+                             time.parse(result[2]['record_time']))
+
+
+    def test_generator(self):
+        '''
+        Rendered lines are exactly the encoded messages, and the same seed
+        generates the same messages.
+        '''
+        # Create test data.
+        headers = [('tenant', 't-{key}'), ('id', '"{message_id}"'),
+                   ('number', '{number}')]
+
+        # Run the test.
+        for sizes in synthetic.SIZES:
+            for arrival in synthetic.ARRIVALS:
+                generator = synthetic.Generator(
+                    25, 100.0, arrival, 5, 20, sizes, 3, headers, 'a%"', seed=1
+                )
+                lines = ''.join(generator.lines(size=10)).splitlines()
+                result = list(generator.messages(size=10))
+
+                # Check the result.
+                self.assertEqual(lines, [json.dumps(data) for data in result])
+                self.assertEqual(list(generator.messages(size=10)), result)
+
+        self.assertEqual(result[3]['message_id'], 'synthetic-3')
+        self.assertEqual(result[3]['headers']['id'], '"synthetic-3"')
+        self.assertEqual(result[3]['headers']['number'], '3')
+        self.assertEqual(len(set(data['routing_key'] for data in result)), 3)
+
+    def test_generator_times(self):
+        '''
+        Messages start at the start time and are recorded in order.
+        '''
+        # Create test data.
+        start = datetime.datetime(2015, 1, 1, 0, 0, 0, 500000, time.UTC)
+
+        # Run the test.
+        generator = synthetic.Generator(4, 4.0, start=start)
+        result = list(generator.messages())
+
+        # Check the result.
+        self.assertEqual([data['record_time'] for data in result], [
+            '2015-01-01T00:00:00.500000+00:00',
+            '2015-01-01T00:00:00.750000+00:00',
+            '2015-01-01T00:00:01+00:00',
+            '2015-01-01T00:00:01.250000+00:00',
+        ])
+        self.assertEqual(result[3]['creation_time'],
+                         '2015-01-01T00:00:01+00:00')
+        self.assertIsNone(result[0]['headers'])
+
+    def test_arrivals(self):
+        '''
+        Every arrival process averages the rate, and every size distribution
+        averages the mean.
+        '''
+        # Create test data.
+        generator = random.Random(0)
+
+        # Run the test.
+        for name, arrival in synthetic.ARRIVALS.items():
+            gaps = arrival(generator, 100.0, 20000, 10)
+            self.assertAlmostEqual(sum(gaps) / len(gaps), 0.01, places=3)
+
+        for name, sizes in synthetic.SIZES.items():
+            result = sizes(generator, 100, 20000)
+            self.assertAlmostEqual(sum(result) / 20000.0, 100, delta=3)
+            self.assertTrue(min(result) >= 0)
+
+        # Bursts arrive together.
+        gaps = synthetic.bursty(generator, 100.0, 1000, 10)
+        self.assertGreater(gaps.count(0.0), 800)
 
 
 class Misc(unittest.TestCase):
@@ -469,6 +2471,25 @@ class Misc(unittest.TestCase):
         with misc.suppress_interrupt():
             raise KeyboardInterrupt()
 
+    def test_lazy(self):
+        '''
+        Lazy modules are imported when an attribute is first used.
+        '''
+        # Create test data.
+        module = misc.Lazy('amtk.utils.misc')
+
+        # Run the test.
+        with patch('importlib.import_module') as load:
+            load.return_value = misc
+            first = module.optional
+            second = module.optional
+
+        # Check the result.
+        self.assertIs(first, misc.optional)
+        self.assertIs(second, misc.optional)
+        load.assert_called_once_with('amtk.utils.misc')
+        self.assertRaises(AttributeError, getattr, module, '__wrapped__')
+
 
 # Run the tests if the file is called directly.
 if __name__ == '__main__':
@@ -26,4 +26,6 @@ def file(lines):
     '''
     result = MagicMock()
     result.readlines.return_value = lines
+    result.__iter__.return_value = iter(lines)
+    result.readline.side_effect = list(lines) + ['']
     return result
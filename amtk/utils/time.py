@@ -1,12 +1,27 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import pytz
+import re
 import datetime
 
+# The utc timezone.
+UTC = datetime.timezone.utc
+
 
 # The datetime epoch obect.
-EPOCH = datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=UTC)
+
+# The format produced by server_time and now; for example
+# 2015-01-18T06:26:59+00:00 or 2015-01-18T06:26:59.000123+00:00.
+ISOFORMAT = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})'
+    r'(?:\.(\d{1,6}))?\+00:00$'
+)
+
+# Parsed timestamps that have no fractional seconds. These are usually
+# creation times, which repeat for every message created in the same second.
+CACHE = {}
+CACHE_SIZE = 4096
 
 
 def server_time(timestamp):
@@ -20,7 +35,7 @@ def server_time(timestamp):
     this function can be changed.
     '''
     parser = datetime.datetime.fromtimestamp
-    parse = lambda target: parser(target, tz=pytz.utc).isoformat()
+    parse = lambda target: parser(target, tz=UTC).isoformat()
     return None if timestamp is None else parse(timestamp)
 
 
@@ -35,4 +50,45 @@ def now():
     '''
     Returns a datetime now object at utc. For convenience.
     '''
-    return datetime.datetime.now(tz=pytz.utc).isoformat()
+    return datetime.datetime.now(tz=UTC).isoformat()
+
+
+def parse(value):
+    '''
+    Returns a datetime object from a timestamp string. Timestamps in the
+    format produced by server_time and now are parsed directly; anything else
+    is handed to dateutil. datetime objects are returned as they are.
+    '''
+    # Binary recordings store timestamps that are already parsed.
+    if isinstance(value, datetime.datetime):
+        return value
+
+    # Check the cache first.
+    result = CACHE.get(value)
+    if result is not None:
+        return result
+
+    # Fall back to dateutil for unusual formats. It is slow to import, so it
+    # is only imported when it is needed.
+    match = ISOFORMAT.match(value)
+    if match is None:
+        import dateutil.parser
+        return dateutil.parser.parse(value)
+
+    # Build the datetime from its parts.
+    parts = match.groups()
+    fraction = parts[6]
+    microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+    year, month, day, hour, minute, second = [int(part) for part in parts[:6]]
+    result = datetime.datetime(
+        year, month, day, hour, minute, second, microsecond, tzinfo=UTC
+    )
+
+    # Only whole seconds are worth caching. The cache is simply emptied when
+    # it fills up, since timestamps rarely repeat once they are in the past.
+    if not fraction:
+        if len(CACHE) >= CACHE_SIZE:
+            CACHE.clear()
+        CACHE[value] = result
+
+    return result
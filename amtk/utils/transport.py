@@ -0,0 +1,340 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import heapq
+import importlib
+import itertools
+import threading
+import queue as Queue
+from amtk.utils import misc
+
+
+# asyncio and pika are only imported once the transport is used.
+asyncio = misc.Lazy('asyncio')
+futures = misc.Lazy('concurrent.futures')
+asyncio_connection = misc.Lazy('pika.adapters.asyncio_connection')
+
+
+# The number of publishes and acks that can wait to be sent before senders
+# block.
+QUEUE_SIZE = 10000
+
+# The number of seconds to wait for the broker to reply to a method.
+TIMEOUT = 30
+
+
+def available():
+    '''
+    Returns True if the asyncio transport can be used. It requires a version
+    of pika with the asyncio adapter.
+    '''
+    try:
+        importlib.import_module('asyncio')
+        importlib.import_module('pika.adapters.asyncio_connection')
+    except ImportError:
+        return False
+
+    return True
+
+
+class Connection(object):
+    '''
+    Runs pika's asyncio connection on an event loop in a background thread,
+    behind the interface of a blocking connection. Reading and writing the
+    socket happens on the loop, so publishing and consuming never wait for
+    the network; the thread using the connection is left to read, parse and
+    write recordings.
+
+    Callbacks, such as consumers, confirms and timeouts, are handed back to
+    the thread using the connection, and are run while it consumes or
+    processes events; just like a blocking connection.
+    '''
+    def __init__(self, parameters, size=QUEUE_SIZE, timeout=TIMEOUT):
+        if not available():
+            raise RuntimeError('The asyncio transport requires pika with '
+                               'the asyncio adapter.')
+
+        self.timeout = timeout
+        self.slots = threading.Semaphore(size)
+
+        # Callbacks waiting to run on the thread using the connection, and
+        # the timeouts as (deadline, number, callback).
+        self.events = Queue.Queue()
+        self.timers = []
+        self.numbers = itertools.count()
+
+        # Replies that are being waited for, failed if the broker closes the
+        # connection or a channel.
+        self.pending = set()
+
+        # Why the connection failed, raised by the next method that is used;
+        # and whether it's being closed on purpose.
+        self.error = None
+        self.closing = False
+
+        # Start the event loop.
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        # Connect.
+        def connect(done):
+            return asyncio_connection.AsyncioConnection(
+                parameters,
+                on_open_callback=done,
+                on_open_error_callback=self.closed,
+                on_close_callback=self.closed,
+                custom_ioloop=self.loop,
+            )
+
+        self.connection = self.call(connect)
+
+    def check(self):
+        '''
+        Raises the error that the connection failed with, if it has failed.
+        '''
+        if self.error is not None:
+            raise self.error
+
+    def fail(self, error):
+        '''
+        Called on the loop when the connection fails. The error is raised on
+        the thread using the connection, as a blocking connection would.
+        '''
+        if self.error is None:
+            self.error = error
+
+        # Wake the thread using the connection, if it's waiting for events.
+        self.events.put((self.check, ()))
+
+    def call(self, function):
+        '''
+        Runs function on the loop with a callback, and waits for the callback
+        to be called. Returns the first argument given to the callback.
+        '''
+        self.check()
+        return self.wait(function)
+
+    def wait(self, function):
+        '''
+        Like call, but even once the connection has failed.
+        '''
+        future = futures.Future()
+
+        def done(result=None, *args):
+            self.pending.discard(future)
+            if not future.done():
+                future.set_result(result)
+
+        def run():
+            self.pending.add(future)
+            try:
+                function(done)
+            except Exception as error:
+                self.pending.discard(future)
+                future.set_exception(error)
+
+        self.loop.call_soon_threadsafe(run)
+        return future.result(self.timeout)
+
+    def send(self, function, *args, **kwargs):
+        '''
+        Runs function on the loop without waiting for it, once fewer than
+        size functions are waiting to run. If function raises, the error is
+        raised by the next method that is used.
+        '''
+        self.check()
+        self.slots.acquire()
+
+        def run():
+            try:
+                function(*args, **kwargs)
+            except Exception as error:
+                self.fail(error)
+            finally:
+                self.slots.release()
+
+        self.loop.call_soon_threadsafe(run)
+
+    def post(self, callback, *args):
+        '''
+        Called on the loop to run a callback on the thread using the
+        connection.
+        '''
+        self.events.put((callback, args))
+
+    def closed(self, connection, *reason):
+        '''
+        Called on the loop when the connection, or a channel, is closed or
+        fails to open. Fails any reply that is being waited for, and the
+        next method that is used, unless it was closed on purpose.
+        '''
+        if self.closing:
+            return
+
+        error = IOError('Closed by the broker: %s' % (reason, ))
+        for future in list(self.pending):
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+        self.fail(error)
+
+    def channel(self):
+        '''
+        Opens a channel. Many channels can be used at once.
+        '''
+        result = self.call(
+            lambda done: self.connection.channel(on_open_callback=done)
+        )
+        channel = Channel(self, result)
+
+        def closed(*reason):
+            if not channel.closing:
+                self.closed(*reason)
+
+        result.add_on_close_callback(closed)
+        return channel
+
+    def add_timeout(self, deadline, callback):
+        '''
+        Calls callback once deadline seconds have passed.
+        '''
+        timer = (time.time() + deadline, next(self.numbers), callback)
+        heapq.heappush(self.timers, timer)
+
+    def process_data_events(self, time_limit=0):
+        '''
+        Runs the callbacks that are due, waiting up to time_limit seconds for
+        one if there are none. Raises the error the connection failed with,
+        if it has failed.
+        '''
+        deadline = time.time() + time_limit
+        while True:
+            self.check()
+
+            # Run the timeouts that are due.
+            now = time.time()
+            while self.timers and self.timers[0][0] <= now:
+                heapq.heappop(self.timers)[2]()
+                now = time.time()
+
+            # Wait for a callback, or the next timeout.
+            wait = deadline
+            if self.timers:
+                wait = min(wait, self.timers[0][0])
+
+            try:
+                callback, args = self.events.get(timeout=max(wait - now, 0))
+            except Queue.Empty:
+                if time.time() >= deadline:
+                    return
+                continue
+
+            # Run it and everything else that has arrived.
+            while True:
+                callback(*args)
+                try:
+                    callback, args = self.events.get_nowait()
+                except Queue.Empty:
+                    return
+
+    def close(self):
+        '''
+        Closes the connection and stops the loop, even if it has failed.
+        '''
+        self.closing = True
+
+        def close(done):
+            if self.connection.is_closed:
+                return done()
+            self.connection.add_on_close_callback(done)
+            self.connection.close()
+
+        try:
+            self.wait(close)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+
+
+class Channel(object):
+    '''
+    A channel of a Connection, with the interface of a blocking channel.
+    Methods that the broker replies to wait for the reply. Publishes and
+    acks are only queued to be sent.
+    '''
+    def __init__(self, connection, channel):
+        self.connection = connection
+        self.channel = channel
+        self.consuming = False
+        self.closing = False
+
+    def call(self, method, **kwargs):
+        '''
+        Calls a method of the channel and waits for the reply.
+        '''
+        return self.connection.call(
+            lambda done: method(callback=done, **kwargs)
+        )
+
+    def exchange_declare(self, **kwargs):
+        return self.call(self.channel.exchange_declare, **kwargs)
+
+    def queue_declare(self, **kwargs):
+        return self.call(self.channel.queue_declare, **kwargs)
+
+    def queue_bind(self, **kwargs):
+        return self.call(self.channel.queue_bind, **kwargs)
+
+    def basic_qos(self, **kwargs):
+        return self.call(self.channel.basic_qos, **kwargs)
+
+    def basic_publish(self, **kwargs):
+        self.connection.send(self.channel.basic_publish, **kwargs)
+
+    def basic_ack(self, **kwargs):
+        self.connection.send(self.channel.basic_ack, **kwargs)
+
+    def basic_nack(self, **kwargs):
+        self.connection.send(self.channel.basic_nack, **kwargs)
+
+    def confirm_delivery(self, callback):
+        '''
+        Calls callback on the thread using the connection when the broker
+        acks or nacks a publish.
+        '''
+        def confirm(frame):
+            self.connection.post(callback, frame)
+
+        self.connection.send(self.channel.confirm_delivery, confirm)
+
+    def basic_consume(self, consumer_callback, **kwargs):
+        '''
+        Calls consumer_callback on the thread using the connection for every
+        message delivered.
+        '''
+        def deliver(channel, method, properties, body):
+            self.connection.post(
+                consumer_callback, self, method, properties, body
+            )
+
+        self.connection.send(self.channel.basic_consume, deliver, **kwargs)
+
+    def start_consuming(self):
+        '''
+        Runs callbacks until stop_consuming is called.
+        '''
+        self.consuming = True
+        while self.consuming:
+            self.connection.process_data_events(time_limit=1)
+
+    def stop_consuming(self):
+        self.consuming = False
+
+    def close(self):
+        self.closing = True
+        if self.channel.is_open:
+            self.connection.send(self.channel.close)
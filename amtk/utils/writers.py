@@ -0,0 +1,355 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import time
+import threading
+import queue as Queue
+from amtk.utils import compress, seek
+
+
+# Segments are written under this suffix until they are complete.
+PARTIAL = '.part'
+
+# Tells the background thread that nothing arrived in time.
+IDLE = object()
+
+
+class Buffered(object):
+    '''
+    Wraps an output file so that flushes happen in batches. The file is
+    flushed once count messages have been written, or once the oldest
+    unflushed message is older than interval seconds; whichever comes first.
+
+    With a count of 1, every message is flushed as soon as it is written.
+    If a callback is given, it's called after every flush.
+    '''
+    def __init__(self, file, count=1, interval=0, clock=time.time,
+                 callback=None):
+        self.file = file
+        self.count = count
+        self.interval = interval
+        self.clock = clock
+        self.callback = callback
+
+        # The number of messages written since the last flush, and the time
+        # the first of those messages was written.
+        self.pending = 0
+        self.oldest = None
+
+    def write(self, data):
+        '''
+        Writes data to the file without flushing it.
+        '''
+        if not self.pending:
+            self.oldest = self.clock()
+
+        self.file.write(data)
+        self.pending += 1
+
+    def tell(self):
+        '''
+        Returns the position in the file.
+        '''
+        return self.file.tell()
+
+    def due(self):
+        '''
+        Returns True if the pending messages should be flushed.
+        '''
+        # Nothing to flush.
+        if not self.pending:
+            return False
+
+        # Too many messages.
+        if self.pending >= self.count:
+            return True
+
+        # Messages too old.
+        age = self.clock() - self.oldest
+        return self.interval > 0 and age >= self.interval
+
+    def flush(self):
+        '''
+        Flushes the file if the pending messages are due.
+        '''
+        if self.due():
+            self.sync()
+
+    def sync(self):
+        '''
+        Flushes the file regardless of the pending messages.
+        '''
+        self.file.flush()
+        self.pending = 0
+        self.oldest = None
+
+        if self.callback is not None:
+            self.callback()
+
+
+def durable(file):
+    '''
+    Flushes a file and waits for its data to reach the disk, including data
+    that is being compressed on a background thread. Files that cannot be
+    synced, such as pipes, are only flushed.
+    '''
+    file.flush()
+
+    # Wait for background compression.
+    binary = getattr(file, 'buffer', file)
+    join = getattr(binary, 'join', None)
+    if join is not None:
+        join()
+        binary = binary.file
+
+    try:
+        os.fsync(binary.fileno())
+
+    except (EnvironmentError, ValueError, io.UnsupportedOperation):
+        pass
+
+
+class Segments(object):
+    '''
+    Writes a recording as a series of segment files. A new segment is started
+    once the current one holds size bytes, before compression, or once its
+    first message is interval seconds old; whichever comes first. 0 disables
+    either limit.
+
+    Segments are numbered from the path; capture.jsonl is written as
+    capture.000000.jsonl, capture.000001.jsonl and so on, after any segments
+    already there. Each segment, and its index, is written with a .part
+    suffix and renamed once it is complete and on disk, so segments without
+    the suffix can be read while recording continues.
+    '''
+    def __init__(self, path, format, method='auto', size=0, interval=0,
+                 count=0, clock=time.time):
+        self.path = path
+        self.format = format
+        self.method = method
+        self.size = size
+        self.interval = interval
+        self.count = count
+        self.clock = clock
+
+        self.number = self.free(0)
+        self.file = None
+        self.open()
+
+    def name(self, number):
+        '''
+        Returns the name of a segment.
+        '''
+        root, extension = os.path.splitext(self.path)
+        return '%s.%06d%s' % (root, number, extension)
+
+    def free(self, number):
+        '''
+        Returns the first segment number from number that is not in use.
+        '''
+        while (os.path.exists(self.name(number)) or
+               os.path.exists(self.name(number) + PARTIAL)):
+            number += 1
+
+        return number
+
+    def open(self):
+        '''
+        Starts the current segment.
+        '''
+        self.final = self.name(self.number)
+        self.raw = open(self.final + PARTIAL, 'w')
+        self.file = compress.output(self.raw, self.method, self.final)
+        self.stream = self.format.stream(self.file)
+        self.format.header(self.stream)
+
+        # Offsets are only meaningful in plain files.
+        self.index = None
+        if self.count > 0 and self.file is self.raw:
+            name = self.final + seek.EXTENSION + PARTIAL
+            self.index = seek.Writer(open(name, 'w'), self.count)
+
+        # The bytes written, and when the first message was written.
+        self.written = 0
+        self.started = None
+
+    def write(self, data):
+        '''
+        Writes a record to the current segment.
+        '''
+        if not self.written:
+            self.started = self.clock()
+
+        self.stream.write(data)
+        self.written += len(data)
+
+    def add(self, date, tell):
+        '''
+        Adds a message to the index of the current segment. See seek.Writer.
+        '''
+        if self.index is not None:
+            self.index.add(date, tell)
+
+    def tell(self):
+        '''
+        Returns the position in the current segment.
+        '''
+        return self.stream.tell()
+
+    def flush(self):
+        self.stream.flush()
+
+    def due(self):
+        '''
+        Returns True if the next message should start a new segment. Empty
+        segments are never finished early.
+        '''
+        if not self.written:
+            return False
+
+        # Too big.
+        if self.size > 0 and self.written >= self.size:
+            return True
+
+        # Too old.
+        if self.interval <= 0:
+            return False
+
+        return self.clock() - self.started >= self.interval
+
+    def remaining(self):
+        '''
+        Returns the number of seconds until the current segment is due by
+        age.
+        '''
+        if not self.written:
+            return self.interval
+
+        return max(self.started + self.interval - self.clock(), 0)
+
+    def finish(self):
+        '''
+        Completes the current segment, and its index, on disk and renames
+        them.
+        '''
+        durable(self.file)
+        self.file.close()
+        self.raw.close()
+
+        if self.index is not None:
+            self.index.close()
+            name = self.final + seek.EXTENSION
+            os.rename(name + PARTIAL, name)
+
+        os.rename(self.final + PARTIAL, self.final)
+        self.file = None
+
+    def rotate(self):
+        '''
+        Finishes the current segment and starts the next.
+        '''
+        self.finish()
+        self.number = self.free(self.number + 1)
+        self.open()
+
+    def close(self):
+        '''
+        Finishes the last segment, unless it is already finished.
+        '''
+        if self.file is not None:
+            self.finish()
+
+
+class Background(object):
+    '''
+    Calls function with each item put on a bounded queue, on a background
+    thread, so that whoever puts items never waits for the disk unless the
+    queue is full. When it is, the block policy waits for room and the drop
+    policy drops the item. idle is called whenever no item arrives for
+    interval seconds.
+
+    Errors raised on the thread are raised by the next put or close. The
+    deepest the queue has been, and the number of items dropped, are kept
+    for reporting.
+    '''
+    def __init__(self, function, size, policy='block', idle=None,
+                 interval=1.0):
+        self.function = function
+        self.queue = Queue.Queue(size)
+        self.size = size
+        self.policy = policy
+        self.idle = idle
+        self.interval = interval
+        self.error = None
+
+        self.peak = 0
+        self.dropped = 0
+
+        # Start writing.
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def check(self):
+        '''
+        Raises any error from the background thread.
+        '''
+        if self.error is not None:
+            raise IOError('Writing failed: %s' % self.error)
+
+    def put(self, item):
+        '''
+        Queues an item. Returns False if it was dropped.
+        '''
+        self.check()
+
+        if self.policy == 'drop':
+            try:
+                self.queue.put_nowait(item)
+            except Queue.Full:
+                self.dropped += 1
+                return False
+        else:
+            self.queue.put(item)
+
+        self.peak = max(self.peak, self.queue.qsize())
+        return True
+
+    def close(self):
+        '''
+        Waits for the queued items to be written and stops the thread.
+        '''
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+        self.check()
+
+    def run(self):
+        '''
+        Writes queued items until the writer is closed.
+        '''
+        while True:
+            try:
+                item = self.queue.get(timeout=self.interval)
+            except Queue.Empty:
+                item = IDLE
+
+            if item is None:
+                return
+
+            # Drain the queue after an error, so that put never blocks.
+            if self.error is not None:
+                continue
+
+            try:
+                if item is IDLE:
+                    if self.idle is not None:
+                        self.idle()
+                else:
+                    self.function(item)
+
+            except Exception as error:
+                self.error = error
@@ -38,11 +38,13 @@ setup(
     download_url=download_url % version,
     packages=find_packages(),
     install_requires=[
-        'setuptools',
         'pika',
-        'pytz',
         'python-dateutil',
     ],
+    python_requires='>=3.8',
+    extras_require={
+        'fast': ['orjson'],
+    },
     tests_require=[
         'mock',
         'nose',
@@ -53,6 +55,10 @@ setup(
             'amtk.play = amtk.apps.play:main',
             'amtk.record = amtk.apps.record:main',
             'amtk.merge = amtk.apps.merge:main',
+            'amtk.convert = amtk.apps.convert:main',
+            'amtk.index = amtk.apps.index:main',
+            'amtk.benchmark = amtk.apps.benchmark:main',
+            'amtk.generate = amtk.apps.generate:main',
         ],
     },
 )